@@ -0,0 +1,222 @@
+import logging
+import os
+import sys
+import warnings
+
+warnings.filterwarnings("ignore")
+
+
+def setup_logging():
+    if getattr(sys, "frozen", False):
+        # If the application is run as a bundle, use the AppData directory
+        log_dir = os.path.join(
+            os.path.expanduser("~"),
+            "AppData",
+            "Roaming",
+            "Ace Centre",
+            "AACSpeakHelper",
+        )
+    else:
+        # If run from a Python environment, use the current directory
+        log_dir = os.path.dirname(os.path.abspath(__file__))
+
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    log_file = os.path.join(log_dir, "app.log")
+
+    logging.basicConfig(
+        filename=log_file,
+        filemode="a",
+        format="%(asctime)s — %(name)s — %(levelname)s — %(funcName)s:%(lineno)d — %(message)s",
+        level=logging.DEBUG,
+    )
+
+    return log_file
+
+
+logfile = setup_logging()
+
+import argparse
+import asyncio
+import signal
+import request_handler
+import utils
+from http_api import HTTP_PORT
+from pipe_server import (
+    HANDLER_WORKERS,
+    PIPE_INSTANCES,
+    WARMUP,
+    WARMUP_PROBE,
+    PipeServer,
+)
+from request_queue import COALESCE_WINDOW, POLICIES, QUEUE_POLICY, QUEUE_SIZE
+
+# Seconds between two runs of the audio cache cleaner
+CACHE_CLEAN_INTERVAL = 24 * 60 * 60
+
+
+class SpeakDaemon:
+    """Headless AACSpeakHelper server built on asyncio, without Qt or the tray.
+
+    PipeServer accepts clients on its own threads and dispatches each request to
+    the event loop, where it runs as a task.
+    """
+
+    def __init__(
+        self,
+        instances=PIPE_INSTANCES,
+        workers=HANDLER_WORKERS,
+        transport_kind=None,
+        address=None,
+        http_port=HTTP_PORT,
+        queue_size=QUEUE_SIZE,
+        queue_policy=QUEUE_POLICY,
+        coalesce_window=COALESCE_WINDOW,
+        warmup=WARMUP,
+        warmup_probe=WARMUP_PROBE,
+    ):
+        self.server = PipeServer(
+            self.dispatch,
+            instances,
+            workers,
+            transport_kind,
+            address,
+            http_port,
+            queue_size,
+            queue_policy,
+            coalesce_window,
+            warmup,
+            warmup_probe,
+        )
+        self.loop = None
+        self.tasks = set()
+
+    def dispatch(self, message):
+        # Called from the PipeServer handler threads
+        self.loop.call_soon_threadsafe(self.start_task, message)
+
+    def start_task(self, message):
+        task = self.loop.create_task(self.handle_request(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle_request(self, message):
+        # The scheduler hands over one foreground request at a time, and background
+        # work runs alongside it only when it started while the foreground was idle
+        try:
+            result = await asyncio.to_thread(request_handler.process_request, message)
+        except Exception as e:
+            logging.error(f"Error handling message: {e}", exc_info=True)
+            self.server.complete(message["id"], error=e)
+            return
+        self.server.complete(message["id"], result)
+
+    async def clean_cache(self):
+        while True:
+            await asyncio.sleep(CACHE_CLEAN_INTERVAL)
+            if utils.config is not None:
+                await asyncio.to_thread(
+                    utils.remove_stale_temp_files, utils.audio_files_path
+                )
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Only available in the main thread and not on Windows, where
+                # Ctrl+C still cancels run()
+                pass
+        cleaner = asyncio.create_task(self.clean_cache())
+        logging.info("AACSpeakHelper daemon started.")
+        try:
+            await asyncio.to_thread(self.server.serve_forever)
+        finally:
+            self.stop()
+            cleaner.cancel()
+            logging.info("AACSpeakHelper daemon stopped.")
+
+    def stop(self):
+        self.server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AACSpeakHelper headless server")
+    parser.add_argument(
+        "--instances",
+        type=int,
+        help="Number of pipe instances listening for clients",
+        default=PIPE_INSTANCES,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of connections handled in parallel",
+        default=HANDLER_WORKERS,
+    )
+    parser.add_argument(
+        "--transport",
+        help="'pipe' or 'unix', defaults to the platform transport",
+        default=None,
+    )
+    parser.add_argument(
+        "--address", help="Pipe name or socket path to listen on", default=None
+    )
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        help="Loopback port of the HTTP and WebSocket API, off unless set",
+        default=HTTP_PORT,
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        help="Number of requests waiting to be processed",
+        default=QUEUE_SIZE,
+    )
+    parser.add_argument(
+        "--queue-policy",
+        choices=POLICIES,
+        help="What to do with a new request when the queue is full",
+        default=QUEUE_POLICY,
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        type=float,
+        help="Seconds within which identical requests are only processed once",
+        default=COALESCE_WINDOW,
+    )
+    parser.add_argument(
+        "--no-warmup",
+        dest="warmup",
+        action="store_false",
+        help="Do not build the engines of the default config before the first request",
+        default=WARMUP,
+    )
+    parser.add_argument(
+        "--warmup-probe",
+        action="store_true",
+        help="Also synthesize a short text, not played, when warming up",
+        default=WARMUP_PROBE,
+    )
+    args = vars(parser.parse_args())
+
+    utils.clearCache()
+    daemon = SpeakDaemon(
+        args["instances"],
+        args["workers"],
+        args["transport"],
+        args["address"],
+        args["http_port"],
+        args["queue_size"],
+        args["queue_policy"],
+        args["coalesce_window"],
+        args["warmup"],
+        args["warmup_probe"],
+    )
+    asyncio.run(daemon.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
 import logging
 import os
 import sys
+import threading
 import warnings
-import unicodedata
-import base64
 
 warnings.filterwarnings("ignore")
 
@@ -38,20 +37,47 @@ def setup_logging():
 
 logfile = setup_logging()
 
-import json
-import sys
-import time
-import pyperclip
-import win32file
-import win32pipe
 from PySide6.QtWidgets import QApplication, QWidget, QSystemTrayIcon, QMenu
 from PySide6.QtGui import QIcon, QAction
 from PySide6.QtCore import QThread, Signal, Slot, QTimer
-from deep_translator import *
 import utils
-import tts_utils
 import subprocess
-import configparser
+from concurrent.futures import ThreadPoolExecutor
+from pipe_server import PipeServer
+import protocol
+import request_handler
+import tracing
+from transport import TransportError, get_transport
+from utils import clearCache, remove_stale_temp_files
+
+# Seconds between the status requests to a server that was already running when the
+# tray started, see ServerStatusThread
+STATUS_INTERVAL = 1
+
+
+def ask_server(message):
+    """Send a stop or status request to the server listening on the transport.
+
+    Args:
+        message (dict): {"stop": True} or {"status": True}.
+    Returns:
+        dict: The result, None if no server answered.
+    """
+    try:
+        connection = get_transport().connect()
+    except TransportError:
+        return None
+    try:
+        protocol.write_message(connection, message)
+        response = protocol.read_message(connection)
+    except Exception as e:
+        logging.warning(f"Server did not answer: {e}")
+        return None
+    finally:
+        connection.close()
+    if response is None or response.get("status") != protocol.STATUS_OK:
+        return None
+    return response.get("result")
 
 
 class SystemTrayIcon(QSystemTrayIcon):
@@ -77,13 +103,19 @@ class SystemTrayIcon(QSystemTrayIcon):
         self.lastRunAction.setEnabled(False)
         menu.addAction(self.lastRunAction)
 
+        self.latencyMenu = menu.addMenu("Latency (p50 / p95 / p99)")
+        menu.aboutToShow.connect(self.update_latency)
+
+        stopAction = menu.addAction("Stop speaking")
+        stopAction.triggered.connect(self.parent.stop_speaking)
+
         exitAction = menu.addAction("Exit")
         exitAction.triggered.connect(self.exit)
 
         self.setContextMenu(menu)
 
     def exit(self):
-        self.parent.pipe_thread.quit()
+        self.parent.stop()
         os._exit(0)
         # QApplication.quit()
 
@@ -92,6 +124,25 @@ class SystemTrayIcon(QSystemTrayIcon):
             f"Last run at {last_run_time} - took {duration} secs"
         )
 
+    def update_latency(self):
+        """Show the rolling percentiles of each request stage, in milliseconds."""
+        self.latencyMenu.clear()
+        status = self.parent.server_status()
+        summary = status.get("spans") or {}
+        warmup = status.get("warmup")
+        if warmup is not None:
+            self.latencyMenu.addAction(
+                f"Warm-up: {warmup['warmup']['timings']['total'] * 1000:.0f} ms"
+            ).setEnabled(False)
+        if not summary:
+            self.latencyMenu.addAction("No requests yet").setEnabled(False)
+        for name, span in summary.items():
+            action = self.latencyMenu.addAction(
+                f"{name}: {span['p50'] * 1000:.0f} / {span['p95'] * 1000:.0f} / "
+                f"{span['p99'] * 1000:.0f} ms"
+            )
+            action.setEnabled(False)
+
     def open_logs(self):
         logging.info("Opening logs...")
         subprocess.Popen(["notepad", logfile])
@@ -103,57 +154,85 @@ class SystemTrayIcon(QSystemTrayIcon):
 
 
 class PipeServerThread(QThread):
-    message_received = Signal(str)
-    voices = None
+    """Runs the PipeServer and processes its requests on a worker thread.
+
+    Translation, synthesis, cache lookups and clipboard access all happen on the
+    worker, the GUI thread only receives the status signals below.
+    """
+
+    request_started = Signal(object)
+    request_finished = Signal(object)
+    request_failed = Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.server = PipeServer(self.dispatch)
+        # PipeServer hands over one foreground request at a time, the second worker
+        # is for background work that may still be running alongside it
+        self.worker = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Request")
+
+    def dispatch(self, message):
+        self.worker.submit(self.process, message)
+
+    def process(self, message):
+        # Warm-ups are not requests of a client, the tray icon does not show them
+        shown = "warmup" not in message
+        if shown:
+            self.request_started.emit(message["id"])
+        try:
+            result = request_handler.process_request(message)
+        except Exception as e:
+            logging.error(f"Error handling message: {e}", exc_info=True)
+            self.server.complete(message["id"], error=e)
+            if shown:
+                self.request_failed.emit(str(e))
+            return
+        self.server.complete(message["id"], result)
+        if shown:
+            self.request_finished.emit(result)
 
     def run(self):
-        pipe_name = r"\\.\pipe\AACSpeakHelper"
-        while True:
-            pipe = None
-            try:
-                pipe = win32pipe.CreateNamedPipe(
-                    pipe_name,
-                    win32pipe.PIPE_ACCESS_DUPLEX,
-                    win32pipe.PIPE_TYPE_MESSAGE
-                    | win32pipe.PIPE_READMODE_MESSAGE
-                    | win32pipe.PIPE_WAIT,
-                    win32pipe.PIPE_UNLIMITED_INSTANCES,
-                    65536,
-                    65536,
-                    0,
-                    None,
-                )
-
-                logging.info("Waiting for client connection...")
-                win32pipe.ConnectNamedPipe(pipe, None)
-                logging.info("Client connected.")
-
-                result, data = win32file.ReadFile(pipe, 64 * 1024)
-                if result == 0:
-                    message = data.decode()
-                    logging.info(f"Received data: {message[:50]}...")
-                    self.message_received.emit(message)
-                    get_voices = json.loads(message)["args"]["listvoices"]
-                    # Extract data from the received message
-                else:
-                    get_voices = None
-                logging.info("Processing complete. Ready for next connection.")
-            except Exception as e:
-                logging.error(f"Pipe server error: {e}", exc_info=True)
-            finally:
-                if pipe:
-                    while get_voices:
-                        if self.voices:
-                            win32file.WriteFile(pipe, json.dumps(self.voices).encode())
-                            self.voices = None
-                            break
-                    win32file.CloseHandle(pipe)
-                logging.info("Pipe closed. Reopening for next connection.")
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.stop()
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+
+class ServerStatusThread(QThread):
+    """Polls the status of a server that was already running when the tray started,
+    e.g. AACSpeakHelperDaemon.py, so that the tray shows its status instead of
+    listening on the same pipe a second time.
+    """
+
+    status_received = Signal(object)
+    server_lost = Signal()
+
+    def __init__(self, status, parent=None):
+        super().__init__(parent)
+        self.status = status
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(STATUS_INTERVAL):
+            status = ask_server({"status": True})
+            if status is None:
+                logging.warning("The running server stopped answering.")
+                self.server_lost.emit()
+                return
+            self.status = status
+            self.status_received.emit(status)
+
+    def stop(self):
+        self.stopping.set()
 
 
 class CacheCleanerThread(QThread):
     def run(self):
-        remove_stale_temp_files(utils.audio_files_path)
+        # Only set once the tray handled a request, never while it is attached to
+        # a running server, which cleans its own cache
+        if utils.config is not None:
+            remove_stale_temp_files(utils.audio_files_path)
 
 
 class MainWindow(QWidget):
@@ -162,11 +241,18 @@ class MainWindow(QWidget):
         self.cache_timer = None
         self.cache_cleaner = None
         self.pipe_thread = None
+        self.status_thread = None
+        # Whether the server the tray is attached to has requests in flight
+        self.server_busy = False
         self.tray_icon = None
         self.icon = QIcon("assets/translate.ico")
         self.icon_loading = QIcon("assets/translate_loading.ico")
         self.init_ui()
-        self.init_pipe_server()
+        status = ask_server({"status": True})
+        if status is None:
+            self.init_pipe_server()
+        else:
+            self.attach(status)
         self.init_cache_cleaner()
         self.tray_icon.setToolTip("Waiting for new client...")
 
@@ -176,266 +262,87 @@ class MainWindow(QWidget):
 
     def init_pipe_server(self):
         self.pipe_thread = PipeServerThread()
-        self.pipe_thread.message_received.connect(self.handle_message)
+        self.pipe_thread.request_started.connect(self.request_started)
+        self.pipe_thread.request_finished.connect(self.request_finished)
+        self.pipe_thread.request_failed.connect(self.request_failed)
         self.pipe_thread.start()
 
+    def attach(self, status):
+        """Show the status of the server already listening on the pipe instead of
+        starting another one, until it stops answering."""
+        logging.info("A server is already running, showing its status.")
+        self.tray_icon.lastRunAction.setText("Attached to the running server")
+        self.status_thread = ServerStatusThread(status)
+        self.status_thread.status_received.connect(self.status_changed)
+        self.status_thread.server_lost.connect(self.server_lost)
+        self.status_thread.start()
+
+    def server_status(self):
+        """Spans and last warm-up of the server the tray runs or is attached to."""
+        if self.pipe_thread is not None:
+            return {
+                "spans": tracing.stats.summary(),
+                "warmup": self.pipe_thread.server.last_warmup,
+            }
+        return self.status_thread.status
+
+    def stop_speaking(self):
+        if self.pipe_thread is not None:
+            self.pipe_thread.server.stop_speaking()
+        else:
+            ask_server({"stop": True})
+
+    def stop(self):
+        if self.pipe_thread is not None:
+            self.pipe_thread.stop()
+        if self.status_thread is not None:
+            self.status_thread.stop()
+
+    @Slot(object)
+    def status_changed(self, status):
+        busy = bool(status.get("in_flight"))
+        if busy == self.server_busy:
+            return
+        self.server_busy = busy
+        if busy:
+            self.request_started(None)
+        else:
+            self.request_done()
+
+    @Slot()
+    def server_lost(self):
+        logging.info("Starting the pipe server of the tray.")
+        self.server_busy = False
+        self.tray_icon.lastRunAction.setText("Last run info not available")
+        self.request_done()
+        self.init_pipe_server()
+
     def init_cache_cleaner(self):
         self.cache_cleaner = CacheCleanerThread()
         self.cache_timer = QTimer(self)
         self.cache_timer.timeout.connect(lambda: self.cache_cleaner.start())
         self.cache_timer.start(24 * 60 * 60 * 1000)  # Run once a day
 
-    @Slot(str)
-    def handle_message(self, message):
-        try:
-            data = json.loads(message)
-
-            # Extract data from the received message
-            args = data["args"]
-            config_dict = data["config"]
-            clipboard_text = data["clipboard_text"]
-
-            # Create a ConfigParser object and update it with received config
-            config = configparser.ConfigParser()
-            for section, options in config_dict.items():
-                config[section] = options
-
-            logging.info(config["googleTTS"]["creds"])
-
-            # Get the config path from the received config
-            config_path = config.get("App", "config_path", fallback=None)
-            # Use utils.get_paths to get the paths
-            # config_path, audio_files_path = utils.get_paths(config_path)
-            # TODO: Disable config_path for now
-            config_path, audio_files_path = utils.get_paths()
-
-            if "App" not in config:
-                config["App"] = {}
-            config["App"]["config_path"] = config_path
-            config["App"]["audio_files_path"] = audio_files_path
-            # Initialize utils with the new config and args
-            utils.init(config, args)
-
-            # Initialize TTS
-            tts_utils.init(utils)
-            # Process the clipboard text
-            if not tts_utils.ready:
-                logging.info(
-                    "Application is not ready. Please wait until current session is finished."
-                )
-                return
-            self.tray_icon.setToolTip("Handling new message ...")
-            self.tray_icon.setIcon(self.icon_loading)
-            logging.info(f"Handling new message: {message[:50]}...")
-            if config.getboolean("translate", "noTranslate"):
-                text_to_process = clipboard_text
-            else:
-                text_to_process = translate_clipboard(clipboard_text, config)
-
-            # Perform TTS if not bypassed
-            if not config.getboolean("TTS", "bypass_tts", fallback=False):
-                tts_utils.speak(text_to_process, args["listvoices"])
-            if tts_utils.voices:
-                self.pipe_thread.voices = tts_utils.voices
-            # Replace clipboard if specified
-            if (
-                config.getboolean("translate", "replacepb")
-                and text_to_process is not None
-            ):
-                pyperclip.copy(text_to_process)
-
-            current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-            self.tray_icon.update_last_run_info(current_time, "N/A")
-            logging.info(f"Processed message at {current_time}")
-            self.tray_icon.setIcon(self.icon)
-            self.tray_icon.setToolTip("Waiting for new client...")
-        except Exception as e:
-            logging.error(f"Error handling message: {e}", exc_info=True)
-        finally:
-            logging.info("Message handling complete.")
+    @Slot(object)
+    def request_started(self, request_id):
+        self.tray_icon.setToolTip("Handling new message ...")
+        self.tray_icon.setIcon(self.icon_loading)
 
-
-def translate_clipboard(text, config):
-    try:
-        translator = config.get("translate", "provider")
-        key = (
-            config.get("translate", f"{translator}_secret_key")
-            if not translator == "GoogleTranslator"
-            else None
-        )
-        email = (
-            config.get("translate", "email")
-            if translator == "MyMemoryTranslator"
-            else None
-        )
-        region = (
-            config.get("translate", "region")
-            if translator == "MicrosoftTranslator"
-            else None
-        )
-        pro = (
-            config.getboolean("translate", "deepl_pro")
-            if translator == "DeeplTranslator"
-            else None
-        )
-        url = config.get("translate", "url") if translator == "LibreProvider" else None
-        client_id = (
-            config.get("translate", "papagotranslator_client_id")
-            if translator == "PapagoTranslator"
-            else None
-        )
-        appid = (
-            config.get("translate", "baidutranslator_appid")
-            if translator == "BaiduTranslator"
-            else None
+    @Slot(object)
+    def request_finished(self, result):
+        self.tray_icon.update_last_run_info(
+            result["processed_at"], f"{result['duration']:.2f}"
         )
+        self.request_done()
 
-        match translator:
-            case "GoogleTranslator":
-                translate_instance = GoogleTranslator(
-                    source="auto", target=config.get("translate", "endLang")
-                )
-            case "PonsTranslator":
-                translate_instance = PonsTranslator(
-                    source="auto", target=config.get("translate", "endLang")
-                )
-            case "LingueeTranslator":
-                translate_instance = LingueeTranslator(
-                    source="auto", target=config.get("translate", "endLang")
-                )
-            case "MyMemoryTranslator":
-                translate_instance = MyMemoryTranslator(
-                    source=config.get("translate", "startLang"),
-                    target=config.get("translate", "endLang"),
-                    email=email,
-                )
-            case "YandexTranslator":
-                translate_instance = YandexTranslator(
-                    source=config.get("translate", "startLang"),
-                    target=config.get("translate", "endLang"),
-                    api_key=key,
-                )
-            case "MicrosoftTranslator":
-                translate_instance = MicrosoftTranslator(
-                    api_key=key,
-                    source=config.get("translate", "startLang"),
-                    target=config.get("translate", "endLang"),
-                    region=region,
-                )
-            case "QcriTranslator":
-                translate_instance = QcriTranslator(
-                    source="auto",
-                    target=config.get("translate", "endLang"),
-                    api_key=key,
-                )
-            case "DeeplTranslator":
-                translate_instance = DeeplTranslator(
-                    source=config.get("translate", "startlang"),
-                    target=config.get("translate", "endLang"),
-                    api_key=key,
-                    use_free_api=not pro,
-                )
-            case "LibreTranslator":
-                translate_instance = LibreTranslator(
-                    source=config.get("translate", "startlang"),
-                    target=config.get("translate", "endLang"),
-                    api_key=key,
-                    custom_url=url,
-                )
-            case "PapagoTranslator":
-                translate_instance = PapagoTranslator(
-                    source="auto",
-                    target=config.get("translate", "endLang"),
-                    client_id=client_id,
-                    secret_key=key,
-                )
-            case "ChatGptTranslator":
-                translate_instance = ChatGptTranslator(
-                    source="auto", target=config.get("translate", "endLang")
-                )
-            case "BaiduTranslator":
-                translate_instance = BaiduTranslator(
-                    source=config.get("translate", "startlang"),
-                    target=config.get("translate", "endLang"),
-                    appid=appid,
-                    appkey=key,
-                )
-        # elif translator == "DeepLearningTranslator":
-        #     translate_instance = BaiduTranslator(source=config.get('translate', 'startlang'),
-        #                                          target=config.get('translate', 'endLang'),
-        #                                          appid=appid,
-        #                                          appkey=key)
-        logging.info("Translation Provider is {}".format(translator))
-        logging.info(f'Text [{config.get("translate", "startLang")}]: {text}')
-        if config.get("translate", "endLang") in [
-            "ckb" "ku",
-            "kmr",
-            "kmr-TR",
-            "ckb-IQ",
-        ]:
-            text = normalize_text(text)
-        translation = translate_instance.translate(text)
-        logging.info(
-            f'Translation [{config.get("translate", "endLang")}]: {translation}'
-        )
-        return translation
-    except Exception as e:
-        logging.error(f"Translation Error: {e}", exc_info=True)
-
-
-def normalize_text(text: str):
-    normalizedText = unicodedata.normalize("NFC", text)
-    logging.info("Normalized Text: {}".format(normalizedText))
-    return normalizedText
-
-
-def remove_stale_temp_files(directory_path, ignore_pattern=".db"):
-    config = utils.config
-    start = time.perf_counter()
-    current_time = time.time()
-    day = int(config.get("appCache", "threshold"))
-    time_threshold = current_time - day * 24 * 60 * 60
-    file_list = []
-
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if (
-                ignore_pattern
-                and file.endswith(ignore_pattern)
-                and file.endswith(".db-journal")
-            ):
-                continue
-            try:
-                file_modification_time = os.path.getmtime(file_path)
-                if file_modification_time < time_threshold:
-                    os.remove(file_path)
-                    file_list.append(os.path.basename(file_path))
-                    logging.info(f"Removed cache file: {file_path}")
-            except Exception as e:
-                logging.error(f"Error processing file {file_path}: {e}", exc_info=True)
-
-    stop = time.perf_counter() - start
-    utils.clear_history(file_list)
-    logging.info(f"Cache clearing took {stop:0.5f} seconds.")
-
-
-def clearCache():
-    temp_folder = os.getenv("TEMP")
-    size_limit = 5 * 1024  # 5KB in bytes
-    # Scan the directory
-    for root, dirs, files in os.walk(temp_folder):
-        for file in files:
-            if file.startswith("tmp"):
-                file_path = os.path.join(root, file)
-                if os.path.getsize(file_path) < size_limit:
-                    config = utils.config
-                    current_time = time.time()
-                    day = 7
-                    time_threshold = current_time - day * 24 * 60 * 60
-                    file_modification_time = os.path.getmtime(file_path)
-                    if file_modification_time < time_threshold:
-                        os.remove(file_path)
+    @Slot(object)
+    def request_failed(self, error):
+        self.request_done()
+
+    def request_done(self):
+        self.tray_icon.setIcon(self.icon)
+        self.tray_icon.setToolTip("Waiting for new client...")
+        logging.info("Message handling complete.")
 
 
 if __name__ == "__main__":
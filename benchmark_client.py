@@ -0,0 +1,117 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import protocol
+import transport
+
+
+class StubServer:
+    """Answers every request at once so that only the client start-up is measured,
+    counting the requests it answered."""
+
+    def __init__(self, server_transport):
+        self.transport = server_transport
+        self.stopping = threading.Event()
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def serve(self):
+        while not self.stopping.is_set():
+            connection = self.transport.accept(timeout=0.2)
+            if connection is None:
+                continue
+            self.handle(connection)
+
+    def handle(self, connection):
+        try:
+            if protocol.read_message(connection) is not None:
+                # Counted before the client gets its answer and exits
+                self.requests += 1
+                protocol.write_message(
+                    connection, {"status": protocol.STATUS_OK, "result": {}}
+                )
+        except Exception as e:
+            print(f"Stub server error: {e}")
+        finally:
+            connection.close()
+
+
+def time_client(client_args, env, runs, server):
+    """Run client.py runs times and return the wall clock time of each run.
+
+    Raises RuntimeError when a run failed or did not reach the server, e.g. when
+    the full client could not load its config, since its time would not be a
+    start-up.
+    """
+    client_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client.py")
+    timings = []
+    for _ in range(runs):
+        requests = server.requests
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, client_path, *client_args], env=env, check=False
+        )
+        timings.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            raise RuntimeError(
+                f"client.py {' '.join(client_args)} exited with "
+                f"{completed.returncode}, see client.log"
+            )
+        if server.requests != requests + 1:
+            raise RuntimeError(
+                f"client.py {' '.join(client_args)} did not send a request, see "
+                "client.log"
+            )
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cold start time of client.py in full and --thin mode"
+    )
+    parser.add_argument("-n", "--runs", type=int, help="Runs per mode", default=10)
+    parser.add_argument(
+        "-c", "--config", help="Config file passed to the client", default=""
+    )
+    args = vars(parser.parse_args())
+
+    if sys.platform == "win32":
+        address = r"\\.\pipe\AACSpeakHelperBenchmark"
+    else:
+        address = os.path.join(tempfile.gettempdir(), "AACSpeakHelperBenchmark.sock")
+    server_transport = transport.get_transport(address=address)
+    server_transport.listen()
+    server = StubServer(server_transport)
+    server.thread.start()
+
+    env = dict(os.environ, AACSPEAKHELPER_ADDRESS=address)
+    config_args = ["--config", args["config"]] if args["config"] else []
+    modes = {
+        "full": config_args,
+        "thin": ["--thin", *config_args],
+    }
+    try:
+        for mode, client_args in modes.items():
+            try:
+                timings = time_client(client_args, env, args["runs"], server)
+            except RuntimeError as e:
+                sys.exit(f"{mode} mode failed: {e}")
+            print(
+                f"{mode:>4}: min {min(timings) * 1000:7.1f} ms"
+                f"  median {statistics.median(timings) * 1000:7.1f} ms"
+                f"  max {max(timings) * 1000:7.1f} ms"
+            )
+    finally:
+        server.stopping.set()
+        server.thread.join()
+        server_transport.close()
+
+
+if __name__ == "__main__":
+    main()
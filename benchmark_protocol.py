@@ -0,0 +1,75 @@
+import argparse
+import configparser
+import json
+import os
+import timeit
+
+import protocol
+
+
+def speak_request(config_path):
+    """A speak request as the full client sends it, with the sections of a config
+    file inline."""
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return {
+        "args": {
+            "config": "",
+            "listvoices": False,
+            "preview": False,
+            "style": "",
+            "styledegree": None,
+        },
+        "config": {section: dict(config[section]) for section in config.sections()},
+        "clipboard_text": "Hello, how are you today? I would like a cup of tea.",
+    }
+
+
+def old_decode(body):
+    """How the server read a request before the framing: the listvoices flag and
+    the request were each parsed from the JSON text."""
+    json.loads(body)["args"]["listvoices"]
+    return json.loads(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare decoding a request with the old double json.loads and "
+        "with protocol.decode"
+    )
+    parser.add_argument(
+        "-n", "--number", type=int, help="Decodes per measurement", default=10000
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="Config file whose sections the request carries",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "settings.cfg"
+        ),
+    )
+    args = vars(parser.parse_args())
+
+    message = speak_request(args["config"])
+    json_body = json.dumps(message).encode()
+    cases = {
+        "json.loads twice": lambda: old_decode(json_body),
+    }
+    for name, codec in (
+        ("marshal", protocol.CODEC_MARSHAL),
+        ("json", protocol.CODEC_JSON),
+    ):
+        codec, body = protocol.encode(message, codec)
+        cases[f"protocol.decode {name}"] = lambda codec=codec, body=body: (
+            protocol.decode(codec, body)
+        )
+        print(f"{name} body: {len(body)} bytes")
+
+    for name, decode in cases.items():
+        # Best of 5 measurements, the others are slowed down by other processes
+        seconds = min(timeit.repeat(decode, number=args["number"], repeat=5))
+        print(f"{name:>24}: {seconds / args['number'] * 1e6:6.1f} us")
+
+
+if __name__ == "__main__":
+    main()
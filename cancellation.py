@@ -0,0 +1,51 @@
+import logging
+import threading
+
+
+class Cancelled(Exception):
+    """Raised by a request that was cancelled before it was done."""
+
+    def __init__(self, message="Request was cancelled."):
+        super().__init__(message)
+
+
+class CancelToken:
+    """Lets a request be stopped from another thread, e.g. by a stop request or a
+    new request that interrupts it.
+
+    Work that can be stopped part way registers a callback with on_cancel, such
+    as stopping the audio stream. Other work checks the token between its steps.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error while cancelling a request: {e}", exc_info=True)
+
+    def on_cancel(self, callback):
+        """Call callback once the token is cancelled, right away if it already is."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise Cancelled()
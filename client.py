@@ -1,16 +1,14 @@
 # client.py
 
+import os
 import sys
 import argparse
+import json
 import logging
-import pyperclip
-import win32file
-import pywintypes
 import time
-import json
-from pathlib import Path
 
-from configure_enc_utils import load_config
+import protocol
+from transport import TransportError, get_transport
 
 
 # Configure logging
@@ -52,6 +50,8 @@ def get_clipboard_text():
     Returns:
         str: The clipboard text.
     """
+    import pyperclip
+
     try:
         return pyperclip.paste()
     except pyperclip.PyperclipException as e:
@@ -59,47 +59,93 @@ def get_clipboard_text():
         return ""
 
 
-def send_to_pipe(data, retries=3, delay=1):
+def log_event(event):
+    """Log a progress event streamed by the server."""
+    details = {
+        k: v
+        for k, v in event.items()
+        if k not in ("status", "event", "time", "elapsed")
+    }
+    logging.info(
+        f"Event {event.get('event')} after {event.get('elapsed', 0):0.3f} seconds"
+        + (f": {details}" if details else ".")
+    )
+
+
+def read_response(connection, on_event=None):
+    """Read the response to a request, passing progress events to on_event.
+
+    Returns:
+        dict: The first frame that is not an event, None if the server closed the
+        connection first.
+    """
+    while True:
+        message = protocol.read_message(connection)
+        if message is None or message.get("status") != protocol.STATUS_EVENT:
+            return message
+        if on_event is not None:
+            on_event(message)
+
+
+def send_to_pipe(data, config=None, retries=3, delay=1, on_event=log_event):
     """
-    Sends data to a named pipe.
+    Sends data to the AACSpeakHelper server over the platform transport
+    (the named pipe on Windows, a Unix domain socket elsewhere).
+
+    The request only carries the config_hash of the config. The full config is
+    sent when the server replies that it does not have that config cached yet.
 
     Args:
         data (dict): The data to send.
+        config (dict): The full config, sent only if the server asks for it.
         retries (int): Number of retries if the pipe is unavailable.
         delay (int): Delay in seconds between retries.
+        on_event (callable): Called with each progress event when the request was
+            sent with "events": True. Events after the response are read until the
+            server closes the connection.
 
     Returns:
-        None
+        dict: The server response, {"status": "ok", "result": {...}} or
+        {"status": "error", "error": "..."}, None if the server was unreachable.
     """
-    pipe_name = r"\\.\pipe\AACSpeakHelper"
+    transport = get_transport()
+    response = None
     attempt = 0
     while attempt < retries:
         try:
-            handle = win32file.CreateFile(
-                pipe_name,
-                win32file.GENERIC_READ | win32file.GENERIC_WRITE,
-                0,
-                None,
-                win32file.OPEN_EXISTING,
-                0,
-                None,
-            )
-            message = json.dumps(data).encode()
-            win32file.WriteFile(handle, message)
+            connection = transport.connect()
+            protocol.write_message(connection, data)
             logging.info(f"Sent data to pipe: {data}")
 
             try:
-                result, response = win32file.ReadFile(handle, 128 * 1024)
-                if result == 0:
-                    available_voices = response.decode()
-                    logging.info(f"Available Voices: {available_voices}")
+                response = read_response(connection, on_event)
+                if (
+                    response is not None
+                    and response.get("status") == protocol.STATUS_CONFIG_REQUIRED
+                ):
+                    logging.info("Server requested the full config.")
+                    protocol.write_message(connection, {"config": config})
+                    response = read_response(connection, on_event)
+                if response is None:
+                    logging.error("Server closed the connection without a response.")
+                elif response.get("status") == protocol.STATUS_OK:
+                    result = response.get("result") or {}
+                    for item in result.get("items", []):
+                        logging.info(f"Batch item {item['index']}: {item}")
+                    if "voices" in result:
+                        logging.info(f"Available Voices: {result['voices']}")
+                    logging.info(f"Processed text: {result.get('text')}")
+                else:
+                    logging.error(f"Server error: {response.get('error')}")
+                if response is not None and data.get("events"):
+                    # Playback events follow the response
+                    read_response(connection, on_event)
             except Exception as read_error:
-                if "109" not in str(read_error):
-                    logging.error(f"Error reading from pipe: {read_error}")
+                logging.error(f"Error reading from pipe: {read_error}")
 
-            win32file.CloseHandle(handle)
+            connection.close()
             break
-        except pywintypes.error as e:
+        except TransportError as e:
             logging.error(
                 f"Attempt {attempt + 1}: Error communicating with the pipe server: {e}"
             )
@@ -109,6 +155,7 @@ def send_to_pipe(data, retries=3, delay=1):
         logging.error(
             "Failed to communicate with the pipe server after multiple attempts."
         )
+    return response
 
 
 def main():
@@ -138,9 +185,108 @@ def main():
         help="Degree of style for Azure TTS",
         default=None,
     )
+    parser.add_argument(
+        "-t",
+        "--thin",
+        help="Fast start: leave loading the config and reading the clipboard to the server",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--text", help="Text to process instead of the clipboard text", default=None
+    )
+    parser.add_argument(
+        "--profile",
+        help="Name of a config file next to settings.cfg, used with --thin",
+        default="",
+    )
+    parser.add_argument(
+        "--batch",
+        help="File with one text per line, processed in a single request",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache-only",
+        help="With --batch, translate and synthesize the texts into the cache without speaking",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stop",
+        help="Stop speaking and drop the requests waiting to be spoken",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print the server's cache, queue and latency statistics",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--interrupt",
+        help="Stop what is being spoken and speak this text right away",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--priority",
+        help="Priority class of the request, by default speak, or preview with --preview",
+        choices=protocol.PRIORITIES,
+        default=None,
+    )
+    parser.add_argument(
+        "--events",
+        help="Log progress events of the request until playback is done",
+        action="store_true",
+    )
     args = vars(parser.parse_args())
+    events = args.pop("events")
+    stop = args.pop("stop")
+    stats = args.pop("stats")
+    interrupt = args.pop("interrupt")
+    priority = args.pop("priority")
+    if stop:
+        send_to_pipe({"stop": True})
+        return
+    if stats:
+        response = send_to_pipe({"stats": True})
+        if response is not None:
+            print(json.dumps(response.get("result"), indent=2))
+        return
+    batch_file = args.pop("batch")
+    cache_only = args.pop("cache_only")
+    thin = args.pop("thin")
+    text = args.pop("text")
+    profile = args.pop("profile")
+
+    batch = None
+    if batch_file:
+        with open(batch_file, encoding="utf-8") as f:
+            batch = {
+                "texts": [line.strip() for line in f if line.strip()],
+                "mode": "cache" if cache_only else "speak",
+            }
 
     config_path = args["config"]
+    if thin:
+        # No decryption, config parsing or clipboard access in this process
+        data_to_send = {
+            "args": args,
+            "config_path": os.path.abspath(config_path) if config_path else "",
+            "profile": profile,
+        }
+        if text is not None:
+            data_to_send["clipboard_text"] = text
+        if events:
+            data_to_send["events"] = True
+        if interrupt:
+            data_to_send["interrupt"] = True
+        if priority:
+            data_to_send["priority"] = priority
+        if batch:
+            data_to_send["batch"] = batch
+        send_to_pipe(data_to_send)
+        return
+
+    # Imported here as decrypting the config is what makes a full start slow
+    from configure_enc_utils import load_config
+
     try:
         # Check if a custom configuration file was provided
         if config_path:
@@ -156,19 +302,27 @@ def main():
         sys.exit(1)
     logging.info("All configurations are validated successfully.")
 
-    # Retrieve clipboard text
-    clipboard_text = get_clipboard_text()
-    logging.debug(f"Clipboard text: {clipboard_text}")
-
     # Prepare data to send
     data_to_send = {
         "args": args,
-        "config": config,
-        "clipboard_text": clipboard_text,
+        "config_hash": protocol.config_fingerprint(config),
     }
+    if batch:
+        data_to_send["batch"] = batch
+    else:
+        # Retrieve clipboard text
+        clipboard_text = text if text is not None else get_clipboard_text()
+        logging.debug(f"Clipboard text: {clipboard_text}")
+        data_to_send["clipboard_text"] = clipboard_text
+    if events:
+        data_to_send["events"] = True
+    if interrupt:
+        data_to_send["interrupt"] = True
+    if priority:
+        data_to_send["priority"] = priority
 
     # Send data to the named pipe
-    send_to_pipe(data_to_send)
+    send_to_pipe(data_to_send, config)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+import configparser
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import protocol
+import utils
+from configure_enc_utils import load_config
+
+
+class ConfigEntry:
+    """A parsed config together with the TTS clients already built for it.
+
+    Configs with the same engine settings share their TTS clients, so changing
+    e.g. only the target language does not build the engine again.
+    """
+
+    def __init__(self, fingerprint, config, tts_clients=None):
+        self.fingerprint = fingerprint
+        self.config = config
+        self.engine_key = engine_key(config)
+        self.tts_clients = tts_clients if tts_clients is not None else {}
+
+
+def engine_key(config):
+    """Fingerprint of the settings the TTS clients of a config are built from:
+    the TTS section and the section of the configured engine.
+
+    Args:
+        config: Parsed config.
+    Returns: str
+    """
+    engine = config.get("TTS", "engine", fallback="")
+    return protocol.config_fingerprint(
+        {
+            section: dict(config[section])
+            for section in ("TTS", engine)
+            if config.has_section(section)
+        }
+    )
+
+
+def build_config(config_dict):
+    """Create a ConfigParser from a config dict received from a client.
+
+    Args:
+        config_dict (dict): Config sections mapped to their options.
+    Returns: ConfigParser
+    """
+    config = configparser.ConfigParser()
+    for section, options in config_dict.items():
+        config[section] = options
+
+    # Get the config path from the received config
+    config_path = config.get("App", "config_path", fallback=None)
+    # Use utils.get_paths to get the paths
+    # config_path, audio_files_path = utils.get_paths(config_path)
+    # TODO: Disable config_path for now
+    config_path, audio_files_path = utils.get_paths()
+
+    if "App" not in config:
+        config["App"] = {}
+    config["App"]["config_path"] = config_path
+    config["App"]["audio_files_path"] = audio_files_path
+    return config
+
+
+class ConfigCache:
+    """LRU of parsed configs keyed by protocol.config_fingerprint."""
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        # Config files loaded by the server itself: path -> (mtime, fingerprint)
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def get(self, fingerprint):
+        """Return the entry for a fingerprint, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is not None:
+                self.entries.move_to_end(fingerprint)
+            return entry
+
+    def add(self, config_dict):
+        """Parse a config dict and cache it, evicting the least recently used entry.
+
+        Args:
+            config_dict (dict): Config sections mapped to their options.
+        Returns: ConfigEntry
+        """
+        fingerprint = protocol.config_fingerprint(config_dict)
+        entry = self.get(fingerprint)
+        if entry is not None:
+            return entry
+        config = build_config(config_dict)
+        key = engine_key(config)
+        with self.lock:
+            same_engine = next(
+                (
+                    cached
+                    for cached in self.entries.values()
+                    if cached.engine_key == key
+                ),
+                None,
+            )
+            entry = ConfigEntry(
+                fingerprint,
+                config,
+                same_engine.tts_clients if same_engine is not None else None,
+            )
+            self.entries[fingerprint] = entry
+            while len(self.entries) > self.capacity:
+                evicted, _ = self.entries.popitem(last=False)
+                logging.info(f"Evicted config {evicted[:12]} from cache.")
+        logging.info(f"Cached config {fingerprint[:12]}.")
+        return entry
+
+    def load(self, config_path=""):
+        """Load a config file on behalf of a thin client, decrypting the secrets
+        only when the file is new or has changed since it was last loaded.
+
+        Args:
+            config_path (str): Path of a settings file, "" for the default settings.cfg.
+        Returns: ConfigEntry
+        """
+        if not config_path:
+            config_path, _ = utils.get_paths()
+        mtime = os.path.getmtime(config_path)
+        with self.lock:
+            known = self.files.get(config_path)
+        if known is not None and known[0] == mtime:
+            entry = self.get(known[1])
+            if entry is not None:
+                return entry
+        config_dict = load_config(custom_config_path=config_path)
+        if config_dict is None:
+            raise FileNotFoundError(f"No config found at {config_path}")
+        entry = self.add(config_dict)
+        with self.lock:
+            self.files[config_path] = (mtime, entry.fingerprint)
+        return entry
+
+
+def profile_path(profile):
+    """Path of a named profile, a .cfg file next to the default settings.cfg.
+
+    Args:
+        profile (str): Profile name.
+    Returns: str
+    """
+    config_path, _ = utils.get_paths()
+    name = os.path.basename(profile)
+    if not name.endswith(".cfg"):
+        name += ".cfg"
+    return os.path.join(os.path.dirname(config_path), name)
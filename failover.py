@@ -0,0 +1,160 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import throttle
+from translate_utils import pool, translate_clipboard
+
+# Seconds a translation may take over all the providers asked before it is given up
+TRANSLATION_BUDGET = float(os.environ.get("AACSPEAKHELPER_TRANSLATION_BUDGET", 10))
+# Seconds to wait for a provider before also asking the next one, used until the
+# provider has MIN_SAMPLES translations to take its p95 latency from
+HEDGE_DELAY = float(os.environ.get("AACSPEAKHELPER_HEDGE_DELAY", 2))
+MIN_SAMPLES = 5
+# Share of failed translations above which a provider is asked after the others
+UNHEALTHY_ERROR_RATE = 0.5
+# Translations sent to the providers at once, over all requests
+HEDGE_WORKERS = 8
+
+# Sends the translations of the providers in the chain
+workers = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="Hedge")
+
+
+def fallback_providers(config):
+    """Providers to fall back on, from the comma separated "fallback_providers"
+    option of the translate section. Each needs its credentials in the config
+    like the configured provider.
+
+    Args:
+        config: Configuration with a "translate" section.
+    Returns: list
+    """
+    option = config.get("translate", "fallback_providers", fallback="")
+    return [provider.strip() for provider in option.split(",") if provider.strip()]
+
+
+def hedge_delay(provider):
+    """Seconds to wait for a provider before also asking the next one: its p95
+    latency, or HEDGE_DELAY until it has enough translations."""
+    health = pool.health(provider)
+    if health["samples"] < MIN_SAMPLES:
+        return HEDGE_DELAY
+    return health["p95"]
+
+
+def provider_chain(config):
+    """Providers to ask for a translation, in order.
+
+    The configured provider comes first and the fallback providers follow, the
+    fastest first. Providers that failed more than UNHEALTHY_ERROR_RATE of their
+    recent translations are moved to the end.
+
+    Args:
+        config: Configuration with a "translate" section.
+    Returns: list
+    """
+    primary = config.get("translate", "provider")
+    fallbacks = [
+        provider
+        for provider in dict.fromkeys(fallback_providers(config))
+        if provider != primary
+    ]
+
+    def unhealthy(provider):
+        return pool.health(provider)["error_rate"] > UNHEALTHY_ERROR_RATE
+
+    # Sorting is stable, so the primary stays first unless it is unhealthy
+    return sorted(
+        [primary] + sorted(fallbacks, key=hedge_delay),
+        key=unhealthy,
+    )
+
+
+def translate(text, config, budget=TRANSLATION_BUDGET):
+    """Translate text with the first provider of the chain that answers in time.
+
+    The first provider is asked right away. When a provider fails, the next one is
+    asked at once. When a provider takes longer than its hedge_delay, the next one
+    is asked as well and the first good answer is taken. Providers still working
+    when the budget runs out are not waited for. Providers with an open circuit are
+    skipped, see throttle.ProviderGuard.
+
+    A provider over its rate limit is skipped too, hedges included, as long as
+    another provider may be asked or a translation is in flight. Once neither is
+    left, the translation waits within the budget for a token of the first of
+    them, instead of giving up while its limit would allow it a moment later.
+
+    Args:
+        text (str): Text to translate.
+        config: Configuration with a "translate" section.
+        budget (float): Seconds the translation may take.
+    Returns:
+        tuple: (translation, provider that translated it). The translation is
+        None if no provider translated it within budget or none could be asked.
+    """
+    if not text.strip():
+        return text, None
+    chain = provider_chain(config)
+    untried = list(chain)
+    deadline = time.monotonic() + budget
+    # Translations in flight: future -> provider
+    pending = {}
+    # Providers skipped for their rate limit, in the order of the chain
+    throttled = []
+
+    def ask(provider, guard):
+        future = workers.submit(translate_clipboard, text, config, provider)
+        # Also recorded when the translation is not waited for anymore
+        future.add_done_callback(
+            lambda done: guard.record(done.result() is not None, config)
+        )
+        pending[future] = provider
+        return hedge_delay(provider)
+
+    def ask_next():
+        """Ask the next provider that may be asked, returns its hedge_delay."""
+        while untried:
+            provider = untried.pop(0)
+            guard = throttle.get_guard(config, provider)
+            if guard.allow():
+                return ask(provider, guard)
+            if guard.is_open:
+                logging.info(f"Skipping {provider}, it keeps failing.")
+            else:
+                logging.info(f"Skipping {provider} for now, over its rate limit.")
+                throttled.append((provider, guard))
+        if pending or not throttled:
+            return None
+        provider, guard = throttled.pop(0)
+        remaining = deadline - time.monotonic()
+        logging.info(
+            f"Waiting up to {remaining:0.1f}s for the rate limit of {provider}."
+        )
+        if guard.allow(timeout=max(0, remaining)):
+            return ask(provider, guard)
+        return None
+
+    delay = ask_next()
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(
+            pending,
+            timeout=min(delay, remaining) if untried else remaining,
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            provider = pending.pop(future)
+            translation = future.result()
+            if translation:
+                if provider != chain[0]:
+                    logging.warning(f"Translated by {provider} instead of {chain[0]}.")
+                return translation, provider
+            logging.warning(f"{provider} could not translate the text.")
+        if untried or (throttled and not pending):
+            # Fail over to the next provider, or hedge when the last one is slow
+            delay = ask_next()
+    logging.error(f"No provider of {chain} translated the text in time.")
+    return None, None
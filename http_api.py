@@ -0,0 +1,542 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import protocol
+import utils
+from progress import Progress
+from request_queue import PRIORITIES, SPEAK
+from tracing import CONFIG, DECODE, Trace
+
+# Loopback port of the HTTP API, off unless set
+HTTP_PORT = int(os.environ.get("AACSPEAKHELPER_HTTP_PORT", 0))
+HTTP_HOST = "127.0.0.1"
+# Host names a request may be addressed to. Anything else is refused, so that a
+# web page cannot reach the API through a DNS name rebound to 127.0.0.1.
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+# Comma separated origins of the web pages allowed to use the API, e.g. a
+# browser based board at http://localhost:3000. Requests from other pages are
+# refused, requests without an Origin (scripts) are not affected.
+HTTP_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get("AACSPEAKHELPER_HTTP_ORIGINS", "").split(",")
+    if origin.strip()
+]
+# Token every request must carry, created once per install in TOKEN_FILE next to
+# settings.cfg unless set here
+HTTP_TOKEN = os.environ.get("AACSPEAKHELPER_HTTP_TOKEN", "")
+TOKEN_FILE = "http_api_token"
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 60
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Arguments of client.py, used for requests that do not set them
+DEFAULT_ARGS = {
+    "config": "",
+    "listvoices": False,
+    "preview": False,
+    "style": "",
+    "styledegree": None,
+}
+# Request fields that select the config, as sent by client.py
+CONFIG_FIELDS = ("config", "config_hash", "config_path", "profile")
+
+
+class ApiError(Exception):
+    """A request the API cannot handle, answered with an HTTP error status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def load_token():
+    """Return the token of the install: HTTP_TOKEN if set, else the one in
+    TOKEN_FILE next to settings.cfg, created with a random token on first use.
+
+    Returns: str
+    """
+    if HTTP_TOKEN:
+        return HTTP_TOKEN
+    config_path, _ = utils.get_paths()
+    path = os.path.join(os.path.dirname(config_path), TOKEN_FILE)
+    try:
+        with open(path) as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    token = secrets.token_urlsafe(32)
+    # Only readable by the user running the server
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as f:
+        f.write(token)
+    logging.info(f"Created the HTTP API token in {path}.")
+    return token
+
+
+class WebSocket:
+    """Server side of a WebSocket connection (RFC 6455) on a handler's socket."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @staticmethod
+    def accept_key(key):
+        digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+        return base64.b64encode(digest).decode()
+
+    def read_frame(self):
+        """Read one frame.
+
+        Returns:
+            tuple: (fin, opcode, payload), None if the client went away.
+        """
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        fin = bool(header[0] & 0x80)
+        opcode = header[0] & 0x0F
+        masked = header[1] & 0x80
+        length = header[1] & 0x7F
+        if length == 126:
+            (length,) = struct.unpack(">H", self.rfile.read(2))
+        elif length == 127:
+            (length,) = struct.unpack(">Q", self.rfile.read(8))
+        if length > protocol.MAX_FRAME_SIZE:
+            raise protocol.ProtocolError(f"WebSocket frame of {length} bytes")
+        mask = self.rfile.read(4) if masked else None
+        payload = self.rfile.read(length)
+        if len(payload) < length:
+            return None
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return fin, opcode, payload
+
+    def receive(self):
+        """Read the next text or binary message, answering pings on the way.
+
+        Returns:
+            bytes or str: The message, None once the connection is closed.
+        """
+        parts = []
+        message_opcode = None
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return None
+            fin, opcode, payload = frame
+            if opcode == OPCODE_CLOSE:
+                self.close()
+                return None
+            if opcode == OPCODE_PING:
+                self.send_frame(OPCODE_PONG, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+            if opcode != OPCODE_CONTINUATION:
+                message_opcode = opcode
+            parts.append(payload)
+            if fin:
+                message = b"".join(parts)
+                return message.decode() if message_opcode == OPCODE_TEXT else message
+
+    def send_frame(self, opcode, payload=b""):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self.lock:
+            if self.closed:
+                return
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def send_json(self, message):
+        self.send_frame(OPCODE_TEXT, json.dumps(message).encode())
+
+    def send_bytes(self, data):
+        for start in range(0, len(data), protocol.CHUNK_SIZE):
+            self.send_frame(OPCODE_BINARY, data[start : start + protocol.CHUNK_SIZE])
+
+    def close(self):
+        try:
+            self.send_frame(OPCODE_CLOSE)
+        except OSError:
+            pass
+        self.closed = True
+
+
+class WebSocketProgress(Progress):
+    """Progress events of a request sent over the WebSocket, tagged with the
+    "ref" the client gave the request."""
+
+    def __init__(self, socket, ref=None, trace=None):
+        super().__init__(socket, streaming=True, trace=trace, ref=ref)
+
+    def write(self, message):
+        if self.connection is None:
+            return
+        try:
+            self.connection.send_json(message)
+        except OSError as e:
+            logging.info(f"WebSocket client stopped listening to events: {e}")
+            self.connection = None
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Routes HTTP and WebSocket requests of the local API.
+
+    HTTP/1.1 keeps connections open between requests, so a client pays for the
+    connection once and not per utterance.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    # Headers and body are written separately, Nagle would hold back the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug(f"HTTP API: {format % args}")
+
+    def send_cors_headers(self):
+        """Let an allowed web page read the response."""
+        origin = self.headers.get("Origin")
+        if origin is not None and origin in self.server.api.origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, error):
+        self.send_json(
+            error.status, {"status": protocol.STATUS_ERROR, "error": str(error)}
+        )
+
+    def check_origin(self):
+        """Refuse requests addressed to another host name, e.g. a DNS name
+        rebound to 127.0.0.1, and requests of web pages not in the allowed
+        origins."""
+        host = self.headers.get("Host", "")
+        port = self.server.server_address[1]
+        if host not in [f"{name}:{port}" for name in LOOPBACK_HOSTS]:
+            raise ApiError(403, f"Unexpected Host {host}")
+        origin = self.headers.get("Origin")
+        if origin is not None and origin not in self.server.api.origins:
+            raise ApiError(403, f"Origin {origin} is not allowed")
+
+    def check_token(self, token=None):
+        """Refuse requests without the token of the install, sent as
+        "Authorization: Bearer <token>" or, by browsers opening a WebSocket, as
+        the token query parameter."""
+        if token is None:
+            scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() != "bearer":
+                token = ""
+        if not hmac.compare_digest(token.encode(), self.server.api.token.encode()):
+            raise ApiError(401, "Missing or wrong token")
+
+    def read_body(self):
+        # Browsers send forms and text/plain across origins without a preflight
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type.lower() != "application/json":
+            raise ApiError(415, "Expected Content-Type application/json.")
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            raise ApiError(400, f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Expected a JSON object.")
+        return body
+
+    def do_OPTIONS(self):
+        # CORS preflight of browser based AAC boards
+        try:
+            self.check_origin()
+        except ApiError as e:
+            self.send_error_json(e)
+            return
+        self.send_response(204)
+        self.send_cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        try:
+            self.check_origin()
+            if url.path == "/ws":
+                self.check_token(query.pop("token", ""))
+            else:
+                self.check_token()
+        except ApiError as e:
+            self.send_error_json(e)
+            return
+        if url.path == "/ws":
+            self.serve_websocket()
+            return
+        self.handle_api(url.path, query, Progress())
+
+    def do_POST(self):
+        progress = Progress()
+        try:
+            self.check_origin()
+            self.check_token()
+            with progress.trace.span(DECODE):
+                body = self.read_body()
+        except ApiError as e:
+            self.send_error_json(e)
+            return
+        self.handle_api(urlsplit(self.path).path, body, progress)
+
+    def handle_api(self, path, body, progress):
+        routes = {
+            "/speak": "speak",
+            "/translate": "translate",
+            "/voices": "voices",
+            "/batch": "batch",
+            "/cache/stats": "stats",
+            "/stop": "stop",
+            "/jobs": "jobs",
+        }
+        try:
+            if path not in routes:
+                raise ApiError(404, f"Unknown endpoint {path}")
+            response = self.server.api.handle(routes[path], body, progress)
+        except ApiError as e:
+            self.send_error_json(e)
+            return
+        except Exception as e:
+            logging.error(f"HTTP API error: {e}", exc_info=True)
+            self.send_json(500, {"status": protocol.STATUS_ERROR, "error": str(e)})
+            return
+        if response["status"] == protocol.STATUS_CONFIG_REQUIRED:
+            self.send_json(409, response)
+        elif response["status"] == protocol.STATUS_ERROR:
+            self.send_json(500, response)
+        else:
+            self.send_json(200, response)
+
+    def serve_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            self.send_json(
+                400, {"status": protocol.STATUS_ERROR, "error": "Expected a WebSocket."}
+            )
+            return
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", WebSocket.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        # Requests over the socket can take longer than an idle HTTP connection
+        self.connection.settimeout(None)
+        socket = WebSocket(self.rfile, self.wfile)
+        try:
+            while True:
+                message = socket.receive()
+                if message is None:
+                    break
+                # Each request gets its own thread so that a "stop" is not
+                # held up behind the requests it should stop
+                threading.Thread(
+                    target=self.handle_websocket_message,
+                    args=(socket, message),
+                    daemon=True,
+                ).start()
+        except (OSError, protocol.ProtocolError) as e:
+            logging.info(f"WebSocket closed: {e}")
+        finally:
+            socket.closed = True
+            self.close_connection = True
+
+    def handle_websocket_message(self, socket, message):
+        """Answer one {"type": ..., "ref": ...} request of a WebSocket client with
+        its progress events and the response, both tagged with "ref"."""
+        trace = Trace()
+        try:
+            with trace.span(DECODE):
+                body = json.loads(message)
+            if not isinstance(body, dict):
+                raise ValueError("Expected a JSON object.")
+        except ValueError as e:
+            socket.send_json({"status": protocol.STATUS_ERROR, "error": str(e)})
+            return
+        ref = body.get("ref")
+        kind = body.get("type", "speak")
+        progress = WebSocketProgress(socket, ref, trace)
+        try:
+            if kind == "audio":
+                response = self.server.api.handle("audio", body, progress)
+                audio = response.pop("audio", None)
+            else:
+                response = self.server.api.handle(kind, body, progress)
+                audio = None
+        except Exception as e:
+            response = {"status": protocol.STATUS_ERROR, "error": str(e)}
+            audio = None
+        response["ref"] = ref
+        try:
+            socket.send_json(response)
+            if audio is not None:
+                # The audio follows its response as binary messages
+                socket.send_bytes(audio)
+                socket.send_json(
+                    {"status": protocol.STATUS_EVENT, "event": "audio_end", "ref": ref}
+                )
+        except OSError as e:
+            logging.info(f"WebSocket client went away before its response: {e}")
+
+
+class HttpApi:
+    """Loopback HTTP and WebSocket API of the running server.
+
+    Requests go through PipeServer.run_request, the same path as requests from
+    client.py, so they are processed by the tray app or the daemon alike.
+
+    Every request must carry the token of the install, see load_token, and be
+    addressed to a loopback host name. Requests of web pages must come from one
+    of the allowed origins, and POST bodies must be application/json, so that
+    other pages open in a browser on the machine cannot use the API.
+
+    HTTP endpoints, all answering {"status": ..., "result": ...}:
+        POST /speak {"text", ...}: translate and speak.
+        POST /translate {"text", ...}: translate only.
+        GET or POST /voices: voices of the configured engine.
+        POST /batch {"texts", "mode"}: see request_handler.process_batch.
+        POST /stop: stop speaking and drop the waiting requests.
+        GET /jobs: id, state and state timestamps of the recent requests.
+        GET /cache/stats: audio and config cache, queue and span statistics.
+
+    Requests select their config like client.py does, with "config_path",
+    "profile", "config" or "config_hash" (answered with 409 when unknown), and
+    may set client.py "args", "interrupt" and "priority". GET /ws?token=... opens a WebSocket taking the
+    same requests as {"type": "speak" | "translate" | "voices" | "batch" |
+    "audio" | "stop" | "stats", "ref": ...} text messages. It streams progress events of each request and,
+    for "audio", the synthesized audio file as binary messages.
+    """
+
+    def __init__(
+        self, server, host=HTTP_HOST, port=HTTP_PORT, token=None, origins=None
+    ):
+        self.server = server
+        self.token = token or load_token()
+        self.origins = HTTP_ORIGINS if origins is None else origins
+        self.httpd = ThreadingHTTPServer((host, port), ApiHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = self
+
+    def serve_forever(self):
+        logging.info(f"HTTP API listening on {self.httpd.server_address}.")
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, kind, body, progress):
+        """Turn an API request into a pipe request and run it.
+
+        Args:
+            kind (str): "speak", "translate", "voices", "batch", "audio", "stop",
+                "jobs" or "stats".
+            body (dict): Request fields.
+            progress (Progress): Progress events of the request.
+        Returns:
+            dict: The response.
+        """
+        if kind == "stats":
+            return {"status": protocol.STATUS_OK, "result": self.stats()}
+        if kind == "jobs":
+            return {
+                "status": protocol.STATUS_OK,
+                "result": self.server.scheduler.stats(),
+            }
+        if kind == "stop":
+            return {"status": protocol.STATUS_OK, "result": self.server.stop_speaking()}
+        message = {key: body[key] for key in CONFIG_FIELDS if key in body}
+        if "interrupt" in body:
+            message["interrupt"] = bool(body["interrupt"])
+        if body.get("priority") in PRIORITIES:
+            message["priority"] = body["priority"]
+        message["args"] = dict(DEFAULT_ARGS, **(body.get("args") or {}))
+        match kind:
+            case "speak":
+                message["clipboard_text"] = self.text(body)
+            case "translate":
+                message["clipboard_text"] = self.text(body)
+                message["speak"] = False
+            case "voices":
+                message["clipboard_text"] = ""
+                message["args"]["listvoices"] = True
+            case "batch":
+                message["batch"] = {
+                    "texts": body.get("texts") or [],
+                    "mode": body.get("mode", "speak"),
+                }
+            case "audio":
+                message["batch"] = {"texts": [self.text(body)], "mode": "cache"}
+                # The caller waits for the audio, unlike for other cache batches
+                message.setdefault("priority", SPEAK)
+            case _:
+                raise ApiError(404, f"Unknown request type {kind}")
+        with progress.trace.span(CONFIG):
+            entry = self.server.find_config(message)
+        if entry is None:
+            return {"status": protocol.STATUS_CONFIG_REQUIRED}
+        message["config_entry"] = entry
+        response = self.server.run_request(message, progress)
+        if kind == "audio" and response["status"] == protocol.STATUS_OK:
+            item = response["result"]["items"][0]
+            if item["status"] != protocol.STATUS_OK:
+                return {"status": protocol.STATUS_ERROR, "error": item["error"]}
+            with open(item["file"], "rb") as f:
+                response["audio"] = f.read()
+            response["result"] = item
+        return response
+
+    @staticmethod
+    def text(body):
+        text = body.get("text")
+        if not isinstance(text, str):
+            raise ApiError(400, 'Missing "text".')
+        return text
+
+    def stats(self):
+        return self.server.stats()
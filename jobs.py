@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+
+from cancellation import Cancelled, CancelToken
+from progress import CANCELLED
+from request_queue import (
+    FOREGROUND,
+    PRIORITIES,
+    RequestDropped,
+    RequestQueue,
+    priority_class,
+)
+
+# States of a job, in the order a job normally goes through them
+QUEUED = "queued"
+RUNNING = "running"
+PLAYING = "playing"
+DONE = "done"
+# Final states of a job that did not get there
+FAILED = "failed"
+CANCELLED_STATE = "cancelled"
+DROPPED = "dropped"
+FINAL_STATES = (DONE, FAILED, CANCELLED_STATE, DROPPED)
+
+# Seconds to wait for the outcome of a request, per text of a batch
+RESPONSE_TIMEOUT = 120
+# Whether a new request stops the one being spoken, unless the request says otherwise
+INTERRUPT = os.environ.get("AACSPEAKHELPER_INTERRUPT", "") == "1"
+# Number of finished jobs kept for GET /jobs
+JOB_HISTORY = 50
+# Seconds the scheduler waits for a job before checking whether to stop
+POLL_INTERVAL = 1
+# Jobs dispatched and not done playing at once: one playing while the next ones
+# are translated and synthesized
+PIPELINE_DEPTH = int(os.environ.get("AACSPEAKHELPER_PIPELINE_DEPTH", 2))
+
+
+class Job:
+    """One request, from being accepted until it is done playing.
+
+    Its future is resolved with the result once the request handler completes it.
+    The job is only done when its progress is finished as well, which may be after
+    the result was sent while the text is still being spoken.
+    """
+
+    def __init__(self, message):
+        self.id = message["id"]
+        self.message = message
+        self.progress = message["progress"]
+        self.cancel_token = message.setdefault("cancel_token", CancelToken())
+        self.priority = priority_class(message)
+        self.future = Future()
+        self.lock = threading.Lock()
+        self.state = None
+        # Time each state was entered, by state
+        self.timestamps = {}
+        self.result = None
+        self.error = None
+        self.set_state(QUEUED)
+
+    def set_state(self, state):
+        self.state = state
+        self.timestamps[state] = time.time()
+        logging.debug(f"Job {self.id} is {state}.")
+
+    @property
+    def timeout(self):
+        """Seconds to wait for the outcome of the job, longer for batches."""
+        texts = len(self.message.get("batch", {}).get("texts") or [])
+        return RESPONSE_TIMEOUT * (texts or 1)
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def start(self):
+        with self.lock:
+            if self.future.done():
+                return False
+            self.set_state(RUNNING)
+            return True
+
+    def complete(self, result=None, error=None):
+        """Set the outcome of the job.
+
+        Args:
+            result: Result of the request handler.
+            error (Exception): Set instead of result when the request failed.
+        Returns:
+            bool: False if the job already had its outcome.
+        """
+        with self.lock:
+            if self.future.done():
+                return False
+            if error is not None:
+                self.error = error
+                if isinstance(error, Cancelled):
+                    self.set_state(CANCELLED_STATE)
+                elif isinstance(error, RequestDropped):
+                    self.set_state(DROPPED)
+                else:
+                    self.set_state(FAILED)
+            else:
+                self.result = result
+                if self.progress.finished.is_set():
+                    self.set_state(DONE)
+                else:
+                    self.set_state(PLAYING)
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+        return True
+
+    def finish(self):
+        """Mark the job done once its progress is finished."""
+        with self.lock:
+            if self.state in (RUNNING, PLAYING):
+                self.set_state(CANCELLED_STATE if self.cancel_token.cancelled else DONE)
+
+    def to_dict(self):
+        summary = {
+            "id": self.id,
+            "priority": self.priority,
+            "state": self.state,
+            "timestamps": dict(self.timestamps),
+        }
+        if self.error is not None:
+            summary["error"] = str(self.error)
+        return summary
+
+
+class Scheduler:
+    """Runs jobs in the order the RequestQueue admits them.
+
+    A job is handed to dispatch, which must arrange for complete() to be called.
+    The next job is dispatched once the previous one has its result, which is when
+    its text was translated and handed to the synthesis and playback pipeline, so
+    that it is translated and synthesized while the previous one plays. At most
+    depth foreground jobs are in flight until they are done playing.
+
+    Jobs of the lower priority classes are only dispatched when no job is in
+    flight, one at a time, and are not waited for. A background job that is still
+    running when a foreground job arrives waits for foreground_idle between its
+    items, so the user's speech gets the CPU and network first.
+    """
+
+    def __init__(self, dispatch, queue=None, depth=PIPELINE_DEPTH):
+        self.dispatch = dispatch
+        self.queue = queue if queue is not None else RequestQueue()
+        self.depth = max(1, depth)
+        # Jobs by id, the oldest finished ones are forgotten after JOB_HISTORY
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        # Jobs passed to dispatch and not done playing yet, oldest first
+        self.active = []
+        # Set while no foreground job is in flight
+        self.foreground_idle = threading.Event()
+        self.foreground_idle.set()
+
+    def submit(self, message):
+        """Create the job of a request and queue it.
+
+        Args:
+            message (dict): Request with its "id", "config_entry" and "progress".
+        Returns: Job
+        """
+        job = Job(message)
+        with self.lock:
+            self.jobs[job.id] = job
+            finished = [old.id for old in self.jobs.values() if old.finished]
+            for old_id in finished[: max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[old_id]
+        self.queue.put(job)
+        if message.get("interrupt", INTERRUPT) and not job.future.done():
+            # Barge in: the new request is spoken as soon as the current stops
+            self.cancel_active()
+        return job
+
+    def complete(self, request_id, result=None, error=None):
+        with self.lock:
+            job = self.jobs.get(request_id)
+        if job is None or not job.complete(result, error):
+            logging.warning(f"No client waiting for request {request_id}.")
+
+    def foreground(self):
+        """Foreground jobs in flight. Call with the lock held."""
+        return [job for job in self.active if job.priority in FOREGROUND]
+
+    def priorities(self):
+        """Priority classes that may be dispatched now: lower classes only start
+        when nothing at all is in flight."""
+        return PRIORITIES if not self.active else FOREGROUND
+
+    def cancel_active(self):
+        """Stop translation, synthesis and playback of the foreground jobs in
+        flight. Background work goes on.
+
+        Returns:
+            bool: False if no job was being processed.
+        """
+        with self.lock:
+            jobs = [job for job in self.foreground() if not job.cancel_token.cancelled]
+        for job in jobs:
+            logging.info(f"Cancelling request {job.id}.")
+            job.progress.emit(CANCELLED)
+            job.cancel_token.cancel()
+        return bool(jobs)
+
+    def stop_speaking(self):
+        """Handle a stop request: cancel the foreground jobs and drop the waiting
+        ones.
+
+        Returns:
+            dict: {"cancelled": bool, "dropped": number of dropped requests}
+        """
+        dropped = self.queue.clear(priorities=FOREGROUND)
+        return {"cancelled": self.cancel_active(), "dropped": dropped}
+
+    def run(self, stopping):
+        """Pass queued jobs to dispatch until stopping is set, each foreground job
+        once the previous one has its result and fewer than depth are in flight.
+
+        Args:
+            stopping (threading.Event): Set to stop the scheduler.
+        Returns: None
+        """
+        while not stopping.is_set():
+            with self.condition:
+                ready = self.condition.wait_for(
+                    lambda: len(self.foreground()) < self.depth,
+                    timeout=POLL_INTERVAL,
+                )
+                now = time.time()
+                stale = [
+                    job
+                    for job in self.active
+                    if now - job.timestamps[RUNNING] > job.timeout
+                ]
+            for job in stale:
+                logging.warning(f"Request {job.id} is still running, moving on.")
+                self.finish(job)
+            if not ready:
+                continue
+            job = self.queue.get(timeout=POLL_INTERVAL, priorities=self.priorities)
+            if job is None or not job.start():
+                continue
+            with self.lock:
+                self.active.append(job)
+                if job.priority in FOREGROUND:
+                    self.foreground_idle.clear()
+                else:
+                    job.message["foreground_idle"] = self.foreground_idle
+            job.progress.on_finish(lambda job=job: self.finish(job))
+            try:
+                self.dispatch(job.message)
+                if job.priority in FOREGROUND:
+                    wait([job.future], timeout=job.timeout)
+            except Exception as e:
+                logging.error(f"Could not dispatch request: {e}", exc_info=True)
+                job.complete(error=e)
+                job.progress.finish()
+            if job.priority in FOREGROUND and not job.future.done():
+                logging.error(f"Request {job.id} timed out.")
+                job.complete(error=TimeoutError("Request timed out."))
+                job.progress.finish()
+
+    def finish(self, job):
+        """Mark a job done once its progress is finished and make room for the
+        next one."""
+        job.finish()
+        with self.condition:
+            if job in self.active:
+                self.active.remove(job)
+            if not self.foreground():
+                self.foreground_idle.set()
+            self.condition.notify_all()
+        self.queue.wake()
+
+    def stats(self):
+        """Recent jobs, oldest first."""
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
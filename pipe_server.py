@@ -0,0 +1,395 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import protocol
+import throttle
+import tracing
+import translate_utils
+import translation_cache
+import transport
+import utils
+from config_cache import ConfigCache, profile_path
+from http_api import HTTP_PORT, HttpApi
+from jobs import RESPONSE_TIMEOUT, Scheduler
+from progress import ACCEPTED, ERROR, Progress
+from request_queue import (
+    BACKGROUND,
+    COALESCE_WINDOW,
+    QUEUE_POLICY,
+    QUEUE_SIZE,
+    RequestQueue,
+)
+from tracing import CONFIG, DECODE, Trace
+
+# Number of pipe instances listening for clients at the same time
+PIPE_INSTANCES = 4
+# Number of connections handled in parallel, most of them wait in the request queue
+HANDLER_WORKERS = 16
+# Seconds a listener waits for a client before checking whether to stop
+ACCEPT_TIMEOUT = 1
+# Whether the default config is warmed up at start and whenever it changed
+WARMUP = os.environ.get("AACSPEAKHELPER_WARMUP", "1") != "0"
+# Whether the warm-up also synthesizes a short text that is not played
+WARMUP_PROBE = os.environ.get("AACSPEAKHELPER_WARMUP_PROBE", "") == "1"
+# Seconds between checks whether the default config changed
+WARMUP_INTERVAL = 5
+
+
+def default_config_version():
+    """Path and modification time of the default settings.cfg, the time None when
+    it does not exist."""
+    config_path, _ = utils.get_paths()
+    try:
+        return config_path, os.path.getmtime(config_path)
+    except OSError:
+        return config_path, None
+
+
+class PipeServer:
+    """Serves clients over several listening pipe instances at once and hands
+    each connection to a bounded pool of handler threads.
+
+    Each request becomes a Job that the Scheduler passes to dispatch one at a time,
+    the next one once the previous has been played. dispatch must arrange for
+    complete() to be called with the outcome. This keeps the server independent of
+    whether requests are processed by the Qt tray app or the headless daemon.
+
+    With warmup, the translator, TTS client and audio device of the default config
+    are built by a background request when the server starts and again whenever
+    the config file changes, so that the first request does not wait for them.
+    """
+
+    def __init__(
+        self,
+        dispatch,
+        instances=PIPE_INSTANCES,
+        workers=HANDLER_WORKERS,
+        transport_kind=None,
+        address=None,
+        http_port=HTTP_PORT,
+        queue_size=QUEUE_SIZE,
+        queue_policy=QUEUE_POLICY,
+        coalesce_window=COALESCE_WINDOW,
+        warmup=WARMUP,
+        warmup_probe=WARMUP_PROBE,
+    ):
+        self.scheduler = Scheduler(
+            dispatch, RequestQueue(queue_size, queue_policy, coalesce_window)
+        )
+        self.transport = transport.get_transport(transport_kind, address)
+        self.config_cache = ConfigCache()
+        self.instances = instances
+        self.workers = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="PipeHandler"
+        )
+        # A listener only accepts a client once a handler is free to take it
+        self.slots = threading.BoundedSemaphore(workers)
+        self.stopping = threading.Event()
+        self.warmup = warmup
+        self.warmup_probe = warmup_probe
+        # Config and outcome of the last warm-up that ran
+        self.last_warmup = None
+        self.http_api = None
+        if http_port:
+            try:
+                self.http_api = HttpApi(self, port=http_port)
+            except OSError as e:
+                logging.error(f"Could not start the HTTP API on port {http_port}: {e}")
+
+    def complete(self, request_id, result=None, error=None):
+        """Deliver the outcome of a request to the connection waiting for it.
+
+        Args:
+            request_id (str): The "id" of the request.
+            result: Result to send back to the client.
+            error (Exception): Set instead of result when the request failed.
+        Returns: None
+        """
+        self.scheduler.complete(request_id, result, error)
+
+    def find_config(self, message):
+        """Find the config of a request from its inline config or its hash.
+
+        Requests from thin clients carry neither config nor hash, only an optional
+        "config_path" or "profile", and the server loads that file itself.
+
+        Args:
+            message (dict): Decoded request.
+        Returns:
+            ConfigEntry, None when the request only has a hash the server does not know.
+        """
+        config_dict = message.pop("config", None)
+        if config_dict is not None:
+            return self.config_cache.add(config_dict)
+        if "config_hash" in message:
+            return self.config_cache.get(message["config_hash"])
+        if message.get("profile"):
+            return self.config_cache.load(profile_path(message["profile"]))
+        return self.config_cache.load(message.get("config_path", ""))
+
+    def resolve_config(self, connection, message):
+        """Find the config of a request by its hash, asking the client for the
+        full config only when it is not cached yet.
+
+        Args:
+            connection: Transport connection of the request.
+            message (dict): Decoded request.
+        Returns: ConfigEntry
+        """
+        entry = self.find_config(message)
+        if entry is not None:
+            return entry
+        protocol.write_message(connection, {"status": protocol.STATUS_CONFIG_REQUIRED})
+        reply = protocol.read_message(connection)
+        config_dict = reply.get("config") if isinstance(reply, dict) else None
+        if config_dict is None:
+            raise protocol.ProtocolError("Client did not send its config.")
+        return self.config_cache.add(config_dict)
+
+    def run_request(self, message, progress):
+        """Dispatch a request whose config is resolved and wait for its outcome.
+
+        Shared by the pipe connections and the HTTP API.
+
+        Args:
+            message (dict): Decoded request with its "config_entry".
+            progress (Progress): Progress events of the request.
+        Returns:
+            dict: The response, {"status": "ok", "result": ...} or
+            {"status": "error", "error": ...}.
+        """
+        request_id = message["id"] = uuid.uuid4().hex
+        message["progress"] = progress
+        progress.emit(ACCEPTED, id=request_id)
+        job = self.scheduler.submit(message)
+        try:
+            response = {
+                "status": protocol.STATUS_OK,
+                "result": job.future.result(timeout=job.timeout),
+            }
+        except FutureTimeoutError:
+            logging.error(f"Request {request_id} timed out.")
+            job.complete(error=TimeoutError("Request timed out."))
+            response = {"status": protocol.STATUS_ERROR, "error": "Request timed out."}
+        except Exception as e:
+            response = {"status": protocol.STATUS_ERROR, "error": str(e)}
+        if response["status"] == protocol.STATUS_ERROR:
+            progress.emit(ERROR, error=response["error"])
+            progress.finish()
+        return response
+
+    def warm_up(self, entry):
+        """Warm up a config with a background request and wait for it to be done.
+
+        Args:
+            entry (ConfigEntry): Config to warm up.
+        Returns:
+            dict: The response, as returned by run_request.
+        """
+        message = {
+            "args": dict(utils.args),
+            "config_entry": entry,
+            "warmup": {"probe": self.warmup_probe},
+            "priority": BACKGROUND,
+        }
+        response = self.run_request(message, Progress())
+        if response["status"] == protocol.STATUS_OK:
+            self.last_warmup = {"config": entry.fingerprint[:12], **response["result"]}
+        return response
+
+    def watch_config(self):
+        """Warm up the default config, and again whenever it changed, until stop()
+        is called.
+
+        A config that cannot be loaded, e.g. a missing settings.cfg on first run,
+        is logged once and only tried again once the file changes.
+        """
+        warmed = None
+        failed = None
+        while not self.stopping.is_set():
+            version = default_config_version()
+            if version != failed:
+                try:
+                    entry = self.config_cache.load()
+                    failed = None
+                    if entry.fingerprint != warmed:
+                        # Not retried when it fails, only once the config changes
+                        warmed = entry.fingerprint
+                        self.warm_up(entry)
+                except Exception as e:
+                    failed = version
+                    logging.warning(
+                        f"Could not warm up the default config: {e}. Trying again "
+                        "once it changes."
+                    )
+            self.stopping.wait(WARMUP_INTERVAL)
+
+    def stop_speaking(self):
+        """Handle a stop request, see Scheduler.stop_speaking."""
+        return self.scheduler.stop_speaking()
+
+    def serve_forever(self):
+        """Listen for clients until stop() is called."""
+        self.transport.listen()
+        logging.info(
+            f"Waiting for client connections on {self.instances} pipe instances..."
+        )
+        listeners = [
+            threading.Thread(target=self.listen, name=f"PipeListener-{i}", daemon=True)
+            for i in range(self.instances)
+        ]
+        listeners.append(
+            threading.Thread(
+                target=self.scheduler.run,
+                args=(self.stopping,),
+                name="Scheduler",
+                daemon=True,
+            )
+        )
+        if self.warmup:
+            listeners.append(
+                threading.Thread(target=self.watch_config, name="Warmup", daemon=True)
+            )
+        if self.http_api is not None:
+            listeners.append(
+                threading.Thread(
+                    target=self.http_api.serve_forever, name="HttpApi", daemon=True
+                )
+            )
+        for listener in listeners:
+            listener.start()
+        for listener in listeners:
+            listener.join()
+
+    def listen(self):
+        while not self.stopping.is_set():
+            if not self.slots.acquire(timeout=ACCEPT_TIMEOUT):
+                continue
+            connection = None
+            try:
+                connection = self.transport.accept(timeout=ACCEPT_TIMEOUT)
+            except Exception as e:
+                if not self.stopping.is_set():
+                    logging.error(f"Pipe server error: {e}", exc_info=True)
+                    time.sleep(ACCEPT_TIMEOUT)
+            if connection is None:
+                self.slots.release()
+                continue
+            logging.info("Client connected.")
+            try:
+                self.workers.submit(self.handle_connection, connection)
+            except RuntimeError:
+                # The pool was shut down while we were waiting for the client
+                connection.close()
+                self.slots.release()
+
+    def stats(self):
+        """Audio, translation and config cache, translator pool, provider limits,
+        queue, span and warm-up statistics, answering stats requests of the clients
+        and GET /cache/stats."""
+        with self.config_cache.lock:
+            configs = len(self.config_cache.entries)
+        return {
+            **utils.cache_stats(utils.audio_files_path),
+            "translations": translation_cache.get_cache(utils.audio_files_path).stats(),
+            "translators": translate_utils.pool.stats(),
+            "providers": throttle.stats(),
+            "configs": configs,
+            "queue": self.scheduler.queue.stats(),
+            "spans": tracing.stats.summary(),
+            "warmup": self.last_warmup,
+        }
+
+    def status(self):
+        """Jobs in flight and waiting, span and warm-up statistics, answering
+        status requests. Unlike stats() it does not count the audio files, so the
+        tray can ask for it every second."""
+        with self.scheduler.lock:
+            in_flight = len(self.scheduler.active)
+        with self.scheduler.queue.condition:
+            waiting = len(self.scheduler.queue)
+        return {
+            "in_flight": in_flight,
+            "waiting": waiting,
+            "spans": tracing.stats.summary(),
+            "warmup": self.last_warmup,
+        }
+
+    def send_error(self, connection, progress, error):
+        """Tell the client that its request failed before it got a response, as
+        long as it is still listening.
+
+        Args:
+            connection: Transport connection of the request.
+            progress (Progress): Progress events of the request, None before the
+                request had any.
+            error (Exception): Why the request failed.
+        Returns: None
+        """
+        response = {"status": protocol.STATUS_ERROR, "error": str(error)}
+        if progress is not None:
+            progress.write(response)
+            return
+        try:
+            protocol.write_message(connection, response)
+        except Exception as e:
+            logging.info(f"Could not send the error to the client: {e}")
+
+    def handle_connection(self, connection):
+        progress = None
+        response = None
+        trace = Trace()
+        try:
+            with trace.span(DECODE):
+                message = protocol.read_message(connection)
+            if message is None:
+                return
+            logging.info(f"Received data: {str(message)[:50]}...")
+            if message.get("stop"):
+                response = {
+                    "status": protocol.STATUS_OK,
+                    "result": self.stop_speaking(),
+                }
+                protocol.write_message(connection, response)
+                return
+            if message.get("stats"):
+                response = {"status": protocol.STATUS_OK, "result": self.stats()}
+                protocol.write_message(connection, response)
+                return
+            if message.get("status"):
+                response = {"status": protocol.STATUS_OK, "result": self.status()}
+                protocol.write_message(connection, response)
+                return
+            with trace.span(CONFIG):
+                message["config_entry"] = self.resolve_config(connection, message)
+            progress = Progress(
+                connection, streaming=bool(message.get("events")), trace=trace
+            )
+            response = self.run_request(message, progress)
+            progress.write(response)
+            if progress.streaming:
+                # Keep streaming until playback of the utterance is done
+                progress.finished.wait(timeout=RESPONSE_TIMEOUT)
+            logging.info("Processing complete. Ready for next connection.")
+        except Exception as e:
+            logging.error(f"Pipe server error: {e}", exc_info=True)
+            if response is None:
+                self.send_error(connection, progress, e)
+        finally:
+            if progress is not None:
+                progress.close()
+            connection.close()
+            self.slots.release()
+            logging.info("Pipe closed.")
+
+    def stop(self):
+        self.stopping.set()
+        if self.http_api is not None:
+            self.http_api.stop()
+        self.transport.close()
+        self.workers.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import tts_utils
+import utils
+from jobs import RESPONSE_TIMEOUT
+from progress import ERROR, FIRST_AUDIO, PLAYBACK_DONE
+
+
+class Utterance:
+    """Translated text on its way through synthesis and playback.
+
+    file is set by the synthesis stage when the audio was rendered ahead. Without
+    it the playback stage speaks the text directly. The file is only added to the
+    audio cache with the save_audio_file option, like speaking directly does,
+    otherwise it is temporary and deleted once played.
+    """
+
+    def __init__(self, text, context):
+        self.text = text
+        self.context = context
+        self.file = None
+        self.temporary = False
+
+
+class Pipeline:
+    """Synthesis and playback stages of the requests, each on its own thread with a
+    queue in between.
+
+    Requests are received and translated by the PipeServer and the request handler,
+    then submitted here. While one utterance plays, the next is looked up in the
+    audio cache or synthesized into it, so that it starts as soon as the first one
+    ends. When nothing is playing, the utterance is streamed right away instead,
+    which gets the first audio out sooner than rendering the whole file.
+
+    Utterances are played in the order they are submitted. The pipeline finishes
+    the progress of each utterance once it was played, cancelled or failed, or
+    cancels it when it is not done within RESPONSE_TIMEOUT so that the next ones
+    are still played.
+    """
+
+    def __init__(self):
+        self.synthesis = queue.Queue()
+        self.playback = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        # Set while the playback stage is speaking an utterance
+        self.playing = threading.Event()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            self.threads = [
+                threading.Thread(target=self.synthesize, name="Synthesis", daemon=True),
+                threading.Thread(target=self.play, name="Playback", daemon=True),
+            ]
+            for thread in self.threads:
+                thread.start()
+
+    def submit(self, text, context):
+        """Queue translated text to be synthesized and spoken.
+
+        The progress of context is finished by the pipeline once the text was
+        played, cancelled or failed, so the caller must not finish it.
+
+        Args:
+            text (str): Text to speak.
+            context (RequestContext): Context of the request.
+        Returns: None
+        """
+        self.start()
+        self.synthesis.put(Utterance(text, context))
+
+    @property
+    def idle(self):
+        return not self.playing.is_set() and self.playback.empty()
+
+    def synthesize(self):
+        while True:
+            utterance = self.synthesis.get()
+            context = utterance.context
+            try:
+                if context.cancel_token.cancelled:
+                    context.progress.finish()
+                    continue
+                if not self.idle and tts_utils.can_render_ahead(context):
+                    cache = context.config.getboolean(
+                        "TTS", "save_audio_file", fallback=False
+                    )
+                    utterance.file, cached = tts_utils.render(
+                        utterance.text, context, cache=cache
+                    )
+                    utterance.temporary = not cache and not cached
+                self.playback.put(utterance)
+            except Exception as e:
+                logging.error(f"Error during TTS processing: {e}", exc_info=True)
+                context.progress.emit(ERROR, error=str(e))
+                context.progress.finish()
+
+    def play(self):
+        while True:
+            utterance = self.playback.get()
+            context = utterance.context
+            self.playing.set()
+            deadline = time.monotonic() + RESPONSE_TIMEOUT
+            # Stops an utterance that stalls in the engine or the audio device
+            watchdog = threading.Timer(RESPONSE_TIMEOUT, self.timed_out, (context,))
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                if context.cancel_token.cancelled:
+                    continue
+                if utterance.file is not None:
+                    context.progress.emit(FIRST_AUDIO)
+                    utils.play_audio(
+                        utterance.file, file=True, cancel_token=context.cancel_token
+                    )
+                    context.progress.emit(PLAYBACK_DONE)
+                    continue
+                player = tts_utils.speak(utterance.text, context=context)
+                if player is not None:
+                    # Streamed on a thread of the TTS client
+                    player.join(timeout=max(0, deadline - time.monotonic()))
+                    if player.is_alive():
+                        self.timed_out(context)
+            except Exception as e:
+                logging.error(f"Error during playback: {e}", exc_info=True)
+                context.progress.emit(ERROR, error=str(e))
+            finally:
+                watchdog.cancel()
+                if utterance.temporary:
+                    self.remove(utterance.file)
+                context.progress.finish()
+                self.playing.clear()
+
+    def remove(self, file):
+        """Delete a temporary file an utterance was rendered into."""
+        try:
+            os.remove(file)
+        except OSError as e:
+            logging.warning(f"Could not delete {file}: {e}")
+
+    def timed_out(self, context):
+        """Cancel an utterance that was not done playing within RESPONSE_TIMEOUT."""
+        if context.cancel_token.cancelled:
+            return
+        logging.error(f"Playback took over {RESPONSE_TIMEOUT} seconds, stopping it.")
+        context.progress.emit(ERROR, error="Playback timed out.")
+        context.cancel_token.cancel()
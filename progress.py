@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+
+import protocol
+import tracing
+from tracing import FIRST_BYTE, PLAYBACK_END, PLAYBACK_START, Trace
+
+ACCEPTED = "accepted"
+TRANSLATED = "translated"
+CACHE_HIT = "cache_hit"
+CACHE_MISS = "cache_miss"
+SYNTHESIS_STARTED = "synthesis_started"
+FIRST_AUDIO = "first_audio"
+PLAYBACK_DONE = "playback_done"
+CANCELLED = "cancelled"
+ERROR = "error"
+
+
+class Progress:
+    """Progress events of one request, streamed to the client if it asked for them.
+
+    Events are sent as {"status": "event", "event": name, "time": ..., "elapsed": ...}
+    frames on the request connection, ahead of and after the final response.
+    The request is finished by the request handler once the response is ready, or
+    by the pipeline once its text was played when it was handed to the pipeline.
+
+    Its trace times the stages of the request. The synthesis and playback spans are
+    taken from the events, and the trace is added to tracing.stats once the
+    request is finished.
+    """
+
+    def __init__(
+        self, connection=None, streaming=False, parent=None, trace=None, **fields
+    ):
+        self.connection = connection
+        self.streaming = streaming
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.callbacks = []
+        self.parent = parent
+        self.trace = trace or Trace()
+        # Added to every event, e.g. the index of a batch item
+        self.fields = fields
+
+    def item(self, **fields):
+        """Progress of one item of a batch request, streamed on the same connection.
+
+        Args:
+            **fields: Added to every event of the item, e.g. index=3.
+        Returns: Progress
+        """
+        item = Progress(
+            streaming=self.streaming, parent=self, trace=self.trace, **fields
+        )
+        item.started = self.started
+        return item
+
+    def write(self, message):
+        """Send a frame to the client unless it went away."""
+        if self.parent is not None:
+            self.parent.write(message)
+            return
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                protocol.write_message(self.connection, message)
+            except Exception as e:
+                logging.info(f"Client stopped listening to events: {e}")
+                self.connection = None
+
+    def emit(self, event, **data):
+        """Send one event with its timestamp.
+
+        Args:
+            event (str): One of the event names defined in this module.
+            **data: Extra fields, e.g. the translated text.
+        Returns: None
+        """
+        now = time.time()
+        logging.debug(f"Event {event} after {now - self.started:0.3f} seconds.")
+        if event == SYNTHESIS_STARTED:
+            self.trace.begin(FIRST_BYTE)
+        elif event == FIRST_AUDIO:
+            self.trace.end(FIRST_BYTE)
+            self.trace.mark(PLAYBACK_START)
+        elif event == PLAYBACK_DONE:
+            self.trace.mark(PLAYBACK_END)
+        if not self.streaming:
+            return
+        self.write(
+            {
+                "status": protocol.STATUS_EVENT,
+                "event": event,
+                "time": now,
+                "elapsed": now - self.started,
+                **self.fields,
+                **data,
+            }
+        )
+
+    def finish(self):
+        """Mark the request as done, no more events will follow."""
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        if self.parent is None:
+            tracing.stats.add(self.trace)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error after finishing a request: {e}", exc_info=True)
+
+    def on_finish(self, callback):
+        """Call callback once the request is finished, right away if it already is."""
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def close(self):
+        with self.lock:
+            self.connection = None
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import marshal
+import struct
+
+# Every message is one frame: an 8 byte header followed by the encoded body.
+#   magic (2s) | version (B) | codec (B) | body length (I), big-endian
+MAGIC = b"AH"
+VERSION = 1
+HEADER = struct.Struct(">2sBBI")
+CODEC_JSON = 0
+CODEC_MARSHAL = 1
+MARSHAL_VERSION = 4
+CHUNK_SIZE = 64 * 1024
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Final response of a request: {"status": "ok", "result": ...} or
+# {"status": "error", "error": "..."}
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+# Progress event streamed ahead of (and after) the final response when the request
+# has "events": True, see progress.py
+STATUS_EVENT = "event"
+# Sent by the server when it does not know the config_hash of a request.
+# The client answers on the same connection with {"config": {...}}.
+STATUS_CONFIG_REQUIRED = "config_required"
+# Priority classes a request can name in "priority", highest first: grid speech,
+# configure GUI previews, voice lists and background pre-synthesis (batches in
+# cache mode). Here so that clients need not import the request queue.
+SPEAK = "speak"
+PREVIEW = "preview"
+LISTVOICES = "listvoices"
+BACKGROUND = "background"
+PRIORITIES = (SPEAK, PREVIEW, LISTVOICES, BACKGROUND)
+
+
+class ProtocolError(Exception):
+    """Raised when a frame is malformed or uses an unsupported version or codec."""
+
+
+def encode(message, codec=CODEC_MARSHAL):
+    """Encode a message body.
+
+    marshal is used by default since it is compact and decodes several times faster
+    than json. Anything marshal cannot represent falls back to JSON.
+
+    Args:
+        message: dict, list, str, int, float, bool or None (nested).
+        codec (int): CODEC_MARSHAL or CODEC_JSON.
+    Returns: Tuple of codec and encoded bytes
+    """
+    if codec == CODEC_MARSHAL:
+        try:
+            return CODEC_MARSHAL, marshal.dumps(message, MARSHAL_VERSION)
+        except ValueError:
+            pass
+    return CODEC_JSON, json.dumps(message, separators=(",", ":"), default=str).encode()
+
+
+def decode(codec, body):
+    """Decode a message body produced by encode().
+
+    Args:
+        codec (int): Codec id from the frame header.
+        body (bytes): Encoded body.
+    Returns: Decoded message
+    """
+    try:
+        if codec == CODEC_MARSHAL:
+            return marshal.loads(body)
+        if codec == CODEC_JSON:
+            return json.loads(body)
+    except (EOFError, TypeError, ValueError) as error:
+        raise ProtocolError(f"Malformed message body: {error}") from error
+    raise ProtocolError(f"Unsupported codec: {codec}")
+
+
+def write_message(connection, message, codec=CODEC_MARSHAL):
+    """Encode a message and write it as one frame, in CHUNK_SIZE pieces.
+
+    Args:
+        connection: Transport connection.
+        message: Message to send.
+        codec (int): Preferred codec.
+    Returns: None
+    """
+    codec, body = encode(message, codec)
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Message of {len(body)} bytes is too large")
+    connection.send(HEADER.pack(MAGIC, VERSION, codec, len(body)))
+    view = memoryview(body)
+    for start in range(0, len(body), CHUNK_SIZE):
+        connection.send(view[start : start + CHUNK_SIZE])
+
+
+def read_exactly(connection, size):
+    """Read exactly size bytes into a buffer allocated once up front.
+
+    Returns:
+        bytearray: The data, or None if the connection closed before any byte was read.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received : received + CHUNK_SIZE])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError("Connection closed in the middle of a frame")
+        received += count
+    return buffer
+
+
+def read_message(connection):
+    """Read and decode one frame.
+
+    Args:
+        connection: Transport connection.
+    Returns: Decoded message, or None if the other end closed the connection.
+    """
+    header = read_exactly(connection, HEADER.size)
+    if header is None:
+        return None
+    magic, version, codec, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("Not an AACSpeakHelper frame")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes is too large")
+    body = read_exactly(connection, length)
+    if body is None:
+        raise ProtocolError("Connection closed before the frame body")
+    return decode(codec, body)
+
+
+def config_fingerprint(config):
+    """Content hash identifying a config dict, independent of key order.
+
+    Args:
+        config (dict): Config sections mapped to their options.
+    Returns: str
+    """
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,64 @@
+from cancellation import CancelToken
+from progress import Progress
+
+# Seconds between checks whether background work waiting for the foreground was
+# cancelled
+IDLE_POLL = 0.1
+
+
+class RequestContext:
+    """State of one request, passed explicitly through translation, cache lookup,
+    synthesis and playback.
+
+    It has the attributes utils.init used to set as module globals (config, args,
+    config_path and audio_files_path), so the utils and tts_utils functions take
+    either a context or, for older callers, fall back to those globals.
+    """
+
+    def __init__(
+        self,
+        config,
+        args,
+        tts_clients=None,
+        progress=None,
+        cancel_token=None,
+        foreground_idle=None,
+    ):
+        self.config = config
+        self.args = args
+        self.config_path = config["App"]["config_path"]
+        self.audio_files_path = config["App"]["audio_files_path"]
+        # TTS clients of the config, keyed by engine and voice id
+        self.tts_clients = tts_clients if tts_clients is not None else {}
+        self.progress = progress or Progress()
+        self.cancel_token = cancel_token or CancelToken()
+        # Voices found by tts_utils.speak for --listvoices requests
+        self.voices = None
+        # Set by the scheduler while no foreground request is in flight, only
+        # given to requests of the lower priority classes
+        self.foreground_idle = foreground_idle
+
+    def item(self, **fields):
+        """Context of one item of a batch request.
+
+        Args:
+            **fields: Added to every progress event of the item, e.g. index=3.
+        Returns: RequestContext
+        """
+        return RequestContext(
+            self.config,
+            self.args,
+            self.tts_clients,
+            self.progress.item(**fields),
+            self.cancel_token,
+            self.foreground_idle,
+        )
+
+    def wait_for_foreground(self):
+        """Let foreground requests go first: wait until none is in flight, or the
+        request is cancelled. Returns right away for foreground requests."""
+        if self.foreground_idle is None:
+            return
+        while not self.foreground_idle.wait(timeout=IDLE_POLL):
+            if self.cancel_token.cancelled:
+                return
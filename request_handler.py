@@ -0,0 +1,294 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyperclip
+
+import failover
+import translation_cache
+import tts_utils
+import utils
+import warmup
+from cancellation import Cancelled, CancelToken
+from pipeline import Pipeline
+from progress import ERROR, TRANSLATED, Progress
+from request_context import RequestContext
+from tracing import TRANSLATION, UTILS_INIT
+from translate_utils import split_sentences
+
+# Batch modes: speak every text in turn, or only translate and synthesize them into
+# the audio cache so that speaking them later is a cache hit
+BATCH_SPEAK = "speak"
+BATCH_CACHE = "cache"
+
+# Sentences translated at once, over all requests
+TRANSLATION_FANOUT = int(os.environ.get("AACSPEAKHELPER_TRANSLATION_FANOUT", 4))
+# Texts up to this many characters are translated in one piece, longer ones a
+# sentence at a time, see process_sentences
+CHUNK_MIN_CHARS = int(os.environ.get("AACSPEAKHELPER_CHUNK_MIN_CHARS", 300))
+
+# Synthesizes and plays the translated texts of all requests, in order
+pipeline = Pipeline()
+# Translates the sentences of long texts
+translation_workers = ThreadPoolExecutor(
+    max_workers=TRANSLATION_FANOUT, thread_name_prefix="Translate"
+)
+
+
+def translate(text, config):
+    """Translate text as configured, returned unchanged with noTranslate.
+
+    Texts translated before with the same provider and languages come from the
+    translation cache without a network call. Others are translated by the
+    configured provider, or its fallback providers when it is slow or fails. A
+    translation is cached under the provider that made it, so an answer of a
+    fallback provider is never served as the configured provider's.
+    Raises RuntimeError when none of them translated the text within
+    failover.TRANSLATION_BUDGET, rather than speaking nothing.
+    """
+    if config.getboolean("translate", "noTranslate"):
+        return text
+    translation = translation_cache.lookup(config, text)
+    if translation is not None:
+        logging.info(f"Translation cache hit: {translation}")
+        return translation
+    translation, provider = failover.translate(text, config)
+    if translation is None:
+        raise RuntimeError(f"Could not translate the text: {text[:50]}")
+    if provider is not None:
+        translation_cache.store(config, text, translation, provider)
+    return translation
+
+
+def process_sentences(sentences, context, speak=True):
+    """Translate the sentences of a long text concurrently and hand each to the
+    pipeline as soon as it and the sentences before it are translated, so that the
+    first sentence is spoken while the later ones are still being translated.
+
+    Args:
+        sentences (list): Sentences of the text, see translate_utils.split_sentences.
+        context (RequestContext): Context of the request. Progress events of a
+            sentence carry its "sentence" index. The request is finished once the
+            last sentence was played. When a sentence cannot be translated, the
+            request is cancelled, which stops the sentences already handed to
+            the pipeline, and the error is raised: the text is never spoken with
+            sentences missing.
+        speak (bool): False only translates the sentences.
+    Returns:
+        tuple: (the translated sentences joined by spaces, True if any was handed
+        to the pipeline, which then finishes the request)
+    """
+    config = context.config
+    progress = context.progress
+    progress.trace.begin(TRANSLATION)
+    futures = [
+        translation_workers.submit(translate, sentence, config)
+        for sentence in sentences
+    ]
+    translations = []
+    last_context = None
+    try:
+        for index, future in enumerate(futures):
+            translation = future.result()
+            # The span of a sentence-chunked request ends with its first sentence
+            progress.trace.end(TRANSLATION)
+            context.cancel_token.raise_if_cancelled()
+            translations.append(translation)
+            sentence_context = context.item(sentence=index)
+            sentence_context.progress.emit(TRANSLATED, text=translation)
+            if speak:
+                pipeline.submit(translation, sentence_context)
+                last_context = sentence_context
+    except Cancelled:
+        raise
+    except Exception as e:
+        logging.error(f"Sentence {len(translations)} could not be translated: {e}")
+        context.cancel_token.cancel()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+    if last_context is None:
+        return " ".join(translations), False
+    # The pipeline plays the sentences in order, so the last one ends the request
+    last_context.progress.on_finish(progress.finish)
+    return " ".join(translations), True
+
+
+def process_batch(batch, context):
+    """Translate and speak or pre-render a list of texts with the engines of one
+    config, which are created once and shared by all items.
+
+    A failing item is reported in its result and does not stop the batch. Batches
+    of a lower priority class wait before each item while a foreground request
+    is in flight. In speak
+    mode the items are handed to the pipeline once translated, and the request is
+    finished once the last of them was played.
+
+    Args:
+        batch (dict): {"texts": [str, ...], "mode": "speak" or "cache"}.
+        context (RequestContext): Context of the request. Progress events of an
+            item carry its "index". Once its cancel token is cancelled, the
+            remaining items are reported as "cancelled".
+    Returns:
+        tuple: (list of {"index", "status", "text"} per text, plus "file" and
+        "cached" in cache mode or "error" when the item failed, True if any item
+        was handed to the pipeline, which then finishes the request)
+    """
+    mode = batch.get("mode", BATCH_SPEAK)
+    if mode not in (BATCH_SPEAK, BATCH_CACHE):
+        raise ValueError(f"Unknown batch mode: {mode}")
+    texts = batch.get("texts") or []
+    logging.info(f"Handling batch of {len(texts)} texts in {mode} mode.")
+    config = context.config
+    bypass_tts = config.getboolean("TTS", "bypass_tts", fallback=False)
+    results = []
+    last_context = None
+    for index, text in enumerate(texts):
+        context.wait_for_foreground()
+        if context.cancel_token.cancelled:
+            results.append({"index": index, "status": "cancelled", "text": text})
+            continue
+        item_context = context.item(index=index)
+        item_progress = item_context.progress
+        try:
+            with item_progress.trace.span(TRANSLATION):
+                text_to_process = translate(text, config)
+            item_progress.emit(TRANSLATED, text=text_to_process)
+            item = {"index": index, "status": "ok", "text": text_to_process}
+            if mode == BATCH_CACHE:
+                item["file"], item["cached"] = tts_utils.render(
+                    text_to_process, item_context
+                )
+            elif not bypass_tts:
+                pipeline.submit(text_to_process, item_context)
+                last_context = item_context
+        except Exception as e:
+            logging.error(f"Error in batch item {index}: {e}", exc_info=True)
+            item_progress.emit(ERROR, error=str(e))
+            item = {"index": index, "status": "error", "text": text, "error": str(e)}
+        results.append(item)
+    if last_context is None:
+        return results, False
+    # The pipeline plays the items in order, so the last one ends the request
+    last_context.progress.on_finish(context.progress.finish)
+    return results, True
+
+
+def process_request(data):
+    """Translate and speak one request received by the pipe server.
+
+    This is shared by the tray app and the headless daemon and never touches Qt.
+
+    Args:
+        data (dict): Decoded request with "args", "clipboard_text" (read from the
+            clipboard here when missing) or a "batch" of texts, the "config_entry"
+            resolved by PipeServer and its "progress" events. "speak": False only
+            translates the text. A "warmup" request, {"probe": bool}, only builds
+            the translator, TTS client and audio device of its config.
+    Returns:
+        dict: {"text": processed text}, plus "voices" for --listvoices requests,
+        {"items": [...]} with the result of each text of a batch, or {"warmup":
+        ...} as returned by warmup.warm_up. All with "processed_at" and the
+        "duration" in seconds since the request arrived.
+    """
+    # Extract data from the received message
+    args = data["args"]
+    config_entry = data["config_entry"]
+    config = config_entry.config
+    progress = data.get("progress") or Progress()
+    cancel_token = data.get("cancel_token") or CancelToken()
+    # Everything below gets the request's state from the context, the globals
+    # set by utils.init and tts_utils.init are only kept for older callers
+    context = RequestContext(
+        config,
+        args,
+        config_entry.tts_clients,
+        progress,
+        cancel_token,
+        data.get("foreground_idle"),
+    )
+
+    logging.info(config["googleTTS"]["creds"])
+
+    # Initialize utils with the new config and args, a no-op but for the args when
+    # the config is the same as the previous request's
+    with progress.trace.span(UTILS_INIT):
+        utils.init(config, args)
+
+    # Initialize TTS, only when the engine settings changed
+    tts_clients = config_entry.tts_clients
+    if tts_utils.utils is not utils or tts_utils.tts_voiceid is not tts_clients:
+        tts_utils.init(utils, tts_clients)
+    if "warmup" in data:
+        result = {"warmup": warmup.warm_up(context, **data["warmup"])}
+        result["processed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        result["duration"] = progress.trace.elapsed()
+        progress.finish()
+        return result
+    if "batch" in data:
+        items, handed_off = process_batch(data["batch"], context)
+        result = {"items": items}
+        result["processed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        result["duration"] = progress.trace.elapsed()
+        if not handed_off:
+            progress.finish()
+        return result
+
+    clipboard_text = data.get("clipboard_text")
+    if clipboard_text is None:
+        # Thin clients leave reading the clipboard to the server
+        clipboard_text = pyperclip.paste()
+    logging.info(f"Handling new message: {clipboard_text[:50]}...")
+    speak = data.get("speak", True) and not config.getboolean(
+        "TTS", "bypass_tts", fallback=False
+    )
+    # Set once the text was handed to the pipeline, which then finishes the request
+    handed_off = False
+    sentences = []
+    if len(clipboard_text) > CHUNK_MIN_CHARS:
+        sentences = split_sentences(clipboard_text)
+    if (
+        len(sentences) > 1
+        and not args["listvoices"]
+        and not config.getboolean("translate", "noTranslate")
+    ):
+        text_to_process, handed_off = process_sentences(sentences, context, speak)
+        progress.emit(TRANSLATED, text=text_to_process)
+        speak = False
+    else:
+        with progress.trace.span(TRANSLATION):
+            text_to_process = translate(clipboard_text, config)
+        cancel_token.raise_if_cancelled()
+        progress.emit(TRANSLATED, text=text_to_process)
+
+    # Perform TTS if not bypassed, sentences were handed to the pipeline already
+    if speak:
+        if args["listvoices"]:
+            tts_utils.speak(text_to_process, True, context)
+        else:
+            # Synthesized and played while the next request is translated
+            pipeline.submit(text_to_process, context)
+            handed_off = True
+    result = {"text": text_to_process}
+    if args["listvoices"]:
+        if not context.voices:
+            raise RuntimeError("Could not retrieve voices.")
+        result["voices"] = context.voices
+    # Replace clipboard if specified
+    if config.getboolean("translate", "replacepb") and text_to_process is not None:
+        try:
+            pyperclip.copy(text_to_process)
+        except pyperclip.PyperclipException as e:
+            # No clipboard is available on headless machines
+            logging.warning(f"Could not replace clipboard: {e}")
+
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    logging.info(f"Processed message at {current_time}")
+    result["processed_at"] = current_time
+    result["duration"] = progress.trace.elapsed()
+    if not handed_off:
+        # Otherwise the pipeline finishes the request once it was played
+        progress.finish()
+    return result
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from protocol import BACKGROUND, LISTVOICES, PREVIEW, PRIORITIES, SPEAK
+from tracing import percentiles
+
+# Admission policies, applied when a request arrives and the queue is full
+FIFO = "fifo"  # refuse the new request
+DROP_OLDEST = "drop_oldest"  # drop the request that waited longest
+LATEST_WINS = "latest_wins"  # drop every waiting request, whether full or not
+# Both only drop requests of the new request's priority class or a lower one,
+# and refuse the new request when there are none
+POLICIES = (FIFO, DROP_OLDEST, LATEST_WINS)
+
+# Classes the user is waiting for, the others only run while none of these is in flight
+FOREGROUND = (SPEAK, PREVIEW)
+# Queue waits per class kept for the percentiles in stats()
+WAIT_SAMPLES = 200
+
+QUEUE_POLICY = os.environ.get("AACSPEAKHELPER_QUEUE_POLICY", FIFO)
+# Requests waiting to be processed, not counting the one being processed
+QUEUE_SIZE = int(os.environ.get("AACSPEAKHELPER_QUEUE_SIZE", 8))
+# Seconds within which a request identical to an earlier one shares its result
+COALESCE_WINDOW = float(os.environ.get("AACSPEAKHELPER_COALESCE_WINDOW", 0.5))
+
+
+class RequestDropped(RuntimeError):
+    """Outcome of a request that the queue refused or dropped."""
+
+
+def priority_class(message):
+    """Priority class of a request, its "priority" if it names one.
+
+    Args:
+        message (dict): Decoded request.
+    Returns: str
+    """
+    if message.get("priority") in PRIORITIES:
+        return message["priority"]
+    args = message.get("args") or {}
+    # request_handler.BATCH_CACHE
+    if (message.get("batch") or {}).get("mode") == "cache":
+        return BACKGROUND
+    if args.get("listvoices"):
+        return LISTVOICES
+    if args.get("preview"):
+        return PREVIEW
+    return SPEAK
+
+
+def coalesce_key(message):
+    """Key under which identical requests are coalesced, None if the request must
+    never be coalesced (thin requests reading whatever the clipboard holds now).
+
+    Args:
+        message (dict): Request with its "config_entry".
+    Returns: str
+    """
+    if message.get("clipboard_text") is None and "batch" not in message:
+        return None
+    return json.dumps(
+        [
+            message["config_entry"].fingerprint,
+            message.get("clipboard_text"),
+            message.get("batch"),
+            message.get("args"),
+            message.get("speak", True),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+
+
+class RequestQueue:
+    """Bounded queue of jobs waiting for the request handler.
+
+    Jobs are taken by priority class, the oldest job of the highest class first.
+    Requests that are identical to one received less than coalesce_window seconds
+    ago are not queued again. They get the result of the earlier request.
+    """
+
+    def __init__(
+        self, capacity=QUEUE_SIZE, policy=QUEUE_POLICY, coalesce_window=COALESCE_WINDOW
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown queue policy {policy}, expected one of {POLICIES}"
+            )
+        self.capacity = capacity
+        self.policy = policy
+        self.coalesce_window = coalesce_window
+        # Waiting jobs by priority class, oldest first
+        self.items = {priority: deque() for priority in PRIORITIES}
+        self.condition = threading.Condition()
+        # Recent jobs by coalesce key: key -> (monotonic time, job)
+        self.recent = {}
+        self.counters = {
+            "received": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "dropped": 0,
+            "max_depth": 0,
+        }
+        # Seconds the last WAIT_SAMPLES jobs of each class waited to be taken
+        self.waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+
+    def __len__(self):
+        return sum(len(items) for items in self.items.values())
+
+    def put(self, job):
+        """Queue a job, or complete it right away when it is coalesced with an
+        earlier job or refused.
+
+        latest_wins drops the waiting jobs of the job's own class. When the queue
+        is still full, it and drop_oldest drop the oldest job of the lowest class
+        that has any, as long as that class is not higher than the job's. A job
+        that would have to drop a higher class is refused, like with fifo.
+
+        Args:
+            job (Job): Job of a request with its "config_entry", "progress" and
+                priority class.
+        Returns: None
+        """
+        key = coalesce_key(job.message)
+        items = self.items[job.priority]
+        # Classes whose jobs may make room for the job, lowest first
+        lower = reversed(PRIORITIES[PRIORITIES.index(job.priority) :])
+        dropped = []
+        refused = False
+        with self.condition:
+            self.counters["received"] += 1
+            now = time.monotonic()
+            for old_key, (received, _) in list(self.recent.items()):
+                if now - received > self.coalesce_window:
+                    del self.recent[old_key]
+            if key is not None and key in self.recent:
+                self.counters["coalesced"] += 1
+                self.chain(self.recent[key][1], job)
+                logging.info(f"Request {job.id} coalesced with an earlier one.")
+                return
+            if self.policy == LATEST_WINS:
+                dropped.extend(old_job for _, old_job in items)
+                items.clear()
+            if len(self) >= self.capacity:
+                lowest = None
+                if self.policy != FIFO:
+                    lowest = next(
+                        (
+                            self.items[priority]
+                            for priority in lower
+                            if self.items[priority]
+                        ),
+                        None,
+                    )
+                if lowest is None:
+                    refused = True
+                    self.counters["rejected"] += 1
+                else:
+                    dropped.append(lowest.popleft()[1])
+            self.counters["dropped"] += len(dropped)
+            if not refused:
+                items.append((now, job))
+                if key is not None:
+                    self.recent[key] = (now, job)
+                self.counters["max_depth"] = max(self.counters["max_depth"], len(self))
+                self.condition.notify()
+        for old_job in dropped:
+            logging.info(f"Request {old_job.id} dropped by a newer request.")
+            old_job.complete(error=RequestDropped("Dropped by a newer request."))
+        if refused:
+            logging.warning(f"Request {job.id} refused, queue is full.")
+            job.complete(error=RequestDropped("Request queue is full."))
+
+    @staticmethod
+    def chain(primary, job):
+        def copy(done):
+            job.progress.finish()
+            if done.exception() is not None:
+                job.complete(error=done.exception())
+            else:
+                job.complete(done.result())
+
+        primary.future.add_done_callback(copy)
+
+    def clear(self, reason="Stopped.", priorities=PRIORITIES):
+        """Drop every waiting request of the given priority classes.
+
+        Args:
+            reason (str): Error the dropped requests get.
+            priorities (tuple): Priority classes to drop.
+        Returns:
+            int: Number of dropped requests.
+        """
+        with self.condition:
+            dropped = []
+            for priority in priorities:
+                dropped.extend(job for _, job in self.items[priority])
+                self.items[priority].clear()
+            self.counters["dropped"] += len(dropped)
+        for job in dropped:
+            job.complete(error=RequestDropped(reason))
+        return len(dropped)
+
+    def get(self, timeout=None, priorities=PRIORITIES):
+        """Take the oldest job of the highest priority class that has one.
+
+        Args:
+            timeout (float): Seconds to wait for a job.
+            priorities: Priority classes to take jobs from, or a function returning
+                them that is called again whenever the queue is woken up.
+        Returns:
+            Job, None if none arrived within timeout.
+        """
+
+        def waiting():
+            classes = priorities() if callable(priorities) else priorities
+            return next((self.items[p] for p in classes if self.items[p]), None)
+
+        with self.condition:
+            items = self.condition.wait_for(waiting, timeout)
+            if items is None:
+                return None
+            received, job = items.popleft()
+            self.waits[job.priority].append(time.monotonic() - received)
+            return job
+
+    def wake(self):
+        """Let get() check again which priority classes it may take jobs from."""
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self):
+        """Current depth and counters of the queue, and the depth and queue wait
+        percentiles in seconds of each priority class."""
+        with self.condition:
+            classes = {}
+            for priority in PRIORITIES:
+                waits = sorted(self.waits[priority])
+                classes[priority] = {"depth": len(self.items[priority])}
+                if waits:
+                    cuts = percentiles(waits, (50, 95))
+                    classes[priority].update(
+                        {
+                            "samples": len(waits),
+                            "wait_p50": cuts["p50"],
+                            "wait_p95": cuts["p95"],
+                            "wait_max": waits[-1],
+                        }
+                    )
+            return {
+                "policy": self.policy,
+                "capacity": self.capacity,
+                "depth": len(self),
+                **self.counters,
+                "classes": classes,
+            }
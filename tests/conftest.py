@@ -0,0 +1,77 @@
+import configparser
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# The modules live in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_cache import ConfigEntry  # noqa: E402
+from jobs import Scheduler  # noqa: E402
+from progress import Progress  # noqa: E402
+
+
+@pytest.fixture
+def config_entry(tmp_path):
+    """Config speaking untranslated text with SherpaOnnxTTS, its files in tmp_path."""
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "App": {
+                "config_path": str(tmp_path),
+                "audio_files_path": str(tmp_path),
+                "collectstats": "False",
+            },
+            "translate": {"noTranslate": "True", "replacepb": "False"},
+            "TTS": {
+                "engine": "SherpaOnnxTTS",
+                "voiceid": "voice",
+                "bypass_tts": "False",
+                "save_audio_file": "False",
+            },
+            "SherpaOnnxTTS": {"voiceid": "voice"},
+            "googleTTS": {"creds": ""},
+        }
+    )
+    return ConfigEntry("test", config)
+
+
+@pytest.fixture
+def scheduler():
+    """Scheduler running its jobs with request_handler.process_request, as the
+    daemon does."""
+    import request_handler
+
+    workers = ThreadPoolExecutor(max_workers=2)
+
+    def work(message):
+        try:
+            result = request_handler.process_request(message)
+        except Exception as e:
+            scheduler.complete(message["id"], error=e)
+            return
+        scheduler.complete(message["id"], result)
+
+    scheduler = Scheduler(lambda message: workers.submit(work, message))
+    stopping = threading.Event()
+    thread = threading.Thread(target=scheduler.run, args=(stopping,), daemon=True)
+    thread.start()
+    yield scheduler
+    stopping.set()
+    thread.join()
+    workers.shutdown()
+
+
+def speak_request(config_entry, text, request_id, **fields):
+    """Request to speak text as the pipe server passes it to the scheduler."""
+    return {
+        "id": request_id,
+        "args": {"style": "", "styledegree": None, "listvoices": False},
+        "clipboard_text": text,
+        "config_entry": config_entry,
+        "progress": Progress(),
+        **fields,
+    }
@@ -0,0 +1,149 @@
+import configparser
+import time
+from collections import OrderedDict
+
+import pytest
+
+import failover
+import request_handler
+import throttle
+import translate_utils
+import translation_cache
+
+
+class FakeTranslator:
+    """Translates after the delay set for its provider, fails when it is None."""
+
+    name = None
+    delays = {}
+    calls = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def translate(self, text):
+        self.calls.append(self.name)
+        delay = self.delays[self.name]
+        if delay is None:
+            raise RuntimeError(f"{self.name} is down")
+        time.sleep(delay)
+        return f"{self.name}: {text}"
+
+
+class FakeGoogle(FakeTranslator):
+    name = "GoogleTranslator"
+
+
+class FakeMyMemory(FakeTranslator):
+    name = "MyMemoryTranslator"
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Delay of each provider, None to fail. Providers, their pool, health and
+    guards start afresh in every test."""
+    delays = {"GoogleTranslator": 0.0, "MyMemoryTranslator": 0.0}
+    monkeypatch.setattr(FakeTranslator, "delays", delays)
+    monkeypatch.setattr(FakeTranslator, "calls", [])
+    monkeypatch.setattr(translate_utils, "GoogleTranslator", FakeGoogle)
+    monkeypatch.setattr(translate_utils, "MyMemoryTranslator", FakeMyMemory)
+    monkeypatch.setattr(translate_utils.pool, "idle", OrderedDict())
+    monkeypatch.setattr(translate_utils.pool, "providers", {})
+    monkeypatch.setattr(translate_utils.pool, "outcomes", {})
+    monkeypatch.setattr(throttle, "guards", {})
+    monkeypatch.setattr(throttle.prober, "start", lambda: None)
+    return delays
+
+
+def make_config(fallback_providers=""):
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "translate": {
+                "provider": "GoogleTranslator",
+                "startLang": "en",
+                "endLang": "fr",
+                "email": "",
+                "mymemorytranslator_secret_key": "",
+                "fallback_providers": fallback_providers,
+            }
+        }
+    )
+    return config
+
+
+def test_waits_for_token_without_fallback(delays, monkeypatch):
+    monkeypatch.setitem(throttle.RATE_LIMITS, "GoogleTranslator", (10, 2))
+    config = make_config()
+    start = time.monotonic()
+    translations = [failover.translate(f"t{i}", config, budget=2) for i in range(4)]
+
+    assert translations == [
+        (f"GoogleTranslator: t{i}", "GoogleTranslator") for i in range(4)
+    ]
+    # The third and fourth waited a tenth of a second for a token each
+    assert time.monotonic() - start > 0.15
+
+
+def test_gives_up_when_token_comes_after_budget(delays, monkeypatch):
+    monkeypatch.setitem(throttle.RATE_LIMITS, "GoogleTranslator", (1, 1))
+    config = make_config()
+    assert failover.translate("first", config, budget=0.5) == (
+        "GoogleTranslator: first",
+        "GoogleTranslator",
+    )
+    assert failover.translate("second", config, budget=0.5) == (None, None)
+
+
+def test_slow_provider_is_hedged(delays, monkeypatch):
+    monkeypatch.setattr(failover, "HEDGE_DELAY", 0.1)
+    delays["GoogleTranslator"] = 1.0
+    config = make_config("MyMemoryTranslator")
+    start = time.monotonic()
+
+    assert failover.translate("Hello", config) == (
+        "MyMemoryTranslator: Hello",
+        "MyMemoryTranslator",
+    )
+    assert 0.1 <= time.monotonic() - start < 1.0
+    assert FakeTranslator.calls == ["GoogleTranslator", "MyMemoryTranslator"]
+
+
+def test_fast_provider_is_not_hedged(delays, monkeypatch):
+    monkeypatch.setattr(failover, "HEDGE_DELAY", 0.5)
+    config = make_config("MyMemoryTranslator")
+
+    assert failover.translate("Hello", config)[0] == "GoogleTranslator: Hello"
+    assert FakeTranslator.calls == ["GoogleTranslator"]
+
+
+def test_failed_provider_fails_over_at_once(delays, monkeypatch):
+    monkeypatch.setattr(failover, "HEDGE_DELAY", 5)
+    delays["GoogleTranslator"] = None
+    config = make_config("MyMemoryTranslator")
+    start = time.monotonic()
+
+    assert failover.translate("Hello", config)[0] == "MyMemoryTranslator: Hello"
+    assert time.monotonic() - start < 1
+
+
+def test_none_translated_in_budget(delays, monkeypatch):
+    monkeypatch.setattr(failover, "HEDGE_DELAY", 0.1)
+    delays["GoogleTranslator"] = None
+    delays["MyMemoryTranslator"] = 1.0
+    config = make_config("MyMemoryTranslator")
+
+    assert failover.translate("Hello", config, budget=0.3) == (None, None)
+
+
+def test_fallback_translation_cached_under_its_provider(delays, tmp_path):
+    delays["GoogleTranslator"] = None
+    config = make_config("MyMemoryTranslator")
+    config["translate"]["noTranslate"] = "False"
+    config["App"] = {"audio_files_path": str(tmp_path)}
+
+    assert request_handler.translate("Hello", config) == "MyMemoryTranslator: Hello"
+    # The configured provider has no translation cached for the text
+    assert translation_cache.lookup(config, "Hello") is None
+    config["translate"]["provider"] = "MyMemoryTranslator"
+    assert translation_cache.lookup(config, "Hello") == "MyMemoryTranslator: Hello"
@@ -0,0 +1,110 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+import protocol
+from http_api import HttpApi
+
+TOKEN = "secret"
+ORIGIN = "http://localhost:3000"
+
+
+class FakeServer:
+    """The parts of PipeServer the stats and stop endpoints use."""
+
+    def stats(self):
+        return {"entries": 0}
+
+    def stop_speaking(self):
+        return {"cancelled": False, "dropped": 0}
+
+
+@pytest.fixture
+def api():
+    api = HttpApi(FakeServer(), port=0, token=TOKEN, origins=[ORIGIN])
+    thread = threading.Thread(target=api.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield api
+    api.stop()
+    thread.join()
+
+
+def request(api, method, path, body=None, **headers):
+    """Send a request and return its status, headers and decoded body."""
+    port = api.httpd.server_address[1]
+    headers.setdefault("Authorization", f"Bearer {TOKEN}")
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        return response.status, response.headers, json.loads(data) if data else None
+    finally:
+        connection.close()
+
+
+def test_answers_with_token(api):
+    status, headers, body = request(api, "GET", "/cache/stats")
+    assert status == 200
+    assert body == {"status": protocol.STATUS_OK, "result": {"entries": 0}}
+    assert "Access-Control-Allow-Origin" not in headers
+
+
+@pytest.mark.parametrize("authorization", ["", "Bearer wrong", f"Basic {TOKEN}"])
+def test_refuses_without_token(api, authorization):
+    status, _, body = request(api, "GET", "/cache/stats", Authorization=authorization)
+    assert status == 401
+    assert body["status"] == protocol.STATUS_ERROR
+
+
+def test_refuses_other_host(api):
+    port = api.httpd.server_address[1]
+    status, _, _ = request(api, "GET", "/cache/stats", Host=f"rebound.example:{port}")
+    assert status == 403
+
+
+def test_reflects_allowed_origin_only(api):
+    status, headers, _ = request(api, "GET", "/cache/stats", Origin=ORIGIN)
+    assert status == 200
+    assert headers["Access-Control-Allow-Origin"] == ORIGIN
+
+    status, headers, _ = request(
+        api, "GET", "/cache/stats", Origin="http://evil.example"
+    )
+    assert status == 403
+    assert "Access-Control-Allow-Origin" not in headers
+
+
+def test_preflight_of_allowed_origin(api):
+    status, headers, _ = request(api, "OPTIONS", "/stop", Origin=ORIGIN)
+    assert status == 204
+    assert headers["Access-Control-Allow-Origin"] == ORIGIN
+    assert "Authorization" in headers["Access-Control-Allow-Headers"]
+
+
+def test_post_requires_json(api):
+    status, _, _ = request(api, "POST", "/stop", "{}", **{"Content-Type": "text/plain"})
+    assert status == 415
+
+    status, _, body = request(
+        api, "POST", "/stop", "{}", **{"Content-Type": "application/json"}
+    )
+    assert status == 200
+    assert body["result"] == {"cancelled": False, "dropped": 0}
+
+
+def test_websocket_checks_token_and_origin(api):
+    upgrade = {
+        "Upgrade": "websocket",
+        "Connection": "Upgrade",
+        "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+        "Sec-WebSocket-Version": "13",
+        "Authorization": "",
+    }
+    assert request(api, "GET", "/ws", **upgrade)[0] == 401
+    status, _, _ = request(
+        api, "GET", f"/ws?token={TOKEN}", Origin="http://evil.example", **upgrade
+    )
+    assert status == 403
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+import jobs
+from jobs import CANCELLED_STATE, DONE, DROPPED, PLAYING, Scheduler
+from progress import Progress
+from request_queue import BACKGROUND, SPEAK
+
+# Seconds to wait for anything the tests expect to happen
+TIMEOUT = 5
+# Seconds to wait for something the tests expect not to happen
+QUIET = 0.3
+
+
+class Dispatcher:
+    """Completes each job at once and leaves it playing until its progress is
+    finished, like the pipeline does."""
+
+    def __init__(self):
+        self.scheduler = None
+        self.messages = []
+        self.dispatched = threading.Condition()
+
+    def __call__(self, message):
+        with self.dispatched:
+            self.messages.append(message)
+            self.dispatched.notify_all()
+        self.scheduler.complete(message["id"], "ok")
+
+    def ids(self):
+        with self.dispatched:
+            return [message["id"] for message in self.messages]
+
+    def wait_for(self, count, timeout=TIMEOUT):
+        """Whether count jobs were dispatched within timeout."""
+        with self.dispatched:
+            return self.dispatched.wait_for(
+                lambda: len(self.messages) >= count, timeout=timeout
+            )
+
+
+@pytest.fixture
+def dispatcher():
+    return Dispatcher()
+
+
+@pytest.fixture
+def run(dispatcher, monkeypatch):
+    """Start a scheduler of the given depth, stopped at the end of the test."""
+    monkeypatch.setattr(jobs, "POLL_INTERVAL", 0.05)
+    threads = []
+    stopping = threading.Event()
+
+    def run(depth=2):
+        scheduler = dispatcher.scheduler = Scheduler(dispatcher, depth=depth)
+        thread = threading.Thread(target=scheduler.run, args=(stopping,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        return scheduler
+
+    yield run
+    stopping.set()
+    for thread in threads:
+        thread.join()
+
+
+def message(request_id, priority=SPEAK, **fields):
+    return {"id": request_id, "priority": priority, "progress": Progress(), **fields}
+
+
+@pytest.mark.parametrize("depth", [1, 2, 3])
+def test_foreground_jobs_in_flight_up_to_depth(run, dispatcher, depth):
+    scheduler = run(depth)
+    jobs = [scheduler.submit(message(f"job{i}")) for i in range(depth + 1)]
+
+    assert dispatcher.wait_for(depth)
+    assert not dispatcher.wait_for(depth + 1, QUIET)
+    assert dispatcher.ids() == [f"job{i}" for i in range(depth)]
+    assert [job.state for job in jobs[:depth]] == [PLAYING] * depth
+
+    # The next one is dispatched once the oldest is done playing
+    jobs[0].progress.finish()
+    assert dispatcher.wait_for(depth + 1)
+    assert jobs[0].state == DONE
+
+
+def test_background_waits_for_foreground(run, dispatcher):
+    scheduler = run()
+    speaking = scheduler.submit(message("speak"))
+    assert dispatcher.wait_for(1)
+    scheduler.submit(message("background", BACKGROUND))
+
+    assert not dispatcher.wait_for(2, QUIET)
+    speaking.progress.finish()
+    assert dispatcher.wait_for(2)
+    assert dispatcher.ids() == ["speak", "background"]
+
+
+def test_stop_cancels_playing_and_drops_waiting(run, dispatcher):
+    scheduler = run(depth=1)
+    playing = scheduler.submit(message("playing"))
+    assert dispatcher.wait_for(1)
+    waiting = scheduler.submit(message("waiting"))
+
+    assert scheduler.stop_speaking() == {"cancelled": True, "dropped": 1}
+    assert playing.cancel_token.cancelled
+    assert waiting.state == DROPPED
+    playing.progress.finish()
+    assert playing.state == CANCELLED_STATE
+    assert scheduler.stop_speaking() == {"cancelled": False, "dropped": 0}
+
+
+def test_interrupt_cancels_playing(run, dispatcher):
+    scheduler = run(depth=1)
+    playing = scheduler.submit(message("playing"))
+    assert dispatcher.wait_for(1)
+    polite = scheduler.submit(message("polite", interrupt=False))
+    assert not playing.cancel_token.cancelled
+
+    scheduler.submit(message("barge-in", interrupt=True))
+    assert playing.cancel_token.cancelled
+    assert not polite.cancel_token.cancelled
+    playing.progress.finish()
+    assert dispatcher.wait_for(2)
+    assert dispatcher.ids() == ["playing", "polite"]
+
+
+def test_background_not_cancelled_by_stop(run, dispatcher):
+    scheduler = run()
+    background = scheduler.submit(message("background", BACKGROUND))
+    assert dispatcher.wait_for(1)
+
+    assert scheduler.stop_speaking() == {"cancelled": False, "dropped": 0}
+    assert not background.cancel_token.cancelled
@@ -0,0 +1,104 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import pipe_server
+import protocol
+from jobs import Job
+from pipe_server import PipeServer, default_config_version
+from progress import Progress
+from transport import UnixSocketConnection
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = PipeServer(
+        lambda message: None,
+        transport_kind="unix",
+        address=str(tmp_path / "socket"),
+        http_port=0,
+        warmup=False,
+    )
+    yield server
+    server.stop()
+
+
+def ask(server, message):
+    """Send a message to handle_connection and return the response."""
+    client, end = socket.socketpair()
+    with client:
+        server.slots.acquire()
+        protocol.write_message(UnixSocketConnection(client), message)
+        server.handle_connection(UnixSocketConnection(end))
+        return protocol.read_message(UnixSocketConnection(client))
+
+
+def test_status(server):
+    server.scheduler.active.append(
+        Job({"id": "playing", "priority": "speak", "progress": Progress()})
+    )
+    server.scheduler.queue.put(
+        Job({"id": "waiting", "priority": "speak", "progress": Progress()})
+    )
+
+    response = ask(server, {"status": True})
+    assert response["status"] == protocol.STATUS_OK
+    assert response["result"]["in_flight"] == 1
+    assert response["result"]["waiting"] == 1
+    assert response["result"]["warmup"] is None
+
+
+def test_stop(server):
+    response = ask(server, {"stop": True})
+    assert response["result"] == {"cancelled": False, "dropped": 0}
+
+
+def test_error_when_config_cannot_be_loaded(server, tmp_path):
+    response = ask(server, {"config_path": str(tmp_path / "missing.cfg")})
+    assert response["status"] == protocol.STATUS_ERROR
+    assert "missing.cfg" in response["error"]
+
+
+def test_error_when_client_sends_no_config(server):
+    client, end = socket.socketpair()
+    with client:
+        server.slots.acquire()
+        connection = UnixSocketConnection(client)
+        protocol.write_message(connection, {"config_hash": "unknown"})
+        protocol.write_message(connection, {"something": "else"})
+        server.handle_connection(UnixSocketConnection(end))
+        assert protocol.read_message(connection) == {
+            "status": protocol.STATUS_CONFIG_REQUIRED
+        }
+        response = protocol.read_message(connection)
+    assert response["status"] == protocol.STATUS_ERROR
+    assert response["error"] == "Client did not send its config."
+
+
+def test_unloadable_config_logged_once(server, tmp_path, monkeypatch, caplog):
+    config_path = tmp_path / "settings.cfg"
+    monkeypatch.setattr(
+        pipe_server.utils, "get_paths", lambda: (str(config_path), str(tmp_path))
+    )
+    monkeypatch.setattr(pipe_server, "WARMUP_INTERVAL", 0.01)
+    loads = []
+
+    def load():
+        loads.append(default_config_version())
+        raise FileNotFoundError(f"No config found at {config_path}")
+
+    monkeypatch.setattr(server.config_cache, "load", load)
+    watcher = threading.Thread(target=server.watch_config, daemon=True)
+    watcher.start()
+    time.sleep(0.2)
+    # Tried again once the file appears
+    config_path.write_text("[App]\n")
+    time.sleep(0.2)
+    server.stopping.set()
+    watcher.join()
+
+    assert len(loads) == 2
+    warnings = [r for r in caplog.records if "Could not warm up" in r.message]
+    assert len(warnings) == 2
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+from tts_wrapper import MicrosoftTTS, SherpaOnnxTTS
+
+import pipeline
+import request_handler
+import tts_utils
+import utils
+from conftest import speak_request
+from jobs import CANCELLED_STATE, DONE, PLAYING
+
+# Seconds to wait for anything the tests expect to happen
+TIMEOUT = 5
+
+
+class FakeEngine:
+    """Streams for seconds or until stopped, without an engine or audio device."""
+
+    def __init__(self, seconds=TIMEOUT):
+        self.seconds = seconds
+        self.streaming = threading.Event()
+        self.stopped = threading.Event()
+        self.synthesized = threading.Event()
+
+    def connect(self, event, callback):
+        pass
+
+    def speak_streamed(self, text):
+        self.streaming.set()
+        self.stopped.wait(timeout=self.seconds)
+
+    def synth_to_file(self, text, filename, file_format):
+        with open(filename, "wb") as file:
+            file.write(b"RIFF")
+        self.rendered = text
+        self.rendered_file = filename
+        self.synthesized.set()
+
+    def stop_audio(self):
+        self.stopped.set()
+
+
+class FakeTTS(FakeEngine, SherpaOnnxTTS):
+    pass
+
+
+class FakeSSML:
+    def clear_ssml(self):
+        pass
+
+    def add(self, text):
+        return f"<speak>{text}</speak>"
+
+
+class FakeAzure(FakeEngine, MicrosoftTTS):
+    """Takes SSML like the Azure client."""
+
+    def __init__(self, seconds=TIMEOUT):
+        super().__init__(seconds)
+        self.ssml = FakeSSML()
+        self.spoken = []
+
+    def speak_streamed(self, text):
+        self.spoken.append(text)
+        super().speak_streamed(text)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    """TTS clients built by tts_utils, in the order they were built."""
+    clients = []
+
+    def init_onnx_tts(config=None):
+        clients.append(FakeTTS())
+        return clients[-1]
+
+    def init_azure_tts(config=None):
+        clients.append(FakeAzure())
+        return clients[-1]
+
+    monkeypatch.setattr(tts_utils, "init_onnx_tts", init_onnx_tts)
+    monkeypatch.setattr(tts_utils, "init_azure_tts", init_azure_tts)
+    monkeypatch.setattr(utils, "play_audio", lambda *args, **kwargs: None)
+    return clients
+
+
+@pytest.fixture
+def tts(config_entry, clients):
+    """The TTS client of the config, which speak() streams with."""
+    tts = FakeTTS()
+    config_entry.tts_clients["SherpaOnnxTTS"] = {"voice": tts}
+    return tts
+
+
+def cached(directory, text):
+    """Whether text is in the audio cache database of directory."""
+    database = directory / "cache_history.db"
+    if not database.exists():
+        return False
+    with sqlite3.connect(database) as connection:
+        return bool(
+            connection.execute(
+                "SELECT COUNT(*) FROM History WHERE text=?", (text,)
+            ).fetchone()[0]
+        )
+
+
+def render_ahead(scheduler, config_entry, tts, clients, **fields):
+    """Speak two texts, the second rendered ahead while the first plays."""
+    first = scheduler.submit(speak_request(config_entry, "First", "first", **fields))
+    assert tts.streaming.wait(timeout=TIMEOUT)
+    second = scheduler.submit(speak_request(config_entry, "Second", "second", **fields))
+    # The render client is built on the synthesis thread
+    deadline = time.monotonic() + TIMEOUT
+    while not clients and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert clients[0].synthesized.wait(timeout=TIMEOUT)
+    tts.stop_audio()
+    assert second.progress.finished.wait(timeout=TIMEOUT)
+    return first, second
+
+
+def slowly(function, seconds):
+    def slow(*args, **kwargs):
+        time.sleep(seconds)
+        return function(*args, **kwargs)
+
+    return slow
+
+
+def test_stop_cancels_request_still_playing(scheduler, config_entry, tts, monkeypatch):
+    # The request thread is still busy once playback started and looks up the
+    # audio cache, which used to finish the request before it was spoken
+    config_entry.config["translate"]["replacepb"] = "True"
+    monkeypatch.setattr(
+        request_handler.pyperclip, "copy", slowly(lambda text: None, 0.2)
+    )
+    monkeypatch.setattr(utils, "check_history", slowly(utils.check_history, 0.4))
+    job = scheduler.submit(speak_request(config_entry, "Hello", "playing"))
+
+    # The result is sent as soon as the text was handed to the pipeline
+    assert job.future.result(timeout=TIMEOUT)["text"] == "Hello"
+    assert tts.streaming.wait(timeout=TIMEOUT)
+    assert job.state == PLAYING
+    assert not job.progress.finished.is_set()
+
+    assert scheduler.stop_speaking()["cancelled"]
+    assert tts.stopped.wait(timeout=TIMEOUT)
+    assert job.progress.finished.wait(timeout=TIMEOUT)
+    assert job.state == CANCELLED_STATE
+
+
+def test_request_done_once_played(scheduler, config_entry, tts):
+    tts.seconds = 0.2
+    job = scheduler.submit(speak_request(config_entry, "Hello", "played"))
+
+    assert job.future.result(timeout=TIMEOUT)["text"] == "Hello"
+    assert job.progress.finished.wait(timeout=TIMEOUT)
+    assert job.state == DONE
+    assert not tts.stopped.is_set()
+
+
+def test_stalled_playback_is_cancelled(scheduler, config_entry, tts, monkeypatch):
+    monkeypatch.setattr(pipeline, "RESPONSE_TIMEOUT", 0.3)
+    job = scheduler.submit(speak_request(config_entry, "Hello", "stalled"))
+
+    assert job.progress.finished.wait(timeout=TIMEOUT)
+    assert tts.stopped.is_set()
+    assert job.state == CANCELLED_STATE
+
+
+def test_render_ahead_uses_own_client(scheduler, config_entry, tts, clients, tmp_path):
+    first, second = render_ahead(scheduler, config_entry, tts, clients)
+
+    assert first.state == DONE
+    assert second.state == DONE
+    assert len(clients) == 1
+    assert clients[0].rendered == "Second"
+    assert not hasattr(tts, "rendered")
+    # save_audio_file is off: played from a temporary file, not cached
+    assert not clients[0].rendered_file.startswith(str(tmp_path))
+    assert not os.path.exists(clients[0].rendered_file)
+    assert not cached(tmp_path, "Second")
+
+
+def test_render_ahead_cached_with_save_audio_file(
+    scheduler, config_entry, tts, clients, tmp_path, monkeypatch
+):
+    config_entry.config["TTS"]["save_audio_file"] = "True"
+    # Spoken directly, the first one is saved while it streams
+    monkeypatch.setattr(
+        utils,
+        "save_audio",
+        lambda text, engine, file_format, tts, context: tts.speak_streamed(text),
+    )
+    _, second = render_ahead(scheduler, config_entry, tts, clients)
+
+    assert second.state == DONE
+    assert clients[0].rendered_file.startswith(str(tmp_path))
+    assert os.path.exists(clients[0].rendered_file)
+    assert cached(tmp_path, "Second")
+
+
+def test_render_ahead_keeps_style(scheduler, config_entry, clients):
+    config_entry.config["TTS"]["engine"] = "azureTTS"
+    config_entry.config["azureTTS"] = {"voiceid": "voice"}
+    tts = FakeAzure()
+    config_entry.tts_clients["azureTTS"] = {"voice": tts}
+    args = {"style": "cheerful", "styledegree": 2, "listvoices": False}
+    first, _ = render_ahead(scheduler, config_entry, tts, clients, args=args)
+
+    assert first.state == DONE
+    assert tts.spoken == [
+        '<speak><mstts:express-as style="cheerful" styledegree="2">'
+        "First</mstts:express-as></speak>"
+    ]
+    assert clients[0].rendered == (
+        '<speak><mstts:express-as style="cheerful" styledegree="2">'
+        "Second</mstts:express-as></speak>"
+    )
@@ -0,0 +1,114 @@
+import pytest
+
+import protocol
+from protocol import (
+    CHUNK_SIZE,
+    CODEC_JSON,
+    CODEC_MARSHAL,
+    HEADER,
+    MAGIC,
+    VERSION,
+    ProtocolError,
+    read_message,
+    write_message,
+)
+
+
+class Connection:
+    """Transport connection over a byte buffer, receiving at most limit bytes at
+    once like a pipe does."""
+
+    def __init__(self, data=b"", limit=1000):
+        self.data = bytearray(data)
+        self.limit = limit
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(len(data))
+        self.data += data
+
+    def recv_into(self, view):
+        count = min(len(view), len(self.data), self.limit)
+        view[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+
+def frame(body, codec=CODEC_JSON, magic=MAGIC, version=VERSION, length=None):
+    length = len(body) if length is None else length
+    return HEADER.pack(magic, version, codec, length) + body
+
+
+MESSAGE = {
+    "id": "1",
+    "clipboard_text": "Hello, wörld",
+    "args": {"listvoices": False, "styledegree": None, "rate": 1.5},
+    "batch": {"texts": ["a", "b"]},
+}
+
+
+@pytest.mark.parametrize("codec", [CODEC_MARSHAL, CODEC_JSON])
+def test_round_trip(codec):
+    connection = Connection()
+    write_message(connection, MESSAGE, codec)
+    write_message(connection, ["second"], codec)
+    assert read_message(connection) == MESSAGE
+    assert read_message(connection) == ["second"]
+    assert read_message(connection) is None
+
+
+def test_large_message_sent_in_chunks():
+    connection = Connection(limit=CHUNK_SIZE * 2)
+    text = "x" * (CHUNK_SIZE * 2 + 10)
+    write_message(connection, {"clipboard_text": text})
+    assert connection.sent[1:] == [
+        CHUNK_SIZE,
+        CHUNK_SIZE,
+        len(connection.data) - HEADER.size - 2 * CHUNK_SIZE,
+    ]
+    assert read_message(connection) == {"clipboard_text": text}
+
+
+def test_unmarshalable_message_falls_back_to_json():
+    connection = Connection()
+    write_message(connection, {"value": object()})
+    assert connection.data[3] == CODEC_JSON
+    assert read_message(connection)["value"].startswith("<object object")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        frame(b'{"id": "1"}')[:5],
+        frame(b'{"id": "1"}')[:-1],
+        frame(b"", length=10),
+    ],
+    ids=["header", "body", "no body"],
+)
+def test_truncated_frame(data):
+    with pytest.raises(ProtocolError):
+        read_message(Connection(data))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        frame(b"{}", magic=b"XX"),
+        frame(b"{}", version=VERSION + 1),
+        frame(b"{}", codec=7),
+        frame(b"{not json"),
+        frame(b"\xff\x00", codec=CODEC_MARSHAL),
+    ],
+    ids=["magic", "version", "codec", "json", "marshal"],
+)
+def test_malformed_frame(data):
+    with pytest.raises(ProtocolError):
+        read_message(Connection(data))
+
+
+def test_frame_too_large(monkeypatch):
+    monkeypatch.setattr(protocol, "MAX_FRAME_SIZE", 16)
+    with pytest.raises(ProtocolError):
+        read_message(Connection(frame(b"", length=17)))
+    with pytest.raises(ProtocolError):
+        write_message(Connection(), "x" * 32)
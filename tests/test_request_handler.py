@@ -0,0 +1,52 @@
+import pytest
+
+import request_handler
+from conftest import speak_request
+from request_context import RequestContext
+
+
+def test_untranslated_sentence_fails_request(config_entry, monkeypatch):
+    def translate(text, config):
+        if text == "Two.":
+            raise RuntimeError("Could not translate the text: Two.")
+        return text
+
+    submitted = []
+    monkeypatch.setattr(request_handler, "translate", translate)
+    monkeypatch.setattr(
+        request_handler.pipeline,
+        "submit",
+        lambda text, context: submitted.append(text),
+    )
+    context = RequestContext(config_entry.config, {})
+
+    with pytest.raises(RuntimeError):
+        request_handler.process_sentences(["One.", "Two.", "Three."], context)
+    # The sentence spoken already is stopped, the others are not spoken
+    assert context.cancel_token.cancelled
+    assert submitted == ["One."]
+
+
+@pytest.mark.parametrize(
+    "text, chunks",
+    [
+        ("Hello there, how are you? I am fine, thank you very much.", 0),
+        ("Hello there, how are you? I am fine, thank you very much. " * 6, 12),
+    ],
+)
+def test_only_long_texts_are_translated_by_sentence(
+    config_entry, monkeypatch, text, chunks
+):
+    sentences = []
+
+    def process_sentences(sentences_, context, speak=True):
+        sentences.extend(sentences_)
+        return " ".join(sentences_), False
+
+    config_entry.config["translate"]["noTranslate"] = "False"
+    config_entry.config["TTS"]["bypass_tts"] = "True"
+    monkeypatch.setattr(request_handler, "process_sentences", process_sentences)
+    monkeypatch.setattr(request_handler, "translate", lambda text, config: text)
+
+    request_handler.process_request(speak_request(config_entry, text, "long"))
+    assert len(sentences) == chunks
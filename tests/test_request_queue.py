@@ -0,0 +1,142 @@
+import pytest
+
+from jobs import DROPPED, Job
+from progress import Progress
+from request_queue import (
+    BACKGROUND,
+    DROP_OLDEST,
+    FIFO,
+    LATEST_WINS,
+    LISTVOICES,
+    PREVIEW,
+    SPEAK,
+    RequestDropped,
+    RequestQueue,
+)
+
+
+def make_job(request_id, priority=SPEAK, text=None, config_entry=None):
+    """Job of a request in a priority class. Requests without a text read the
+    clipboard and are never coalesced."""
+    return Job(
+        {
+            "id": request_id,
+            "priority": priority,
+            "progress": Progress(),
+            "clipboard_text": text,
+            "config_entry": config_entry,
+        }
+    )
+
+
+def waiting(queue):
+    """Ids of the waiting jobs, in the order get() takes them."""
+    ids = []
+    while (job := queue.get(timeout=0)) is not None:
+        ids.append(job.id)
+    return ids
+
+
+def refused(job):
+    return isinstance(job.future.exception(timeout=0), RequestDropped)
+
+
+def test_fifo_refuses_new_job_when_full():
+    queue = RequestQueue(capacity=2, policy=FIFO)
+    jobs = [make_job(f"speak{i}") for i in range(3)]
+    for job in jobs:
+        queue.put(job)
+    assert refused(jobs[2])
+    assert waiting(queue) == ["speak0", "speak1"]
+    assert queue.stats()["rejected"] == 1
+
+
+def test_get_takes_highest_class_first():
+    queue = RequestQueue(capacity=8)
+    for request_id, priority in [
+        ("background", BACKGROUND),
+        ("voices", LISTVOICES),
+        ("speak", SPEAK),
+        ("preview", PREVIEW),
+    ]:
+        queue.put(make_job(request_id, priority))
+    assert waiting(queue) == ["speak", "preview", "voices", "background"]
+
+
+def test_drop_oldest_drops_lowest_class_first():
+    queue = RequestQueue(capacity=2, policy=DROP_OLDEST)
+    background = make_job("background", BACKGROUND)
+    queue.put(make_job("speak0"))
+    queue.put(background)
+    queue.put(make_job("speak1"))
+    assert refused(background)
+    assert background.state == DROPPED
+    assert waiting(queue) == ["speak0", "speak1"]
+
+
+def test_drop_oldest_drops_oldest_of_same_class():
+    queue = RequestQueue(capacity=2, policy=DROP_OLDEST)
+    jobs = [make_job(f"speak{i}") for i in range(3)]
+    for job in jobs:
+        queue.put(job)
+    assert refused(jobs[0])
+    assert waiting(queue) == ["speak1", "speak2"]
+
+
+def test_drop_oldest_never_drops_higher_class():
+    queue = RequestQueue(capacity=2, policy=DROP_OLDEST)
+    speak = [make_job(f"speak{i}") for i in range(2)]
+    background = make_job("background", BACKGROUND)
+    for job in speak + [background]:
+        queue.put(job)
+    assert refused(background)
+    assert not any(job.future.done() for job in speak)
+    assert waiting(queue) == ["speak0", "speak1"]
+
+
+def test_latest_wins_drops_own_class_only():
+    queue = RequestQueue(capacity=8, policy=LATEST_WINS)
+    older = make_job("speak0")
+    queue.put(older)
+    queue.put(make_job("voices", LISTVOICES))
+    queue.put(make_job("speak1"))
+    assert refused(older)
+    assert waiting(queue) == ["speak1", "voices"]
+
+
+@pytest.mark.parametrize("priority, kept", [(SPEAK, True), (BACKGROUND, False)])
+def test_latest_wins_keeps_capacity(priority, kept):
+    queue = RequestQueue(capacity=2, policy=LATEST_WINS)
+    queue.put(make_job("preview", PREVIEW))
+    queue.put(make_job("voices", LISTVOICES))
+    job = make_job("new", priority)
+    queue.put(job)
+    assert len(queue) == 2
+    if kept:
+        # The lowest class made room
+        assert waiting(queue) == ["new", "preview"]
+    else:
+        assert refused(job)
+        assert waiting(queue) == ["preview", "voices"]
+
+
+def test_identical_requests_are_coalesced(config_entry):
+    queue = RequestQueue(capacity=8, coalesce_window=10)
+    first = make_job("first", text="Hello", config_entry=config_entry)
+    second = make_job("second", text="Hello", config_entry=config_entry)
+    queue.put(first)
+    queue.put(second)
+    assert waiting(queue) == ["first"]
+    first.complete({"text": "Bonjour"})
+    assert second.future.result(timeout=0) == {"text": "Bonjour"}
+    assert queue.stats()["coalesced"] == 1
+
+
+def test_clear_drops_given_classes():
+    queue = RequestQueue(capacity=8)
+    speak = make_job("speak")
+    queue.put(speak)
+    queue.put(make_job("background", BACKGROUND))
+    assert queue.clear(priorities=(SPEAK, PREVIEW)) == 1
+    assert refused(speak)
+    assert waiting(queue) == ["background"]
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import throttle
+from throttle import ProviderGuard, TokenBucket
+
+
+def test_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(rate=1, burst=3)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=20, burst=1)
+    assert bucket.take()
+    assert not bucket.take()
+    time.sleep(0.06)
+    assert bucket.take()
+
+
+def test_take_waits_for_token_within_timeout():
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.take()
+    start = time.monotonic()
+    assert bucket.take(timeout=1)
+    assert 0.05 < time.monotonic() - start < 0.5
+
+
+def test_take_gives_up_when_token_comes_too_late():
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.take()
+    start = time.monotonic()
+    assert not bucket.take(timeout=0.2)
+    # Nothing to wait for once the next token would come after the timeout
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    monkeypatch.setattr(throttle, "FAILURE_THRESHOLD", 2)
+    # The probes are not tested here
+    monkeypatch.setattr(throttle.prober, "start", lambda: None)
+    return ProviderGuard("GoogleTranslator", "GoogleTranslator test")
+
+
+def test_guard_counts_throttled(guard):
+    guard.bucket = TokenBucket(rate=1, burst=1)
+    assert guard.allow()
+    assert not guard.allow()
+    stats = guard.stats()
+    assert (stats["allowed"], stats["throttled"]) == (1, 1)
+
+
+def test_circuit_opens_after_failures_in_a_row(guard):
+    guard.record(False, None)
+    guard.record(True, None)
+    guard.record(False, None)
+    assert not guard.is_open
+    guard.record(False, None)
+    assert guard.is_open
+    # An open circuit is not waited for
+    start = time.monotonic()
+    assert not guard.allow(timeout=1)
+    assert time.monotonic() - start < 0.1
+    assert guard.stats()["skipped_open"] == 1
@@ -0,0 +1,32 @@
+from translate_utils import split_sentences
+
+
+def test_splits_at_sentence_ends_and_line_breaks():
+    text = (
+        "Hello there, how are you? I am fine, thank you very much.\n"
+        "See you at the station tomorrow!"
+    )
+    assert split_sentences(text) == [
+        "Hello there, how are you?",
+        "I am fine, thank you very much.",
+        "See you at the station tomorrow!",
+    ]
+
+
+def test_keeps_abbreviations_with_their_sentence():
+    assert split_sentences("Dr. Smith arrived at 3 p.m. today.") == [
+        "Dr. Smith arrived at 3 p.m. today."
+    ]
+
+
+def test_keeps_short_sentences_with_the_next():
+    assert split_sentences("Yes. I would like a cup of tea, please.") == [
+        "Yes. I would like a cup of tea, please."
+    ]
+    assert split_sentences("I would like a cup of tea, please. Now!") == [
+        "I would like a cup of tea, please. Now!"
+    ]
+
+
+def test_splits_long_sentences_at_a_space():
+    assert split_sentences("aaaa bbbb cccc", limit=10) == ["aaaa bbbb", "cccc"]
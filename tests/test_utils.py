@@ -0,0 +1,90 @@
+import io
+import wave
+
+import pytest
+
+import utils
+
+
+class FakeDevice:
+    """PyAudio instance whose first streams fail to open."""
+
+    created = []
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.terminated = False
+        FakeDevice.created.append(self)
+
+    def get_format_from_width(self, width):
+        return width
+
+    def open(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("Invalid output device")
+        return FakeStream()
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeStream:
+    def start_stream(self):
+        pass
+
+    def is_active(self):
+        return False
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def silence():
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\0" * 320)
+    buffer.seek(0)
+    return wave.open(buffer, "rb")
+
+
+@pytest.fixture
+def devices(monkeypatch):
+    FakeDevice.created = []
+    monkeypatch.setattr(utils, "audio_device", None)
+    monkeypatch.setattr(utils, "audio_device_streams", 0)
+    # Not refreshed in the background during the test
+    monkeypatch.setattr(utils, "audio_device_refresher", object())
+    return FakeDevice.created
+
+
+def test_device_is_shared(devices, monkeypatch):
+    monkeypatch.setattr(utils.pyaudio, "PyAudio", FakeDevice)
+    utils.play_wave(silence())
+    utils.play_wave(silence())
+    assert len(devices) == 1
+    assert utils.audio_device_streams == 0
+
+
+def test_device_initialized_again_after_error(devices, monkeypatch):
+    # Only the device PortAudio knew at first has gone away
+    monkeypatch.setattr(
+        utils.pyaudio, "PyAudio", lambda: FakeDevice(failures=0 if devices else 1)
+    )
+    utils.play_wave(silence())
+    assert len(devices) == 2
+    assert devices[0].terminated
+    assert utils.audio_device is devices[1]
+
+
+def test_device_error_raised_when_retry_fails(devices, monkeypatch):
+    monkeypatch.setattr(utils.pyaudio, "PyAudio", lambda: FakeDevice(failures=2))
+    with pytest.raises(OSError):
+        utils.play_wave(silence())
+    assert len(devices) == 2
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import threading
+import time
+
+from translate_utils import pool, translator_options
+
+# Translations per second and burst allowed per provider and credential. The free
+# providers throttle hard and are kept well below what they allow.
+RATE_LIMITS = {
+    "GoogleTranslator": (5, 10),
+    "MyMemoryTranslator": (1, 5),
+    "LibreTranslator": (1, 5),
+}
+DEFAULT_RATE_LIMIT = (5, 10)
+# Consecutive failures after which a provider is not asked anymore
+FAILURE_THRESHOLD = 3
+# Seconds before an open circuit is probed, doubled after every failed probe up to
+# MAX_OPEN_SECONDS
+OPEN_SECONDS = 30
+MAX_OPEN_SECONDS = 300
+# Seconds between checks whether an open circuit is due to be probed
+PROBE_INTERVAL = 1
+# Text the probes translate
+PROBE_TEXT = "Hello"
+
+# States of a circuit
+CLOSED = "closed"
+OPEN = "open"
+
+
+class TokenBucket:
+    """Allows rate actions per second on average and up to burst at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, timeout=0):
+        """Take a token, waiting up to timeout seconds for one.
+
+        Args:
+            timeout (float): Seconds to wait, 0 returns right away.
+        Returns:
+            bool: False when no token is left, or none would be within timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                # Until the next token
+                delay = (1 - self.tokens) / self.rate
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+class ProviderGuard:
+    """Rate limiter and circuit breaker of one provider and credential.
+
+    The circuit opens after FAILURE_THRESHOLD translations in a row failed. While
+    it is open the provider is skipped, so requests go to the fallback providers at
+    once instead of waiting for it to time out again. An open circuit is closed
+    again by a background probe that translated successfully.
+    """
+
+    def __init__(self, provider, label):
+        self.provider = provider
+        self.label = label
+        self.bucket = TokenBucket(*RATE_LIMITS.get(provider, DEFAULT_RATE_LIMIT))
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.open_seconds = OPEN_SECONDS
+        self.retry_at = None
+        # Config of the last translation, which the probes translate with
+        self.config = None
+        self.counters = {"allowed": 0, "throttled": 0, "skipped_open": 0}
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def allow(self, timeout=0):
+        """Whether the provider may be asked, taking a token if so.
+
+        Args:
+            timeout (float): Seconds to wait for a token when the provider is over
+                its rate limit. An open circuit is never waited for.
+        Returns: bool
+        """
+        with self.lock:
+            if self.state == OPEN:
+                self.counters["skipped_open"] += 1
+                return False
+        allowed = self.bucket.take(timeout)
+        with self.lock:
+            self.counters["allowed" if allowed else "throttled"] += 1
+        return allowed
+
+    def record(self, ok, config):
+        """Record the outcome of a translation, opening the circuit after too many
+        failures in a row."""
+        with self.lock:
+            self.config = config
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == CLOSED and self.failures >= FAILURE_THRESHOLD:
+                self.open()
+
+    def open(self):
+        """Open the circuit. Call with the lock held."""
+        self.state = OPEN
+        self.retry_at = time.monotonic() + self.open_seconds
+        logging.warning(
+            f"{self.label} failed {self.failures} times in a row, not asking it for "
+            f"{self.open_seconds}s."
+        )
+        prober.start()
+
+    def due(self):
+        with self.lock:
+            return self.state == OPEN and time.monotonic() >= self.retry_at
+
+    def probe(self):
+        """Translate PROBE_TEXT, closing the circuit when it works and keeping it
+        open twice as long when not."""
+        try:
+            ok = bool(pool.translate(self.config, PROBE_TEXT, self.provider))
+        except Exception as e:
+            logging.info(f"Probe of {self.label} failed: {e}")
+            ok = False
+        with self.lock:
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                self.open_seconds = OPEN_SECONDS
+                logging.info(f"{self.label} works again.")
+            else:
+                self.open_seconds = min(self.open_seconds * 2, MAX_OPEN_SECONDS)
+                self.open()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "tokens": int(self.bucket.tokens),
+                **self.counters,
+            }
+
+
+class Prober:
+    """Background thread probing the open circuits once they are due."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="CircuitProbe", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(PROBE_INTERVAL)
+            with guards_lock:
+                due = [guard for guard in guards.values() if guard.due()]
+            for guard in due:
+                guard.probe()
+
+
+# Guards by provider and credentials
+guards = {}
+guards_lock = threading.Lock()
+prober = Prober()
+
+
+def get_guard(config, provider):
+    """Return the guard of a provider with the credentials of a config.
+
+    Args:
+        config: Configuration with a "translate" section.
+        provider (str): Provider to guard.
+    Returns: ProviderGuard
+    """
+    try:
+        credentials = tuple(translator_options(config, provider).values())
+    except Exception:
+        # Missing options: its translations fail and the circuit opens
+        credentials = ()
+    key = (provider, credentials)
+    with guards_lock:
+        guard = guards.get(key)
+        if guard is None:
+            # Never show the credentials, only tell guards of a provider apart
+            digest = hashlib.sha256(repr(credentials).encode()).hexdigest()[:8]
+            guard = guards[key] = ProviderGuard(provider, f"{provider} {digest}")
+        return guard
+
+
+def stats():
+    """State, failures in a row, tokens left and counters of each guard.
+
+    Returns:
+        dict: {"<provider> <credentials digest>": {...}}
+    """
+    with guards_lock:
+        current = list(guards.values())
+    return {guard.label: guard.stats() for guard in current}
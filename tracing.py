@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from statistics import quantiles
+
+# Spans of a request, in the order it goes through them. Durations in seconds.
+DECODE = "decode"  # reading and decoding the request
+CONFIG = "config"  # finding or building its config
+UTILS_INIT = "utils_init"
+TRANSLATION = "translation"
+CACHE_LOOKUP = "cache_lookup"
+ENGINE_INIT = "engine_init"  # only when the TTS client was not cached yet
+FIRST_BYTE = "synthesis_first_byte"  # from synthesis started to its first audio
+# Marks: seconds from the start of the request to the first utterance playing
+PLAYBACK_START = "playback_start"
+PLAYBACK_END = "playback_end"
+SPANS = (
+    DECODE,
+    CONFIG,
+    UTILS_INIT,
+    TRANSLATION,
+    CACHE_LOOKUP,
+    ENGINE_INIT,
+    FIRST_BYTE,
+    PLAYBACK_START,
+    PLAYBACK_END,
+)
+# Durations kept per span for the rolling percentiles
+SAMPLES = 500
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Percentiles of a list of numbers.
+
+    Args:
+        samples (list): At least one number.
+        points (tuple): Percentiles to return.
+    Returns:
+        dict: {"p50": ..., "p95": ..., "p99": ...} for the default points.
+    """
+    cuts = (
+        quantiles(samples, n=100, method="inclusive")
+        if len(samples) > 1
+        else list(samples) * 99
+    )
+    return {f"p{point}": cuts[point - 1] for point in points}
+
+
+class Trace:
+    """Spans of one request.
+
+    A span can be timed with span() around the work, or with begin() and end()
+    when it starts and ends in different places, like the first audio of a
+    synthesis. mark() records when something happened, counted from the start of
+    the request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # (name, seconds) in the order they ended
+        self.spans = []
+        # Start time of the spans begun and not ended yet, by name
+        self.open = {}
+        self.marks = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.spans.append((name, seconds))
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def begin(self, name):
+        with self.lock:
+            self.open[name] = time.perf_counter()
+
+    def end(self, name):
+        """End a span started with begin(), does nothing if none was."""
+        with self.lock:
+            start = self.open.pop(name, None)
+        if start is not None:
+            self.add(name, time.perf_counter() - start)
+
+    def mark(self, name):
+        """Record the time since the start of the request, only the first time."""
+        with self.lock:
+            self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def elapsed(self):
+        """Seconds since the start of the request."""
+        return time.perf_counter() - self.started
+
+    def to_dict(self):
+        with self.lock:
+            return {"spans": list(self.spans), "marks": dict(self.marks)}
+
+
+class SpanStats:
+    """Rolling durations of the spans of the last SAMPLES requests."""
+
+    def __init__(self, samples=SAMPLES):
+        self.lock = threading.Lock()
+        self.samples = {name: deque(maxlen=samples) for name in SPANS}
+
+    def add(self, trace):
+        """Add the spans and marks of a finished request."""
+        recorded = trace.to_dict()
+        with self.lock:
+            for name, seconds in recorded["spans"]:
+                self.samples[name].append(seconds)
+            for name, seconds in recorded["marks"].items():
+                self.samples[name].append(seconds)
+
+    def summary(self):
+        """Sample count and p50, p95 and p99 in seconds of each span seen so far.
+
+        Returns:
+            dict: {span: {"count", "p50", "p95", "p99"}}
+        """
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        return {
+            name: {"count": len(values), **percentiles(values)}
+            for name, values in samples.items()
+            if values
+        }
+
+
+# Spans of every request the server finished
+stats = SpanStats()
@@ -0,0 +1,429 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+
+from deep_translator import *
+
+from tracing import percentiles
+
+# Provider, language and credential combinations the pool keeps translators for
+POOL_KEYS = 8
+# Idle translators kept per combination, one per translation running at once
+POOL_IDLE = 4
+# Outcomes of the last translations kept per provider for its latency and errors
+OUTCOME_SAMPLES = 100
+# Longest chunk split_sentences returns, well below the providers' size limits
+CHUNK_CHARS = 1000
+# Pieces shorter than this are kept with the next sentence, e.g. "Dr." or "No. 5"
+MIN_SENTENCE_CHARS = 20
+# End of a sentence: closing punctuation followed by whitespace, CJK closing
+# punctuation, which is not followed by a space, or a line break
+SENTENCE_END = re.compile(r"(?<=[.!?؟।])\s+|(?<=[。！？])\s*|\s*\n\s*")
+
+
+def translator_options(config, provider=None):
+    """Credentials and settings of a provider that its translator is built with,
+    None for those it does not use.
+
+    Args:
+        config: Configuration with a "translate" section.
+        provider (str): Provider, the configured one if None.
+    Returns: dict
+    """
+    translator = provider or config.get("translate", "provider")
+    key = (
+        config.get("translate", f"{translator}_secret_key")
+        if not translator == "GoogleTranslator"
+        else None
+    )
+    email = (
+        config.get("translate", "email") if translator == "MyMemoryTranslator" else None
+    )
+    region = (
+        config.get("translate", "region")
+        if translator == "MicrosoftTranslator"
+        else None
+    )
+    pro = (
+        config.getboolean("translate", "deepl_pro")
+        if translator == "DeeplTranslator"
+        else None
+    )
+    url = config.get("translate", "url") if translator == "LibreProvider" else None
+    client_id = (
+        config.get("translate", "papagotranslator_client_id")
+        if translator == "PapagoTranslator"
+        else None
+    )
+    appid = (
+        config.get("translate", "baidutranslator_appid")
+        if translator == "BaiduTranslator"
+        else None
+    )
+    return {
+        "key": key,
+        "email": email,
+        "region": region,
+        "pro": pro,
+        "url": url,
+        "client_id": client_id,
+        "appid": appid,
+    }
+
+
+def translator_key(config, provider=None):
+    """Key of the translators that can be shared by configs: the provider, the
+    languages and the options returned by translator_options.
+
+    Args:
+        config: Configuration with a "translate" section.
+        provider (str): Provider, the configured one if None.
+    Returns: tuple
+    """
+    return (
+        provider or config.get("translate", "provider"),
+        config.get("translate", "startLang"),
+        config.get("translate", "endLang"),
+        *translator_options(config, provider).values(),
+    )
+
+
+def create_translator(config, provider=None):
+    """Create the translator of a provider.
+
+    Args:
+        config: Configuration with a "translate" section.
+        provider (str): Provider, the configured one if None.
+    Returns: deep_translator translator instance.
+    """
+    translator = provider or config.get("translate", "provider")
+    options = translator_options(config, provider)
+    key = options["key"]
+    email = options["email"]
+    region = options["region"]
+    pro = options["pro"]
+    url = options["url"]
+    client_id = options["client_id"]
+    appid = options["appid"]
+
+    match translator:
+        case "GoogleTranslator":
+            translate_instance = GoogleTranslator(
+                source="auto", target=config.get("translate", "endLang")
+            )
+        case "PonsTranslator":
+            translate_instance = PonsTranslator(
+                source="auto", target=config.get("translate", "endLang")
+            )
+        case "LingueeTranslator":
+            translate_instance = LingueeTranslator(
+                source="auto", target=config.get("translate", "endLang")
+            )
+        case "MyMemoryTranslator":
+            translate_instance = MyMemoryTranslator(
+                source=config.get("translate", "startLang"),
+                target=config.get("translate", "endLang"),
+                email=email,
+            )
+        case "YandexTranslator":
+            translate_instance = YandexTranslator(
+                source=config.get("translate", "startLang"),
+                target=config.get("translate", "endLang"),
+                api_key=key,
+            )
+        case "MicrosoftTranslator":
+            translate_instance = MicrosoftTranslator(
+                api_key=key,
+                source=config.get("translate", "startLang"),
+                target=config.get("translate", "endLang"),
+                region=region,
+            )
+        case "QcriTranslator":
+            translate_instance = QcriTranslator(
+                source="auto",
+                target=config.get("translate", "endLang"),
+                api_key=key,
+            )
+        case "DeeplTranslator":
+            translate_instance = DeeplTranslator(
+                source=config.get("translate", "startlang"),
+                target=config.get("translate", "endLang"),
+                api_key=key,
+                use_free_api=not pro,
+            )
+        case "LibreTranslator":
+            translate_instance = LibreTranslator(
+                source=config.get("translate", "startlang"),
+                target=config.get("translate", "endLang"),
+                api_key=key,
+                custom_url=url,
+            )
+        case "PapagoTranslator":
+            translate_instance = PapagoTranslator(
+                source="auto",
+                target=config.get("translate", "endLang"),
+                client_id=client_id,
+                secret_key=key,
+            )
+        case "ChatGptTranslator":
+            translate_instance = ChatGptTranslator(
+                source="auto", target=config.get("translate", "endLang")
+            )
+        case "BaiduTranslator":
+            translate_instance = BaiduTranslator(
+                source=config.get("translate", "startlang"),
+                target=config.get("translate", "endLang"),
+                appid=appid,
+                appkey=key,
+            )
+        case _:
+            raise ValueError(f"Unknown translation provider {translator}")
+    # elif translator == "DeepLearningTranslator":
+    #     translate_instance = BaiduTranslator(source=config.get('translate', 'startlang'),
+    #                                          target=config.get('translate', 'endLang'),
+    #                                          appid=appid,
+    #                                          appkey=key)
+    return translate_instance
+
+
+class TranslatorPool:
+    """Translators ready to use, keyed by translator_key, so that a request does not
+    read the options and build a translator again.
+
+    deep_translator translators keep the text of a translation in the instance
+    while sending it, so an instance is only used by one translation at a time.
+    translate() takes an idle translator of the key or builds a new one, and puts
+    it back once done. Only the POOL_KEYS most recently used keys are kept, so the
+    translators of a changed config are dropped.
+    """
+
+    def __init__(self, keys=POOL_KEYS, idle=POOL_IDLE):
+        self.keys = keys
+        self.idle_per_key = idle
+        # Idle (translator, whether it translated before) by key, least recently
+        # used key first
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+        # Counters and seconds spent building translators and translating with
+        # them, by provider
+        self.providers = {}
+        # (seconds, whether it succeeded) of the last translations, by provider
+        self.outcomes = {}
+
+    def record(self, provider, name, seconds):
+        with self.lock:
+            counters = self.providers.setdefault(
+                provider,
+                {
+                    kind: {"count": 0, "seconds": 0.0}
+                    for kind in ("built", "first_calls", "calls")
+                },
+            )
+            counters[name]["count"] += 1
+            counters[name]["seconds"] += seconds
+
+    def take(self, config, provider=None):
+        """Return an idle translator of the config and whether it was used before,
+        building one when none is idle."""
+        key = translator_key(config, provider)
+        with self.lock:
+            translators = self.idle.get(key)
+            if translators:
+                self.idle.move_to_end(key)
+                return translators.pop()
+        start = time.perf_counter()
+        translator = create_translator(config, provider)
+        seconds = time.perf_counter() - start
+        self.record(key[0], "built", seconds)
+        logging.info(f"Built {key[0]} in {seconds:0.3f} seconds.")
+        return translator, False
+
+    def put(self, config, translator, used=True, provider=None):
+        """Make a translator taken with take() available again."""
+        key = translator_key(config, provider)
+        with self.lock:
+            translators = self.idle.setdefault(key, [])
+            self.idle.move_to_end(key)
+            if len(translators) < self.idle_per_key:
+                translators.append((translator, used))
+            while len(self.idle) > self.keys:
+                self.idle.popitem(last=False)
+
+    def prepare(self, config):
+        """Build a translator for the config unless one is idle already."""
+        translator, used = self.take(config)
+        self.put(config, translator, used)
+
+    def translate(self, config, text, provider=None):
+        """Translate text with a translator of the config.
+
+        Args:
+            config: Configuration with a "translate" section.
+            text (str): Text to translate.
+            provider (str): Provider, the configured one if None.
+        Returns: str
+        """
+        provider = provider or config.get("translate", "provider")
+        start = time.perf_counter()
+        try:
+            translator, used = self.take(config, provider)
+            call_start = time.perf_counter()
+            translation = translator.translate(text)
+        except Exception:
+            # Not put back, the next translation gets a new translator
+            self.add_outcome(provider, time.perf_counter() - start, False)
+            raise
+        self.record(
+            provider,
+            "calls" if used else "first_calls",
+            time.perf_counter() - call_start,
+        )
+        self.add_outcome(provider, time.perf_counter() - start, True)
+        self.put(config, translator, provider=provider)
+        return translation
+
+    def add_outcome(self, provider, seconds, ok):
+        with self.lock:
+            self.outcomes.setdefault(provider, deque(maxlen=OUTCOME_SAMPLES)).append(
+                (seconds, ok)
+            )
+
+    def health(self, provider):
+        """Latency and errors of the last OUTCOME_SAMPLES translations of a
+        provider.
+
+        Returns:
+            dict: {"samples": successful translations, "p95": their 95th
+            percentile in seconds or None without any, "error_rate": share of
+            the translations that failed}
+        """
+        with self.lock:
+            outcomes = list(self.outcomes.get(provider, ()))
+        latencies = [seconds for seconds, ok in outcomes if ok]
+        return {
+            "samples": len(latencies),
+            "p95": percentiles(latencies, (95,))["p95"] if latencies else None,
+            "error_rate": (
+                (len(outcomes) - len(latencies)) / len(outcomes) if outcomes else 0.0
+            ),
+        }
+
+    def stats(self):
+        """Translators built and translations done by provider, with the mean
+        seconds each took: the first translation of a translator separately, as it
+        opens the connection to the provider. And the health() of each provider.
+
+        Returns:
+            dict: {provider: {"built", "first_calls", "calls": {"count", "mean"},
+            "health": {"samples", "p95", "error_rate"}}}
+        """
+        with self.lock:
+            summary = {
+                provider: {
+                    name: {
+                        "count": value["count"],
+                        "mean": (
+                            value["seconds"] / value["count"]
+                            if value["count"]
+                            else None
+                        ),
+                    }
+                    for name, value in counters.items()
+                }
+                for provider, counters in self.providers.items()
+            }
+            providers = set(summary) | set(self.outcomes)
+        for provider in providers:
+            summary.setdefault(provider, {})["health"] = self.health(provider)
+        return summary
+
+
+# Translators of every config, shared by all requests
+pool = TranslatorPool()
+
+
+def translate_clipboard(text, config, provider=None):
+    """Translate text with a provider.
+
+    Args:
+        text (str): Text to translate.
+        config: Configuration with a "translate" section.
+        provider (str): Provider, the configured one if None.
+    Returns:
+        str: The translation, None if it failed.
+    """
+    try:
+        translator = provider or config.get("translate", "provider")
+        logging.info("Translation Provider is {}".format(translator))
+        logging.info(f'Text [{config.get("translate", "startLang")}]: {text}')
+        if config.get("translate", "endLang") in [
+            "ckb" "ku",
+            "kmr",
+            "kmr-TR",
+            "ckb-IQ",
+        ]:
+            text = normalize_text(text)
+        translation = pool.translate(config, text, translator)
+        logging.info(
+            f'Translation [{config.get("translate", "endLang")}]: {translation}'
+        )
+        return translation
+    except Exception as e:
+        logging.error(f"Translation Error: {e}", exc_info=True)
+
+
+def split_sentences(text, limit=CHUNK_CHARS, shortest=MIN_SENTENCE_CHARS):
+    """Split text into sentences to translate separately, splitting sentences
+    longer than limit at the last space before it.
+
+    Abbreviations end in a full stop as well, so a piece shorter than shortest is
+    kept with the next one, as is a piece followed by one starting in lower case:
+    "Dr. Smith arrived at 3 p.m. today." stays one sentence.
+
+    Args:
+        text (str): Text to split.
+        limit (int): Longest chunk in characters.
+        shortest (int): Shortest sentence in characters, but for a text that short.
+    Returns:
+        list: Non-empty chunks, in order.
+    """
+    # Pieces keep the whitespace after them, so that joining them gives the text
+    pieces = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        pieces.append(text[start : match.end()])
+        start = match.end()
+    pieces.append(text[start:])
+    sentences = []
+    for piece in pieces:
+        if sentences and (
+            len(sentences[-1].strip()) < shortest or piece.lstrip()[:1].islower()
+        ):
+            sentences[-1] += piece
+        else:
+            sentences.append(piece)
+    if len(sentences) > 1 and len(sentences[-1].strip()) < shortest:
+        last = sentences.pop()
+        sentences[-1] += last
+
+    chunks = []
+    for sentence in sentences:
+        sentence = sentence.strip()
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit)
+            if cut <= 0:
+                cut = limit
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            chunks.append(sentence)
+    return chunks
+
+
+def normalize_text(text: str):
+    normalizedText = unicodedata.normalize("NFC", text)
+    logging.info("Normalized Text: {}".format(normalizedText))
+    return normalizedText
@@ -0,0 +1,177 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import utils
+
+# Seconds a translation is served from the cache before it is fetched again
+TRANSLATION_TTL = float(
+    os.environ.get("AACSPEAKHELPER_TRANSLATION_TTL", 30 * 24 * 60 * 60)
+)
+# Translations kept, the least recently used ones are evicted beyond this
+TRANSLATION_CACHE_SIZE = int(
+    os.environ.get("AACSPEAKHELPER_TRANSLATION_CACHE_SIZE", 20000)
+)
+# File of the cache, next to cache_history.db in the audio files directory
+DATABASE = "translation_cache.db"
+
+# Caches by audio files directory
+caches = {}
+caches_lock = threading.Lock()
+
+
+def normalize(text):
+    """Key of a text: NFC normalized, with runs of whitespace collapsed and the
+    ends stripped, so that the same phrase typed slightly differently is a hit."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class TranslationCache:
+    """Translations kept in a SQLite database, keyed by provider, source language,
+    target language and normalized text.
+
+    Repeated phrases are translated without a network call, also when offline.
+    Translations older than ttl seconds are fetched again, and beyond capacity the
+    least recently used ones are evicted.
+    """
+
+    def __init__(self, path, ttl=TRANSLATION_TTL, capacity=TRANSLATION_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "stored": 0,
+            "evicted": 0,
+        }
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS "Translations" (
+                    "provider" TEXT NOT NULL,
+                    "source" TEXT NOT NULL,
+                    "target" TEXT NOT NULL,
+                    "text" TEXT NOT NULL,
+                    "translation" TEXT NOT NULL,
+                    "created" REAL NOT NULL,
+                    "used" REAL NOT NULL,
+                    PRIMARY KEY("provider", "source", "target", "text"));""")
+            self.connection.execute("""CREATE INDEX IF NOT EXISTS "translations_used"
+                    ON "Translations" ("used");""")
+
+    def get(self, provider, source, target, text):
+        """Return the cached translation of a text, None on a miss or when it
+        expired."""
+        key = (provider, source, target, normalize(text))
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT translation, created FROM Translations"
+                " WHERE provider=? AND source=? AND target=? AND text=?",
+                key,
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self.connection.execute(
+                    "DELETE FROM Translations"
+                    " WHERE provider=? AND source=? AND target=? AND text=?",
+                    key,
+                )
+                self.counters["expired"] += 1
+                row = None
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self.connection.execute(
+                "UPDATE Translations SET used=?"
+                " WHERE provider=? AND source=? AND target=? AND text=?",
+                (now, *key),
+            )
+            self.counters["hits"] += 1
+            return row[0]
+
+    def put(self, provider, source, target, text, translation):
+        """Cache the translation of a text, evicting the least recently used
+        translations beyond capacity."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO Translations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (provider, source, target, normalize(text), translation, now, now),
+            )
+            self.counters["stored"] += 1
+            evicted = self.connection.execute(
+                "DELETE FROM Translations WHERE rowid IN (SELECT rowid FROM"
+                " Translations ORDER BY used LIMIT max(0, (SELECT COUNT(*) FROM"
+                " Translations) - ?))",
+                (self.capacity,),
+            ).rowcount
+            self.counters["evicted"] += evicted
+
+    def stats(self):
+        """Number of cached translations and the hit, miss, expired, stored and
+        evicted counts since the server started."""
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM Translations"
+            ).fetchone()[0]
+            return {"entries": entries, **self.counters}
+
+
+def get_cache(directory_path=None):
+    """Return the translation cache of an audio files directory, opening it on
+    first use.
+
+    Args:
+        directory_path (str): Audio files directory, the default one if None.
+    Returns: TranslationCache
+    """
+    if directory_path is None:
+        _, directory_path = utils.get_paths()
+    with caches_lock:
+        cache = caches.get(directory_path)
+        if cache is None:
+            cache = caches[directory_path] = TranslationCache(
+                os.path.join(directory_path, DATABASE)
+            )
+            logging.info(f"Opened translation cache in {directory_path}.")
+        return cache
+
+
+def cache_key(config, text, provider=None):
+    """Provider, source language, target language and text of a translation, by
+    default with the configured provider."""
+    return (
+        provider or config.get("translate", "provider"),
+        config.get("translate", "startLang"),
+        config.get("translate", "endLang"),
+        text,
+    )
+
+
+def lookup(config, text):
+    """Return the cached translation of text with the provider and languages of a
+    config, None on a miss or when the cache cannot be read."""
+    try:
+        return get_cache(config["App"]["audio_files_path"]).get(
+            *cache_key(config, text)
+        )
+    except sqlite3.Error as error:
+        logging.error(f"Failed to read translation cache: {error}")
+        return None
+
+
+def store(config, text, translation, provider=None):
+    """Cache the translation of text with the languages of a config, by the
+    provider that translated it, the configured one if None."""
+    try:
+        get_cache(config["App"]["audio_files_path"]).put(
+            *cache_key(config, text, provider), translation
+        )
+    except sqlite3.Error as error:
+        logging.error(f"Failed to write translation cache: {error}")
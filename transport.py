@@ -0,0 +1,303 @@
+import logging
+import os
+import select
+import socket
+import sys
+import tempfile
+
+if sys.platform == "win32":
+    import pywintypes
+    import win32event
+    import win32file
+    import win32pipe
+
+PIPE_NAME = r"\\.\pipe\AACSpeakHelper"
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), "AACSpeakHelper.sock")
+BUFFER_SIZE = 64 * 1024
+# Server side reads give up on a client that stops sending for this long.
+IO_TIMEOUT = 30
+ERROR_BROKEN_PIPE = 109
+ERROR_PIPE_BUSY = 231
+ERROR_PIPE_CONNECTED = 535
+ERROR_IO_PENDING = 997
+
+
+class TransportError(Exception):
+    """Raised when the server cannot be reached or a connection drops."""
+
+
+def wait_overlapped(handle, overlapped, timeout):
+    """Wait for an overlapped operation on handle to finish.
+
+    Args:
+        handle: Pipe handle the operation was started on.
+        overlapped: OVERLAPPED passed to the operation.
+        timeout (float): Seconds to wait, None to wait forever.
+    Returns:
+        int: Number of bytes transferred, or None if the timeout expired and the
+        operation was cancelled.
+    """
+    milliseconds = win32event.INFINITE if timeout is None else int(timeout * 1000)
+    if win32event.WaitForSingleObject(overlapped.hEvent, milliseconds) != 0:
+        win32file.CancelIo(handle)
+        return None
+    return win32file.GetOverlappedResult(handle, overlapped, False)
+
+
+class NamedPipeConnection:
+    """One end of a connected Windows named pipe instance, used as a byte stream.
+
+    Server side instances are opened for overlapped I/O so that reads can time out
+    and listening can be interrupted.
+    """
+
+    def __init__(self, handle, overlapped=None, timeout=None):
+        self.handle = handle
+        self.overlapped = overlapped
+        self.timeout = timeout
+
+    def recv_into(self, view):
+        """Read up to len(view) bytes into view.
+
+        Returns:
+            int: Number of bytes read, 0 if the other end closed the pipe.
+        """
+        try:
+            if self.overlapped is None:
+                _, data = win32file.ReadFile(self.handle, len(view))
+            else:
+                buffer = win32file.AllocateReadBuffer(len(view))
+                win32file.ReadFile(self.handle, buffer, self.overlapped)
+                count = wait_overlapped(self.handle, self.overlapped, self.timeout)
+                if count is None:
+                    raise TransportError("Timed out waiting for the client.")
+                data = bytes(buffer[:count])
+        except pywintypes.error as error:
+            if error.winerror == ERROR_BROKEN_PIPE:
+                return 0
+            raise TransportError(error) from error
+        view[: len(data)] = data
+        return len(data)
+
+    def send(self, data):
+        try:
+            if self.overlapped is None:
+                win32file.WriteFile(self.handle, data)
+            else:
+                win32file.WriteFile(self.handle, data, self.overlapped)
+                if wait_overlapped(self.handle, self.overlapped, self.timeout) is None:
+                    raise TransportError("Timed out writing to the client.")
+        except pywintypes.error as error:
+            raise TransportError(error) from error
+
+    def close(self):
+        if self.overlapped is not None:
+            try:
+                win32file.FlushFileBuffers(self.handle)
+                win32pipe.DisconnectNamedPipe(self.handle)
+            except pywintypes.error:
+                pass
+            win32file.CloseHandle(self.overlapped.hEvent)
+        win32file.CloseHandle(self.handle)
+
+
+class NamedPipeTransport:
+    """Transport over the \\\\.\\pipe\\AACSpeakHelper named pipe (Windows only)."""
+
+    name = "pipe"
+
+    def __init__(self, pipe_name=PIPE_NAME):
+        self.address = pipe_name
+
+    def listen(self):
+        # Every accept() creates its own pipe instance, nothing to set up.
+        pass
+
+    def accept(self, timeout=None):
+        """Create a pipe instance and wait until a client connects to it.
+
+        Several threads can call this at once, each one then owns a listening
+        instance of the pipe.
+
+        Args:
+            timeout (float): Seconds to wait for a client, None to wait forever.
+        Returns:
+            NamedPipeConnection, or None if no client connected within timeout.
+        """
+        handle = win32pipe.CreateNamedPipe(
+            self.address,
+            win32pipe.PIPE_ACCESS_DUPLEX | win32file.FILE_FLAG_OVERLAPPED,
+            win32pipe.PIPE_TYPE_BYTE
+            | win32pipe.PIPE_READMODE_BYTE
+            | win32pipe.PIPE_WAIT,
+            win32pipe.PIPE_UNLIMITED_INSTANCES,
+            BUFFER_SIZE,
+            BUFFER_SIZE,
+            0,
+            None,
+        )
+        overlapped = pywintypes.OVERLAPPED()
+        overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+        try:
+            result = win32pipe.ConnectNamedPipe(handle, overlapped)
+            if result == ERROR_IO_PENDING:
+                if wait_overlapped(handle, overlapped, timeout) is None:
+                    win32file.CloseHandle(overlapped.hEvent)
+                    win32file.CloseHandle(handle)
+                    return None
+            elif result not in (0, ERROR_PIPE_CONNECTED):
+                raise TransportError(f"ConnectNamedPipe failed: {result}")
+        except Exception:
+            win32file.CloseHandle(overlapped.hEvent)
+            win32file.CloseHandle(handle)
+            raise
+        return NamedPipeConnection(handle, overlapped, IO_TIMEOUT)
+
+    def connect(self, timeout=5):
+        """Open the client end of the pipe, waiting up to timeout seconds for a
+        free instance when all of them are busy.
+
+        Returns:
+            NamedPipeConnection
+        """
+        try:
+            while True:
+                try:
+                    handle = win32file.CreateFile(
+                        self.address,
+                        win32file.GENERIC_READ | win32file.GENERIC_WRITE,
+                        0,
+                        None,
+                        win32file.OPEN_EXISTING,
+                        0,
+                        None,
+                    )
+                    break
+                except pywintypes.error as error:
+                    if error.winerror != ERROR_PIPE_BUSY:
+                        raise
+                    win32pipe.WaitNamedPipe(self.address, int(timeout * 1000))
+        except pywintypes.error as error:
+            raise TransportError(error) from error
+        return NamedPipeConnection(handle)
+
+    def close(self):
+        pass
+
+
+class UnixSocketConnection:
+    """One end of a connected Unix domain socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv_into(self, view):
+        """Read up to len(view) bytes into view.
+
+        Returns:
+            int: Number of bytes read, 0 if the other end closed the socket.
+        """
+        try:
+            return self.sock.recv_into(view)
+        except OSError as error:
+            raise TransportError(error) from error
+
+    def send(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError as error:
+            raise TransportError(error) from error
+
+    def close(self):
+        self.sock.close()
+
+
+class UnixSocketTransport:
+    """Transport over a Unix domain socket, used on Linux and macOS."""
+
+    name = "unix"
+
+    def __init__(self, path=SOCKET_PATH):
+        self.address = path
+        self.server_socket = None
+
+    def listen(self, backlog=16):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(self.address)
+        os.chmod(self.address, 0o600)
+        self.server_socket.listen(backlog)
+        # Several listener threads share the socket and wait in select() instead
+        self.server_socket.setblocking(False)
+
+    def accept(self, timeout=None):
+        """Wait until a client connects. Safe to call from several threads at once.
+
+        Args:
+            timeout (float): Seconds to wait for a client, None to wait forever.
+        Returns:
+            UnixSocketConnection, or None if no client connected within timeout.
+        """
+        server_socket = self.server_socket
+        if server_socket is None:
+            raise TransportError("Transport is closed.")
+        try:
+            ready, _, _ = select.select([server_socket], [], [], timeout)
+            if not ready:
+                return None
+            sock, _ = server_socket.accept()
+        except BlockingIOError:
+            # Another listener took the client first
+            return None
+        except OSError as error:
+            raise TransportError(error) from error
+        sock.settimeout(IO_TIMEOUT)
+        return UnixSocketConnection(sock)
+
+    def connect(self):
+        """Open a connection to the server socket.
+
+        Returns:
+            UnixSocketConnection
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except OSError as error:
+            sock.close()
+            raise TransportError(error) from error
+        return UnixSocketConnection(sock)
+
+    def close(self):
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+            if os.path.exists(self.address):
+                os.remove(self.address)
+
+
+def get_transport(kind=None, address=None):
+    """Return the transport to use on this platform.
+
+    The AACSPEAKHELPER_TRANSPORT ("pipe" or "unix") and AACSPEAKHELPER_ADDRESS
+    environment variables override the platform defaults.
+
+    Args:
+        kind (str): "pipe" or "unix". Defaults to the named pipe on Windows.
+        address (str): Pipe name or socket path.
+    Returns: NamedPipeTransport or UnixSocketTransport
+    """
+    kind = kind or os.getenv("AACSPEAKHELPER_TRANSPORT")
+    if not kind:
+        kind = "pipe" if sys.platform == "win32" else "unix"
+    address = address or os.getenv("AACSPEAKHELPER_ADDRESS")
+    match kind:
+        case "pipe":
+            transport = NamedPipeTransport(address or PIPE_NAME)
+        case "unix":
+            transport = UnixSocketTransport(address or SOCKET_PATH)
+        case _:
+            raise ValueError(f"Unknown transport: {kind}")
+    logging.info(f"Using {transport.name} transport at {transport.address}")
+    return transport
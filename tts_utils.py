@@ -21,15 +21,31 @@ from tts_wrapper import (
     GoogleTransClient,
 )
 import warnings
-from threading import Thread
+from threading import Lock, Thread
 from configure_enc_utils import load_config, load_credentials
+import progress as progress_events
+from progress import Progress
+from cancellation import Cancelled, CancelToken
+from request_context import RequestContext
+from tracing import CACHE_LOOKUP, ENGINE_INIT, FIRST_BYTE
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
+# Compatibility shims for callers that do not pass a RequestContext: the state of
+# the last request passed to init(), and the voices of the last --listvoices.
 utils = None
 voices = None
-ready = True
 # Global dictionary to store TTS clients
 tts_voiceid = {}
+# Progress events of the request being processed
+progress = Progress()
+# Stops synthesis and playback of the request being processed
+cancel_token = CancelToken()
+# Key of the TTS clients only render() uses in a config's tts_clients. They are a
+# second instance of each engine and voice, so that rendering ahead on the
+# synthesis thread never uses the client the playback thread is streaming with.
+RENDER_CLIENTS = "render"
+# render() synthesizes one text at a time with the render clients
+render_lock = Lock()
 
 VALID_STYLES = [
     "advertisement_upbeat",
@@ -69,42 +85,67 @@ VALID_STYLES = [
 ]
 
 
-def init(module):
+def init(module, tts_clients=None, request_progress=None, request_cancel_token=None):
     """Initialize utils module making it in memory instead of one time instance.
 
     Args:
         module: Instance of utils module.
+        tts_clients (dict): TTS clients already built for the current config, keyed
+            by engine and voice id. Shared across requests with the same config.
+        request_progress (Progress): Progress events of the current request.
+        request_cancel_token (CancelToken): Cancels the current request.
     Returns: None
     """
     global utils
+    global tts_voiceid
+    global progress
+    global cancel_token
     utils = module
+    if tts_clients is not None:
+        tts_voiceid = tts_clients
+    progress = request_progress or Progress()
+    cancel_token = request_cancel_token or CancelToken()
 
 
-def init_azure_tts():
+def global_context():
+    """RequestContext of the state set by init(), for callers without a context.
+
+    Returns: RequestContext
+    """
+    return RequestContext(utils.config, utils.args, tts_voiceid, progress, cancel_token)
+
+
+def init_azure_tts(config=None):
     """Initialize unique instance of MicrosoftTTS based on the changes in voiceid.
 
+    Args:
+        config: Configuration of the request, utils.config if None.
     Returns: MicrosoftTTS
     """
-    key = utils.config.get("azureTTS", "key")
-    config = load_config()
+    config = config if config is not None else utils.config
+    key = config.get("azureTTS", "key")
+    defaults = load_config()
     if key == "":
-        key = config.get("azureTTS")["key"]
-    location = utils.config.get("azureTTS", "location")
+        key = defaults.get("azureTTS")["key"]
+    location = config.get("azureTTS", "location")
     if location == "":
-        location = config.get("azureTTS")["location"]
-    voiceid = utils.config.get("azureTTS", "voiceid")
+        location = defaults.get("azureTTS")["location"]
+    voiceid = config.get("azureTTS", "voiceid")
     parts = voiceid.split("-")
     lang = parts[0] + "-" + parts[1]
     client = MicrosoftClient((key, location))
     return MicrosoftTTS(client=client, voice=voiceid, lang=lang)
 
 
-def init_google_tts():
+def init_google_tts(config=None):
     """Initialize unique instance of GoogleTTS based on the changes in voiceid.
 
+    Args:
+        config: Configuration of the request, utils.config if None.
     Returns: GoogleTTS
     """
-    gcreds = utils.config.get("googleTTS", "creds")
+    config = config if config is not None else utils.config
+    gcreds = config.get("googleTTS", "creds")
     path = Path(gcreds)
     if not path.exists():
         path = Path("google_creds.enc")
@@ -115,31 +156,37 @@ def init_google_tts():
     logging.info(f"Google TTS credentials file location: {path}")
     if not isinstance(gcreds, dict) and os.path.isfile(gcreds):
         logging.info(f"Google TTS credentials file: {gcreds}")
-    voiceid = utils.config.get("googleTTS", "voiceid")
+    voiceid = config.get("googleTTS", "voiceid")
     client = GoogleClient(credentials=gcreds)
     tts = GoogleTTS(client=client, voice=voiceid)
     return tts
 
 
-def init_sapi_tts():
+def init_sapi_tts(config=None):
     """Initialize unique instance of SAPITTS based on the changes in voiceid.
 
+    Args:
+        config: Configuration of the request, utils.config if None.
     Returns: SAPITTS
     """
-    voiceid = utils.config.get("sapi5TTS", "voiceid")
+    config = config if config is not None else utils.config
+    voiceid = config.get("sapi5TTS", "voiceid")
     client = SAPIClient()
     client._client.setProperty("voice", voiceid)
-    client._client.setProperty("rate", utils.config.get("TTS", "rate"))
-    client._client.setProperty("volume", utils.config.get("TTS", "volume"))
+    client._client.setProperty("rate", config.get("TTS", "rate"))
+    client._client.setProperty("volume", config.get("TTS", "volume"))
     return SAPITTS(client=client)
 
 
-def init_onnx_tts():
+def init_onnx_tts(config=None):
     """Initialize unique instance of SherpaOnnxTTS based on the changes in voiceid.
 
+    Args:
+        config: Configuration of the request, utils.config if None.
     Returns: SherpaOnnxTTS
     """
-    voiceid = utils.config.get("SherpaOnnxTTS", "voiceid")
+    config = config if config is not None else utils.config
+    voiceid = config.get("SherpaOnnxTTS", "voiceid")
     if getattr(sys, "frozen", False):
         home_directory = os.path.expanduser("~")
         onnx_cache_path = os.path.join(
@@ -161,17 +208,20 @@ def init_onnx_tts():
     return tts
 
 
-def init_googleTrans_tts():
+def init_googleTrans_tts(config=None):
     """Initialize unique instance of GoogleTransTTS based on the changes in voiceid.
 
+    Args:
+        config: Configuration of the request, utils.config if None.
     Returns: GoogleTransTTS
     """
-    voiceid = utils.config.get("googleTransTTS", "voiceid")
+    config = config if config is not None else utils.config
+    voiceid = config.get("googleTransTTS", "voiceid")
     client = GoogleTransClient(voiceid)
     return GoogleTransTTS(client)
 
 
-def speak(text="", list_voices=False):
+def speak(text="", list_voices=False, context=None):
     """Speak function convert text parameter to speech. This function decides which TTS Engine will be used
     base on the config file received.
     Then, it will call the specific function that will create the TTS Engine Instance.
@@ -179,116 +229,289 @@ def speak(text="", list_voices=False):
     Args:
         text (str): String to be spoken by specific TTS Engine.
         list_voices (bool): Use to return all available voices only instead of speech function .
-    Returns: None
+        context (RequestContext): Context of the request, the state set by init() if None.
+    Returns:
+        Thread: Thread streaming the speech, which is done once it was played. None
+        when it was played, or could not be, before speak returned.
     """
     global voices
-    global ready
-    ready = False
+    context = context or global_context()
+    config = context.config
+    request_progress = context.progress
 
     try:
-        ttsengine = utils.config.get("TTS", "engine")
-        voice_id = utils.config.get(ttsengine, "voiceid")
+        ttsengine = config.get("TTS", "engine")
+        voice_id = config.get(ttsengine, "voiceid")
         if not voice_id:
-            voice_id = utils.config.get("TTS", "voiceid")
+            voice_id = config.get("TTS", "voiceid")
     except Exception as e:
         logging.error(f"Error getting TTS engine or voice ID: {e}")
         return
-    finally:
-        ready = True
 
     try:
-        file = utils.check_history(text)
+        with request_progress.trace.span(CACHE_LOOKUP):
+            file = utils.check_history(text, context)
         if file is not None and os.path.isfile(file):
             if list_voices:
-                tts_client = tts_voiceid[ttsengine][voice_id]
-                voices = tts_client.get_voices()
+                tts_client = context.tts_clients[ttsengine][voice_id]
+                voices = context.voices = tts_client.get_voices()
                 return
             else:
-                voices = None
-            utils.play_audio(file, file=True)
+                voices = context.voices = None
+            request_progress.emit(progress_events.CACHE_HIT)
+            request_progress.emit(progress_events.FIRST_AUDIO)
+            utils.play_audio(file, file=True, cancel_token=context.cancel_token)
+            request_progress.emit(progress_events.PLAYBACK_DONE)
             logging.info(f"Speech synthesized for text [{text}] from cache.")
-            ready = True  # Make sure to update ready after cache playback
             return
     except Exception as e:
         logging.error(f"Error checking history or playing audio: {e}")
-        ready = True  # In case of error, ensure ready is set back
         return
 
     logging.info(f"Speech synthesized for text [{text}].")
+    if not list_voices:
+        request_progress.emit(progress_events.CACHE_MISS)
 
-    try:
-        if ttsengine in tts_voiceid and voice_id in tts_voiceid[ttsengine]:
-            tts_client = tts_voiceid[ttsengine][voice_id]
-        else:
-            match ttsengine:
-                case "azureTTS":
-                    tts_client = init_azure_tts()
-                case "googleTTS":
-                    tts_client = init_google_tts()
-                case "sapi5":
-                    tts_client = init_sapi_tts()
-                case "SherpaOnnxTTS":
-                    tts_client = init_onnx_tts()
-                case "googleTransTTS":
-                    tts_client = init_googleTrans_tts()
-                case _:
-                    tts_client = pyttsx3.init(ttsengine)
-    except Exception as e:
-        logging.error(f"Error initializing TTS client: {e}")
-        return
-
-    try:
-        if ttsengine not in tts_voiceid:
-            tts_voiceid[ttsengine] = {voice_id: tts_client}
-        else:
-            if voice_id not in tts_voiceid[ttsengine]:
-                tts_voiceid[ttsengine][voice_id] = tts_client
-    except Exception as e:
-        logging.error(f"Error storing TTS client: {e}")
+    tts_client = get_tts_client(ttsengine, voice_id, context)
+    if tts_client is None:
         return
 
     if list_voices:
         try:
-            voices = tts_client.get_voices()
+            voices = context.voices = tts_client.get_voices()
             return
         except Exception as e:
             logging.error(f"Error getting voices: {e}")
             return
     else:
-        voices = None
+        voices = context.voices = None
 
     try:
         match ttsengine:
             case "azureTTS":
-                if utils.args["style"]:
-                    azureSpeak(
+                if context.args["style"]:
+                    return azureSpeak(
                         text,
                         ttsengine,
                         tts_client,
-                        utils.args["style"],
-                        utils.args["styledegree"],
+                        context.args["style"],
+                        context.args["styledegree"],
+                        context=context,
                     )
                 else:
-                    azureSpeak(text, ttsengine, tts_client)
+                    return azureSpeak(text, ttsengine, tts_client, context=context)
             case "googleTTS":
-                googleSpeak(text, ttsengine, tts_client)
+                return googleSpeak(text, ttsengine, tts_client, context)
             case "sapi5":
-                sapiSpeak(text, ttsengine, tts_client)
+                return sapiSpeak(text, ttsengine, tts_client, context)
             case "SherpaOnnxTTS":
-                onnxSpeak(text, ttsengine, tts_client)
+                return onnxSpeak(text, ttsengine, tts_client, context)
             case "googleTransTTS":
-                googleTransSpeak(text, ttsengine, tts_client)
+                return googleTransSpeak(text, ttsengine, tts_client, context)
             case _:
-                tts_client.setProperty("voice", utils.config.get("TTS", "voiceid"))
-                tts_client.setProperty("rate", utils.config.get("TTS", "rate"))
-                tts_client.setProperty("volume", utils.config.get("TTS", "volume"))
+                tts_client.setProperty("voice", config.get("TTS", "voiceid"))
+                tts_client.setProperty("rate", config.get("TTS", "rate"))
+                tts_client.setProperty("volume", config.get("TTS", "volume"))
+                request_progress.emit(progress_events.SYNTHESIS_STARTED)
+                context.cancel_token.on_cancel(tts_client.stop)
                 tts_client.say(text)
                 tts_client.runAndWait()
+                request_progress.emit(progress_events.PLAYBACK_DONE)
     except Exception as e:
         logging.error(f"Error during TTS processing: {e}")
 
 
-def onnxSpeak(text: str, engine, tts_client):
+def get_tts_client(ttsengine, voice_id, context=None, tts_clients=None):
+    """Return the TTS client of an engine and voice, creating it on first use.
+
+    Args:
+        ttsengine (str): Name of the TTS Engine.
+        voice_id (str): Voice of the TTS Engine.
+        context (RequestContext): Context of the request, the state set by init() if None.
+        tts_clients (dict): Clients to take it from, context.tts_clients if None.
+    Returns: TTS client, None if it could not be created.
+    """
+    context = context or global_context()
+    if tts_clients is None:
+        tts_clients = context.tts_clients
+    config = context.config
+    try:
+        if ttsengine in tts_clients and voice_id in tts_clients[ttsengine]:
+            return tts_clients[ttsengine][voice_id]
+        with context.progress.trace.span(ENGINE_INIT):
+            match ttsengine:
+                case "azureTTS":
+                    tts_client = init_azure_tts(config)
+                case "googleTTS":
+                    tts_client = init_google_tts(config)
+                case "sapi5":
+                    tts_client = init_sapi_tts(config)
+                case "SherpaOnnxTTS":
+                    tts_client = init_onnx_tts(config)
+                case "googleTransTTS":
+                    tts_client = init_googleTrans_tts(config)
+                case _:
+                    tts_client = pyttsx3.init(ttsengine)
+    except Exception as e:
+        logging.error(f"Error initializing TTS client: {e}")
+        return None
+
+    try:
+        if ttsengine not in tts_clients:
+            tts_clients[ttsengine] = {voice_id: tts_client}
+        else:
+            tts_clients[ttsengine][voice_id] = tts_client
+    except Exception as e:
+        logging.error(f"Error storing TTS client: {e}")
+        return None
+    return tts_client
+
+
+def configured_voice(config):
+    """Return the TTS engine and voice id of a config.
+
+    Args:
+        config: Configuration of the request.
+    Returns:
+        tuple: (engine, voice id)
+    """
+    ttsengine = config.get("TTS", "engine")
+    voice_id = config.get(ttsengine, "voiceid", fallback="")
+    if not voice_id:
+        voice_id = config.get("TTS", "voiceid")
+    return ttsengine, voice_id
+
+
+def can_render_ahead(context):
+    """Whether text can be synthesized into the audio cache while other audio plays.
+
+    pyttsx3 engines run one loop at a time, and the mp3 files of GoogleTransTTS
+    cannot be played by utils.play_audio, so those are only spoken directly.
+
+    Args:
+        context (RequestContext): Context of the request.
+    Returns: bool
+    """
+    tts_client = get_tts_client(*configured_voice(context.config), context)
+    return isinstance(tts_client, AbstractTTS) and not isinstance(
+        tts_client, GoogleTransTTS
+    )
+
+
+def render(text="", context=None, cache=True):
+    """Synthesize text into the audio cache without playing it, so that speaking it
+    later is a cache hit. Used by batch requests to pre-render phrases and by the
+    pipeline to render the next text while one plays. The texts are synthesized
+    with the RENDER_CLIENTS, never with a client speak() may be using on the
+    playback thread, in the same SSML and style speak() would use.
+
+    Args:
+        text (str): String to be synthesized by the configured TTS Engine.
+        context (RequestContext): Context of the request, the state set by init() if None.
+        cache (bool): Add the audio to the audio cache. Otherwise it is written to
+            a temporary file, which the caller deletes once it was played.
+    Returns:
+        tuple: (audio file path, True if the text was already cached)
+    """
+    context = context or global_context()
+    request_progress = context.progress
+    ttsengine, voice_id = configured_voice(context.config)
+
+    with request_progress.trace.span(CACHE_LOOKUP):
+        file = utils.check_history(text, context)
+    if file is not None and os.path.isfile(file):
+        request_progress.emit(progress_events.CACHE_HIT)
+        return file, True
+    request_progress.emit(progress_events.CACHE_MISS)
+
+    with render_lock:
+        tts_client = get_tts_client(
+            ttsengine,
+            voice_id,
+            context,
+            context.tts_clients.setdefault(RENDER_CLIENTS, {}),
+        )
+        if tts_client is None:
+            raise RuntimeError(f"Could not initialize TTS engine {ttsengine}.")
+        request_progress.emit(progress_events.SYNTHESIS_STARTED)
+        if isinstance(tts_client, AbstractTTS):
+            fmt = "mp3" if isinstance(tts_client, GoogleTransTTS) else "wav"
+            ssml = wrap_ssml(styled_text(text, ttsengine, context), tts_client)
+            file = utils.render_audio(
+                text, ttsengine, fmt, tts_client, context, ssml=ssml, cache=cache
+            )
+        else:
+            # pyttsx3 engines write the file on runAndWait
+            if cache:
+                file = utils.new_audio_file("wav", context)
+            else:
+                file = utils.temp_audio_file("wav")
+            tts_client.save_to_file(text, file)
+            tts_client.runAndWait()
+            if cache:
+                utils.add_history(text, file, ttsengine, context)
+    # The whole file is the first audio of a rendered text
+    request_progress.trace.end(FIRST_BYTE)
+    if cache:
+        logging.info(f"Speech synthesized for text [{text}] saved in cache.")
+    else:
+        logging.info(f"Speech synthesized for text [{text}] into {file}.")
+    return file, False
+
+
+def styled_text(text, ttsengine, context):
+    """Text as speak() passes it to the engine: in the SSML of the style of the
+    request for azureTTS.
+
+    Args:
+        text (str): String to be spoken.
+        ttsengine (str): Name of the TTS Engine.
+        context (RequestContext): Context of the request.
+    Returns: str
+    """
+    args = context.args or {}
+    if ttsengine != "azureTTS" or not args.get("style"):
+        return text
+    return style_ssml(text, args["style"], args.get("styledegree"))
+
+
+def style_ssml(text, style, styledegree=None):
+    """Wrap text in the SSML of an Azure speaking style, unless the style is not
+    one of VALID_STYLES.
+
+    Args:
+        text (str): String to be spoken.
+        style (str): Speaking style.
+        styledegree (float): Intensity of the style.
+    Returns: str
+    """
+    if style not in VALID_STYLES:
+        return text
+    ssml = f'<mstts:express-as style="{style}"'
+    if styledegree:
+        ssml += f' styledegree="{styledegree}"'
+    return ssml + f">{text}</mstts:express-as>"
+
+
+def wrap_ssml(text, tts):
+    """Text as ttsWrapperSpeak passes it to tts: in the SSML document of the
+    engines that take SSML.
+
+    Args:
+        text (str): String to be spoken.
+        tts: Instance of TTS Engine.
+    Returns: str
+    """
+    match tts:
+        case SherpaOnnxTTS() | GoogleTransTTS():
+            return text
+        case AbstractTTS():
+            tts.ssml.clear_ssml()
+            return tts.ssml.add(text)
+    return text
+
+
+def onnxSpeak(text: str, engine, tts_client, context=None):
     """This function received the input parameters and make necessary modification (if needed). Then, those parameter
     will be pass to ttsWrapperSpeak.
 
@@ -296,14 +519,20 @@ def onnxSpeak(text: str, engine, tts_client):
         text (str): String to be spoken by the TTS Engine.
         engine (str): Name of the TTS Engine.
         tts_client: Instance of TTS Engine.
-    Returns: None
+        context (RequestContext): Context of the request.
+    Returns: Thread streaming the speech, see ttsWrapperSpeak
     """
 
-    ttsWrapperSpeak(text, tts_client, engine)
+    return ttsWrapperSpeak(text, tts_client, engine, context)
 
 
 def azureSpeak(
-    text: str, engine, tts_client, style: str = None, styledegree: float = None
+    text: str,
+    engine,
+    tts_client,
+    style: str = None,
+    styledegree: float = None,
+    context=None,
 ):
     """This function received the input parameters and make necessary modification (if needed). Then, those parameter
     will be pass to ttsWrapperSpeak.
@@ -314,28 +543,15 @@ def azureSpeak(
         tts_client: Instance of TTS Engine.
         style (str): Set the SSML style format and wrap the text string.
         styledegree (float): Set the SSML style degree format and wrap the text string.
-    Returns: None
+        context (RequestContext): Context of the request.
+    Returns: Thread streaming the speech, see ttsWrapperSpeak
     """
-
-    if style:
-        # Check if the provided style is in the valid styles array
-        if style in VALID_STYLES:
-            # Construct SSML with the specified style
-            ssml = f'<mstts:express-as style="{style}"'
-            if styledegree:
-                ssml += f' styledegree="{styledegree}"'
-            ssml += f">{text}</mstts:express-as>"
-        else:
-            # Style is not valid, use default SSML without style
-            ssml = text
-    else:
-        # Use default SSML without style
-        ssml = text
-
-    ttsWrapperSpeak(ssml, tts_client, engine)
+    # Without a valid style the text is spoken in the default style
+    ssml = style_ssml(text, style, styledegree) if style else text
+    return ttsWrapperSpeak(ssml, tts_client, engine, context)
 
 
-def googleSpeak(text: str, engine, tts_client):
+def googleSpeak(text: str, engine, tts_client, context=None):
     """This function received the input parameters and make necessary modification (if needed). Then, those parameter
     will be pass to ttsWrapperSpeak.
 
@@ -343,12 +559,13 @@ def googleSpeak(text: str, engine, tts_client):
         text (str): String to be spoken by the TTS Engine.
         engine (str): Name of the TTS Engine.
         tts_client: Instance of TTS Engine.
-    Returns: None
+        context (RequestContext): Context of the request.
+    Returns: Thread streaming the speech, see ttsWrapperSpeak
     """
-    ttsWrapperSpeak(text, tts_client, engine)
+    return ttsWrapperSpeak(text, tts_client, engine, context)
 
 
-def googleTransSpeak(text: str, engine, tts_client):
+def googleTransSpeak(text: str, engine, tts_client, context=None):
     """This function received the input parameters and make necessary modification (if needed). Then, those parameter
     will be pass to ttsWrapperSpeak.
 
@@ -356,12 +573,13 @@ def googleTransSpeak(text: str, engine, tts_client):
         text (str): String to be spoken by the TTS Engine.
         engine (str): Name of the TTS Engine.
         tts_client: Instance of TTS Engine.
-    Returns: None
+        context (RequestContext): Context of the request.
+    Returns: Thread streaming the speech, see ttsWrapperSpeak
     """
-    ttsWrapperSpeak(text, tts_client, engine)
+    return ttsWrapperSpeak(text, tts_client, engine, context)
 
 
-def sapiSpeak(text: str, engine, tts_client):
+def sapiSpeak(text: str, engine, tts_client, context=None):
     """This function received the input parameters and make necessary modification (if needed). Then, those parameter
     will be pass to ttsWrapperSpeak.
 
@@ -369,12 +587,13 @@ def sapiSpeak(text: str, engine, tts_client):
         text (str): String to be spoken by the TTS Engine.
         engine (str): Name of the TTS Engine.
         tts_client: Instance of TTS Engine.
-    Returns: None
+        context (RequestContext): Context of the request.
+    Returns: Thread streaming the speech, see ttsWrapperSpeak
     """
-    ttsWrapperSpeak(text, tts_client, engine)
+    return ttsWrapperSpeak(text, tts_client, engine, context)
 
 
-def ttsWrapperSpeak(text: str, tts, engine):
+def ttsWrapperSpeak(text: str, tts, engine, context=None):
     """This function identifies the TTS Instance and set format of the text and audio format.
     Then, create a Thread that synthesize text to audio.
 
@@ -382,25 +601,56 @@ def ttsWrapperSpeak(text: str, tts, engine):
         text (str): String to be spoken by the TTS Engine.
         tts: Instance of TTS Engine.
         engine (str): Name of the TTS Engine.
-    Returns: None
+        context (RequestContext): Context of the request, the state set by init() if None.
+    Returns:
+        Thread: Thread streaming the speech, None if it could not be started.
     """
-    fmt = "wav"
-    match tts:
-        case SherpaOnnxTTS():
-            pass
-        case GoogleTransTTS():
-            fmt = "mp3"
-        case AbstractTTS():
-            tts.ssml.clear_ssml()
-            text = tts.ssml.add(text)
+    context = context or global_context()
+    fmt = "mp3" if isinstance(tts, GoogleTransTTS) else "wav"
+    text = wrap_ssml(text, tts)
     try:
-        playText = Thread(target=playSpeech, args=(text, engine, fmt, tts))
+        playText = Thread(target=playSpeech, args=(text, engine, fmt, tts, context))
         playText.start()
+        return playText
     except Exception as e:
         print(e)
+        return None
+
+
+def watch_first_audio(tts, request_progress):
+    """Emit the first_audio event of a request when tts starts playing.
+
+    TTS clients are cached across requests, so the onStart callback is connected
+    once and reports to whichever request the client is currently speaking.
+
+    Args:
+        tts: Instance of TTS Engine.
+        request_progress (Progress): Progress events of the request.
+    Returns: None
+    """
+    if not hasattr(tts, "connect"):
+        return
+    if not hasattr(tts, "request_progress"):
+        tts.connect(
+            "onStart", lambda: tts.request_progress.emit(progress_events.FIRST_AUDIO)
+        )
+    tts.request_progress = request_progress
 
 
-def playSpeech(text, engine, file_format, tts):
+def stop_playback(tts):
+    """Stop the audio tts is streaming.
+
+    Args:
+        tts: Instance of TTS Engine.
+    Returns: None
+    """
+    if hasattr(tts, "stop_audio"):
+        tts.stop_audio()
+    else:
+        logging.warning(f"{type(tts).__name__} cannot be stopped while playing.")
+
+
+def playSpeech(text, engine, file_format, tts, context=None):
     """This function is run by a Thread which synthesize text to audio.
     While audio is streaming, the audio is also saving in parallel.
 
@@ -409,23 +659,39 @@ def playSpeech(text, engine, file_format, tts):
         engine (str): Name of the TTS Engine.
         file_format (str): Audio Format.
         tts: Instance of TTS Engine.
+        context (RequestContext): Context of the request, the state set by init() if None.
     Returns: None
     """
-    global ready
-    ready = False  # Start in an unready state
+    context = context or global_context()
+    request_progress = context.progress
+    request_cancel_token = context.cancel_token
 
     start = time.perf_counter()
+    request_progress.emit(progress_events.SYNTHESIS_STARTED)
     try:
-        save_audio_file = utils.config.getboolean("TTS", "save_audio_file")
+        request_cancel_token.raise_if_cancelled()
+        request_cancel_token.on_cancel(lambda: stop_playback(tts))
+        watch_first_audio(tts, request_progress)
+        save_audio_file = context.config.getboolean("TTS", "save_audio_file")
         if save_audio_file:
-            utils.save_audio(text=text, engine=engine, file_format=file_format, tts=tts)
+            utils.save_audio(
+                text=text,
+                engine=engine,
+                file_format=file_format,
+                tts=tts,
+                context=context,
+            )
             logging.info(f"Speech synthesized for text [{text}] saved in cache.")
         else:
             tts.speak_streamed(text)
+    except Cancelled:
+        logging.info(f"Speech for text [{text}] was cancelled.")
+        return
     except Exception as e:
         logging.error(f"Error during TTS processing: {e}")
+        request_progress.emit(progress_events.ERROR, error=str(e))
         return
     finally:
         stop = time.perf_counter() - start
         logging.info(f"Speech synthesis runtime is {stop:0.5f} seconds.")
-        ready = True  # Ensure ready is set to True even after an exception
+        request_progress.emit(progress_events.PLAYBACK_DONE)
@@ -6,13 +6,11 @@ import time
 import io
 import uuid
 import posthog
-from PySide6.QtWidgets import *
-from PySide6.QtCore import *
 import sqlite3
 import wave
 import pyaudio
+import threading
 import warnings
-from GUI_TranslateAndTTS import resources_rc
 import tempfile
 
 warnings.filterwarnings("ignore")
@@ -23,9 +21,37 @@ args = {
     "style": "",
     "styledegree": None,
 }
+# Compatibility shims: the config, args and paths of the last request passed to
+# init(). Functions taking a request context only fall back to these without one.
 config_path = None
 audio_files_path = None
 config = None
+# Properties of the last "App Run" event, sent again only when they change
+app_run_properties = None
+# Directories get_paths already made sure exist
+created_directories = set()
+# Seconds after which the idle PyAudio instance is replaced by a new one, so that
+# audio devices plugged in or made the default since are used
+AUDIO_DEVICE_REFRESH = float(os.environ.get("AACSPEAKHELPER_AUDIO_DEVICE_REFRESH", 30))
+# PyAudio instance shared by every playback, see open_audio_device()
+audio_device = None
+audio_device_lock = threading.Lock()
+# Streams open on audio_device and when the last one closed, it is only replaced
+# while none is open
+audio_device_streams = 0
+audio_device_used = 0.0
+# Replaces the idle audio_device every AUDIO_DEVICE_REFRESH seconds
+audio_device_refresher = None
+
+
+def request_context(context=None):
+    """The request context to use, this module's globals when context is None.
+
+    Args:
+        context (RequestContext): Context of the current request.
+    Returns: RequestContext or this module
+    """
+    return context if context is not None else sys.modules[__name__]
 
 
 def ynbox(message: str, header: str, timeout: int = 10000):
@@ -37,6 +63,11 @@ def ynbox(message: str, header: str, timeout: int = 10000):
         timeout (int): Time in milliseconds will take for the QMessageBox to close without user interaction.
     Returns: bool
     """
+    # Imported here so that the headless daemon never loads Qt
+    from PySide6.QtWidgets import QMessageBox
+    from PySide6.QtCore import QTimer
+    from GUI_TranslateAndTTS import resources_rc
+
     try:
 
         ynInstance = QMessageBox(None)
@@ -63,6 +94,10 @@ def msgbox(message: str, header: str, timeout: int = 10000):
         timeout (int): Time in milliseconds will take for the QMessageBox to close without user interaction.
     Returns: bool
     """
+    from PySide6.QtWidgets import QMessageBox
+    from PySide6.QtCore import QTimer
+    from GUI_TranslateAndTTS import resources_rc
+
     try:
         msgInstance = QMessageBox(None)
         msgInstance.setWindowTitle(header)
@@ -127,48 +162,143 @@ def get_paths(configuration_path=None):
         configuration_path = os.path.join(application_path, "settings.cfg")
 
     # Ensure the audio files directory exists
-    os.makedirs(audio_files_path, exist_ok=True)
+    if audio_files_path not in created_directories:
+        os.makedirs(audio_files_path, exist_ok=True)
+        created_directories.add(audio_files_path)
 
     return configuration_path, audio_files_path
 
 
-def play_audio(audio_bytes, file: bool = False):
+def play_audio(audio_bytes, file: bool = False, cancel_token=None):
     if file:
         with wave.open(audio_bytes, "rb") as wf:
-            play_wave(wf)
+            play_wave(wf, cancel_token)
     else:
         with wave.open(io.BytesIO(audio_bytes), "rb") as wf:
-            play_wave(wf)
+            play_wave(wf, cancel_token)
 
 
-def play_wave(wf):
-    p = pyaudio.PyAudio()
+def open_audio_device():
+    """Initialize PortAudio on first use and return the PyAudio instance every
+    playback shares, so that the audio devices are not enumerated again for each
+    utterance.
 
-    def callback(in_data, frame_count, time_info, status):
-        data = wf.readframes(frame_count)
-        return data, pyaudio.paContinue
-
-    stream = p.open(
-        format=p.get_format_from_width(wf.getsampwidth()),
-        channels=wf.getnchannels(),
-        rate=wf.getframerate(),
-        output=True,
-        stream_callback=callback,
-    )
-
-    stream.start_stream()
-
-    while stream.is_active():
-        pass
+    PortAudio only sees the devices present when it was initialized, so a
+    background thread replaces the instance with a new one once it has been idle
+    for AUDIO_DEVICE_REFRESH seconds, and play_wave replaces it when it cannot
+    open a stream on it. Playback does not wait for either.
+    Returns: pyaudio.PyAudio
+    """
+    global audio_device, audio_device_used, audio_device_refresher
+    with audio_device_lock:
+        if audio_device is None:
+            audio_device = pyaudio.PyAudio()
+            audio_device_used = time.monotonic()
+        if audio_device_refresher is None:
+            audio_device_refresher = threading.Thread(
+                target=refresh_audio_device, name="AudioDevice", daemon=True
+            )
+            audio_device_refresher.start()
+        return audio_device
 
-    stream.stop_stream()
-    stream.close()
-    wf.close()
 
-    p.terminate()
+def reset_audio_device(device):
+    """Terminate a PyAudio instance that failed, the next playback initializes
+    PortAudio again.
+    Args:
+        device (pyaudio.PyAudio): Instance returned by open_audio_device().
+    Returns: None
+    """
+    global audio_device
+    with audio_device_lock:
+        if audio_device is not device:
+            return
+        audio_device = None
+        if audio_device_streams == 0:
+            device.terminate()
+
+
+def refresh_audio_device():
+    """Replace the PyAudio instance whenever it has been idle for
+    AUDIO_DEVICE_REFRESH seconds."""
+    global audio_device, audio_device_used
+    while True:
+        time.sleep(AUDIO_DEVICE_REFRESH)
+        with audio_device_lock:
+            idle = time.monotonic() - audio_device_used
+            if (
+                audio_device is None
+                or audio_device_streams
+                or idle < AUDIO_DEVICE_REFRESH
+            ):
+                continue
+            try:
+                audio_device.terminate()
+                audio_device = pyaudio.PyAudio()
+            except Exception as e:
+                logging.error(f"Could not initialize the audio device: {e}")
+                audio_device = None
+            audio_device_used = time.monotonic()
+
+
+def play_wave(wf, cancel_token=None):
+    """Play a wave file, stopping within a buffer when cancel_token is cancelled.
+    Args:
+        wf: Opened wave file.
+        cancel_token (CancelToken): Stops playback when cancelled.
+    Returns: None
+    """
+    global audio_device_streams, audio_device_used
 
+    def callback(in_data, frame_count, time_info, status):
+        if cancel_token is not None and cancel_token.cancelled:
+            return b"", pyaudio.paComplete
+        data = wf.readframes(frame_count)
+        return data, pyaudio.paContinue
 
-def save_audio(text: str, engine: str, file_format: str = "wav", tts=None):
+    for attempt in range(2):
+        p = open_audio_device()
+        try:
+            stream = p.open(
+                format=p.get_format_from_width(wf.getsampwidth()),
+                channels=wf.getnchannels(),
+                rate=wf.getframerate(),
+                output=True,
+                stream_callback=callback,
+            )
+            break
+        except OSError as e:
+            if attempt:
+                raise
+            # The device it knows may have gone away
+            logging.warning(f"Could not open audio stream, initializing again: {e}")
+            reset_audio_device(p)
+
+    with audio_device_lock:
+        audio_device_streams += 1
+    try:
+        stream.start_stream()
+
+        while stream.is_active():
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            time.sleep(0.01)
+
+        stream.stop_stream()
+        stream.close()
+    except OSError:
+        reset_audio_device(p)
+        raise
+    finally:
+        with audio_device_lock:
+            audio_device_streams -= 1
+            audio_device_used = time.monotonic()
+        wf.close()
+
+
+def save_audio(
+    text: str, engine: str, file_format: str = "wav", tts=None, context=None
+):
     """Save text as audio file with specific file format then save this text and audio file name in the database.
     If text is synthesize again, it will be find first in the database if there is a match.
     Args:
@@ -176,17 +306,87 @@ def save_audio(text: str, engine: str, file_format: str = "wav", tts=None):
         engine (str): Name of the TTS Engine
         file_format (str): File Format of the Audio e.g. 'wav' or 'mp3'
         tts: Instance of TTS Engine
+        context (RequestContext): Context of the current request.
     Returns: None
     """
-    timestr = time.strftime("%Y%m%d-%H%M%S.")
-    filename = os.path.join(audio_files_path, timestr + file_format)
+    filename = new_audio_file(file_format, context)
     tts.speak_streamed(text, save_to_file_path=filename, audio_format=file_format)
-    sql = "INSERT INTO History(text, filename, engine) VALUES('{}','{}','{}')".format(
-        text, filename, engine
+    add_history(text, filename, engine, context)
+
+
+def render_audio(
+    text: str,
+    engine: str,
+    file_format: str = "wav",
+    tts=None,
+    context=None,
+    ssml: str = None,
+    cache: bool = True,
+):
+    """Synthesize text to an audio file in the cache without playing it, so a later
+    request for the same text is played from the cache.
+    Args:
+        text (str): Text String
+        engine (str): Name of the TTS Engine
+        file_format (str): File Format of the Audio e.g. 'wav' or 'mp3'
+        tts: Instance of TTS Engine
+        context (RequestContext): Context of the current request.
+        ssml (str): What tts synthesizes for text, text itself if None.
+        cache (bool): Add the file to the cache, otherwise it is a temporary file
+            the caller deletes.
+    Returns: str
+    """
+    if cache:
+        filename = new_audio_file(file_format, context)
+    else:
+        filename = temp_audio_file(file_format)
+    tts.synth_to_file(ssml or text, filename, file_format)
+    if cache:
+        add_history(text, filename, engine, context)
+    return filename
+
+
+def new_audio_file(file_format: str = "wav", context=None):
+    """Return a new file path in the audio cache. The random suffix keeps files
+    apart when several are saved within the same second.
+    Args:
+        file_format (str): File Format of the Audio e.g. 'wav' or 'mp3'
+        context (RequestContext): Context of the current request.
+    Returns: str
+    """
+    timestr = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(
+        request_context(context).audio_files_path,
+        f"{timestr}-{uuid.uuid4().hex[:8]}.{file_format}",
     )
+
+
+def temp_audio_file(file_format: str = "wav"):
+    """Return the path of a new empty file in the temp directory, for audio that is
+    played once and not cached.
+    Args:
+        file_format (str): File Format of the Audio e.g. 'wav' or 'mp3'
+    Returns: str
+    """
+    descriptor, filename = tempfile.mkstemp(suffix=f".{file_format}")
+    os.close(descriptor)
+    return filename
+
+
+def add_history(text: str, filename: str, engine: str, context=None):
+    """Save text and its audio file name in the cache database.
+    Args:
+        text (str): Text String
+        filename (str): Path of the audio file
+        engine (str): Name of the TTS Engine
+        context (RequestContext): Context of the current request.
+    Returns: None
+    """
+    sql = "INSERT INTO History(text, filename, engine) VALUES(?, ?, ?)"
+    directory = request_context(context).audio_files_path
     try:
-        connection = sqlite3.connect(os.path.join(audio_files_path, "cache_history.db"))
-        connection.execute(sql)
+        connection = sqlite3.connect(os.path.join(directory, "cache_history.db"))
+        connection.execute(sql, (text, filename, engine))
         connection.commit()
         connection.close()
     except Exception as error:
@@ -242,22 +442,25 @@ def notify_posthog(id: str, event_name: str, properties: dict = {}):
         pass
 
 
-def check_history(text: str):
+def check_history(text: str, context=None):
     """Check for a matching string in the database and return the file path.
     If no database was found, the function will call the create_Database function and return None
     Args:
         text (str): Text to be match in the database
+        context (RequestContext): Context of the current request.
     Returns: str
     """
+    context = request_context(context)
+    audio_files_path = context.audio_files_path
     try:
-        if args["style"]:
+        if context.args["style"]:
             return None
         if os.path.isfile(os.path.join(audio_files_path, "cache_history.db")):
-            sql = "SELECT filename FROM History WHERE text='{}'".format(text)
+            sql = "SELECT filename FROM History WHERE text=?"
             connection = sqlite3.connect(
                 os.path.join(audio_files_path, "cache_history.db")
             )
-            cursor = connection.execute(sql)
+            cursor = connection.execute(sql, (text,))
             results = cursor.fetchone()
             base_name = results[0] if results is not None else None
             if base_name is not None:
@@ -267,7 +470,7 @@ def check_history(text: str):
             else:
                 return None
         else:
-            create_Database()
+            create_Database(context)
             return None
     except Exception as error:
         logging.error("Failed to connect to database: ".format(error), exc_info=True)
@@ -299,11 +502,14 @@ def clear_history(files: list):
         return None
 
 
-def create_Database():
+def create_Database(context=None):
     """If no database was found, this function will create database function.
 
+    Args:
+        context (RequestContext): Context of the current request.
     Returns: None
     """
+    audio_files_path = request_context(context).audio_files_path
     try:
         if not os.path.isfile(os.path.join(audio_files_path, "cache_history.db")):
             sql1 = """CREATE TABLE IF NOT EXISTS "History" ("id"	INTEGER NOT NULL UNIQUE,
@@ -328,36 +534,141 @@ def create_Database():
         logging.error("Failed to create database: ".format(error), exc_info=True)
 
 
-def init(input_config, args):
+def remove_stale_temp_files(directory_path, ignore_pattern=".db"):
+    """Remove cached audio files older than the appCache threshold (in days) and
+    their entries in the cache database.
+
+    Args:
+        directory_path (str): Audio files directory.
+        ignore_pattern (str): Suffix of files to keep.
+    Returns: None
+    """
+    start = time.perf_counter()
+    current_time = time.time()
+    day = int(config.get("appCache", "threshold"))
+    time_threshold = current_time - day * 24 * 60 * 60
+    file_list = []
+
+    for root, dirs, files in os.walk(directory_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if ignore_pattern and (
+                file.endswith(ignore_pattern) or file.endswith(".db-journal")
+            ):
+                continue
+            try:
+                file_modification_time = os.path.getmtime(file_path)
+                if file_modification_time < time_threshold:
+                    os.remove(file_path)
+                    file_list.append(os.path.basename(file_path))
+                    logging.info(f"Removed cache file: {file_path}")
+            except Exception as e:
+                logging.error(f"Error processing file {file_path}: {e}", exc_info=True)
+
+    stop = time.perf_counter() - start
+    clear_history(file_list)
+    logging.info(f"Cache clearing took {stop:0.5f} seconds.")
+
+
+def cache_stats(directory_path=None):
+    """Count the audio files in the cache and the texts in the cache database.
+
+    Args:
+        directory_path (str): Audio files directory, the default one if None.
+    Returns: dict
+    """
+    if directory_path is None:
+        _, directory_path = get_paths()
+    files = 0
+    size = 0
+    for root, dirs, names in os.walk(directory_path):
+        for name in names:
+            if name.endswith((".db", ".db-journal")):
+                continue
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    entries = 0
+    database = os.path.join(directory_path, "cache_history.db")
+    if os.path.isfile(database):
+        try:
+            connection = sqlite3.connect(database)
+            entries = connection.execute("SELECT COUNT(*) FROM History").fetchone()[0]
+            connection.close()
+        except Exception as error:
+            logging.error(f"Failed to read cache database: {error}")
+    return {"audio_files": files, "audio_bytes": size, "history_entries": entries}
+
+
+def clearCache():
+    """Remove small tmp files older than a week from the temp directory.
+
+    Returns: None
+    """
+    temp_folder = os.getenv("TEMP") or tempfile.gettempdir()
+    size_limit = 5 * 1024  # 5KB in bytes
+    # Scan the directory
+    for root, dirs, files in os.walk(temp_folder):
+        for file in files:
+            if file.startswith("tmp"):
+                file_path = os.path.join(root, file)
+                if os.path.getsize(file_path) < size_limit:
+                    current_time = time.time()
+                    day = 7
+                    time_threshold = current_time - day * 24 * 60 * 60
+                    file_modification_time = os.path.getmtime(file_path)
+                    if file_modification_time < time_threshold:
+                        os.remove(file_path)
+
+
+def init(input_config, input_args):
     """Initialize configuration file path making it in memory instead of one time instance.
 
+    Only what differs from the config of the previous call is updated: the paths
+    when they changed, and the "App Run" event is only sent again when the
+    languages or the engine changed. Calling it again with the same config only
+    sets the args.
+
     Args:
         input_config: configuration file path.
+        input_args (dict): Arguments of the request.
     Returns: None
     """
 
     global config_path
     global audio_files_path
     global config
+    global args
+    global app_run_properties
 
-    config_path = input_config["App"]["config_path"]
-    audio_files_path = input_config["App"]["audio_files_path"]
+    previous = config
     config = (
         input_config  # This assigns the passed config to the global config variable
     )
+    args = input_args
+    if config is previous:
+        return
 
-    logging.info(f"Initialized utils with config path: {config_path}")
-    logging.info(f"Audio files path: {audio_files_path}")
+    paths = (config["App"]["config_path"], config["App"]["audio_files_path"])
+    if paths != (config_path, audio_files_path):
+        config_path, audio_files_path = paths
+        logging.info(f"Initialized utils with config path: {config_path}")
+        logging.info(f"Audio files path: {audio_files_path}")
 
     if config.getboolean("App", "collectstats"):
+        run_properties = {
+            "fromLang": config.get("translate", "startlang"),
+            "toLang": config.get("translate", "endlang"),
+            "ttsengine": config.get("TTS", "engine"),
+        }
+        if run_properties == app_run_properties:
+            return
+        app_run_properties = run_properties
         distinct_id = get_uuid()
         event_name = "App Run"
         event_properties = {
             "uuid": distinct_id,
             "source": "helperApp",
             "version": 2.4,
-            "fromLang": config.get("translate", "startlang"),
-            "toLang": config.get("translate", "endlang"),
-            "ttsengine": config.get("TTS", "engine"),
+            **run_properties,
         }
         notify_posthog(distinct_id, event_name, event_properties)
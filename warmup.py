@@ -0,0 +1,90 @@
+import logging
+import os
+import tempfile
+import time
+
+from tts_wrapper import AbstractTTS, GoogleTransTTS
+
+import translate_utils
+import tts_utils
+import utils
+
+# Parts of a warm-up, in the order they are done
+AUDIO_DEVICE = "audio_device"
+TRANSLATOR = "translator"
+ENGINE = "engine"
+PROBE = "probe"
+# Text the probe synthesizes into a temporary file, which is never played
+PROBE_TEXT = "Hello"
+
+
+def load_engine(context):
+    """Create the TTS client of the configured engine and voice, or get it from
+    context.tts_clients when it was already created."""
+    ttsengine, voice_id = tts_utils.configured_voice(context.config)
+    tts_client = tts_utils.get_tts_client(ttsengine, voice_id, context)
+    if tts_client is None:
+        raise RuntimeError(f"Could not initialize TTS engine {ttsengine}.")
+    return tts_client
+
+
+def synthesize_probe(context):
+    """Synthesize PROBE_TEXT with the configured voice into a temporary file and
+    delete it, without playing it or adding it to the audio cache."""
+    tts_client = load_engine(context)
+    fmt = "mp3" if isinstance(tts_client, GoogleTransTTS) else "wav"
+    descriptor, file = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(descriptor)
+    try:
+        if isinstance(tts_client, AbstractTTS):
+            tts_client.synth_to_file(PROBE_TEXT, file, fmt)
+        else:
+            # pyttsx3 engines write the file on runAndWait
+            tts_client.save_to_file(PROBE_TEXT, file)
+            tts_client.runAndWait()
+    finally:
+        os.remove(file)
+
+
+def warm_up(context, probe=False):
+    """Build what the first request of a config would otherwise wait for: the audio
+    device, the translator in the translator pool and the TTS client of the
+    configured voice.
+
+    The TTS client is stored in context.tts_clients, the clients of the config
+    entry, which tts_utils.init makes tts_utils.tts_voiceid once a request uses
+    the config. A part that fails is logged and reported, the others are still
+    warmed up.
+
+    Args:
+        context (RequestContext): Context with the config to warm up.
+        probe (bool): Also synthesize a short text that is not played, for engines
+            that only load their voice model on the first synthesis.
+    Returns:
+        dict: {"timings": seconds each part took and the "total",
+        "errors": error of each part that failed}
+    """
+    config = context.config
+    parts = [(AUDIO_DEVICE, utils.open_audio_device)]
+    if not config.getboolean("translate", "noTranslate", fallback=False):
+        parts.append((TRANSLATOR, lambda: translate_utils.pool.prepare(config)))
+    if not config.getboolean("TTS", "bypass_tts", fallback=False):
+        parts.append((ENGINE, lambda: load_engine(context)))
+        if probe:
+            parts.append((PROBE, lambda: synthesize_probe(context)))
+
+    timings = {}
+    errors = {}
+    start = time.perf_counter()
+    for name, part in parts:
+        part_start = time.perf_counter()
+        try:
+            part()
+        except Exception as e:
+            logging.error(f"Warm-up of the {name} failed: {e}", exc_info=True)
+            errors[name] = str(e)
+        timings[name] = time.perf_counter() - part_start
+    details = ", ".join(f"{name} {seconds:0.3f}" for name, seconds in timings.items())
+    timings["total"] = time.perf_counter() - start
+    logging.info(f"Warm-up took {timings['total']:0.3f} seconds ({details}).")
+    return {"timings": timings, "errors": errors}